@@ -8,11 +8,17 @@ import hashlib
 import os
 import re
 import shutil
+import sys
 import textwrap
 import time
 
 from Bio import Entrez
 
+# seq_io is shared with the scripts in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'scripts'))
+import seq_io
+
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 
@@ -406,17 +412,15 @@ def merge_with_extra_sequences(dataset, sequences, extra_sequences_path,
             # (i.e., are needed to be copied)
             acc_nums_needed = set()
             num_sequences = 0
-            with open(os.path.join(extra_sequences_path, fn)) as f:
-                for line in f:
-                    if line.startswith('>'):
-                        header = line.rstrip()[1:]
-                        acc_num = extract_accession_num_from_header(header)
-                        if (acc_num not in acc_nums_present and
-                                acc_num.split('.')[0] not in acc_nums_present):
-                            # acc_num nor the num without the verison number
-                            # is already present, so we need it
-                            acc_nums_needed.add(acc_num)
-                        num_sequences += 1
+            for header in seq_io.iterate_fasta_headers(
+                    os.path.join(extra_sequences_path, fn)):
+                acc_num = extract_accession_num_from_header(header)
+                if (acc_num not in acc_nums_present and
+                        acc_num.split('.')[0] not in acc_nums_present):
+                    # acc_num nor the num without the verison number
+                    # is already present, so we need it
+                    acc_nums_needed.add(acc_num)
+                num_sequences += 1
 
             num_needed = len(acc_nums_needed)
             if num_needed == 0:
@@ -0,0 +1,15 @@
+#!/bin/bash
+
+# Benchmark the optimizer of find_optimal_params.py on synthetic probe
+# counts, comparing against the saved baseline if there is one
+# Usage: ./run.sh [--save_baseline baseline.tsv]
+# baseline.tsv should be re-saved whenever the optimizer is made faster,
+# so that comparisons against it reflect the current code
+
+SCRIPTS_DIR=../../../scripts
+
+if [ -f baseline.tsv ]; then
+    python3 $SCRIPTS_DIR/benchmark_find_optimal_params.py --baseline baseline.tsv "$@"
+else
+    python3 $SCRIPTS_DIR/benchmark_find_optimal_params.py "$@"
+fi
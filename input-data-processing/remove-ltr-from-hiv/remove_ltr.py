@@ -3,12 +3,15 @@ HIV FASTA sequences.
 """
 
 import argparse
-from collections import OrderedDict
+from os.path import abspath
 from os.path import dirname
 from os.path import join
+import sys
 
 import numpy as np
 
+# seq_io is shared with the scripts in scripts/
+sys.path.insert(0, join(dirname(abspath(__file__)), '..', '..', 'scripts'))
 import seq_io
 
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
@@ -26,8 +29,6 @@ HIV2_LTR3_COORDS = (9504, 10359)
 
 
 def main(args):
-    seqs = seq_io.read_fasta(args.i)
-
     # Find the reference sequence. For HIV-1, the sequence header
     # contains 'reference'; for HIV-2, the sequence header contains
     # 'isolate BEN'
@@ -37,24 +38,24 @@ def main(args):
         ref_search_pattern = 'isolate BEN'
     else:
         raise ValueError("Unknown sequence %s" % args.s)
-    num_with_ref = sum(True if ref_search_pattern in name else False
-                       for name in seqs.keys())
-    assert num_with_ref == 1
-    ref_name = [name for name in seqs.keys() if ref_search_pattern in name][0]
-    ref_seq = seqs[ref_name]
+    # Stream through the input to find the reference, keeping only it
+    # (rather than reading every sequence into memory); this handles any
+    # line wrapping, unlike an index
+    ref_seqs = [seq for name, seq in seq_io.iterate_fasta_records(args.i)
+                if ref_search_pattern in name]
+    assert len(ref_seqs) == 1
+    ref_seq = seq_io.encode_seq(ref_seqs[0])
+
+    # Find the index (i.e., counting gaps) of each non-gap base in the
+    # reference
+    ref_nongap_idx = np.flatnonzero(ref_seq != seq_io.CODE_GAP)
 
     # Find the index end of the 5' LTR (i.e., counting gaps)
     if args.s == 'hiv1':
         ltr_end_bp = HIV1_LTR5_COORDS[1]
     elif args.s == 'hiv2':
         ltr_end_bp = HIV2_LTR5_COORDS[1]
-    bp = 0
-    for i in range(len(ref_seq)):
-        if ref_seq[i] != '-':
-            if bp == ltr_end_bp - 1:
-                ltr_5_end = i + 1
-                break
-            bp += 1
+    ltr_5_end = ref_nongap_idx[ltr_end_bp - 1] + 1
 
     # Find the index start of the 3' LTR (i.e., counting gaps)
     if args.s == 'hiv1':
@@ -63,27 +64,21 @@ def main(args):
         ltr_start_bp = HIV2_LTR3_COORDS[0]
     else:
         raise ValueError("Unknown sequence %s" % args.s)
-    bp = 0
-    for i in range(len(ref_seq)):
-        if ref_seq[i] != '-':
-            if bp == ltr_start_bp:
-                ltr_3_start = i
-                break
-            bp += 1
+    ltr_3_start = ref_nongap_idx[ltr_start_bp]
 
     # Write the sequences without LTRs
-    seqs_no_ltrs = []
-    for name, seq in seqs.items():
-        # Ensure the seq (with gaps) has the same length as the
-        # reference seq
-        assert len(seq) == len(ref_seq)
-        # Remove the LTR by chopping seq (which includes the gap
-        # character '-') to only include ltr_5_end:ltr_3_start
-        seq_no_ltr = seq[ltr_5_end:ltr_3_start]
-        # Remove gaps from the sequence
-        seq_no_ltr = seq_no_ltr.replace('-', '')
-        seqs_no_ltrs += [(name, seq_no_ltr)]
-    seq_io.write_fasta(OrderedDict(seqs_no_ltrs), args.o)
+    def iterate_seqs_no_ltrs():
+        for name, seq in seq_io.iterate_fasta_records(args.i):
+            # Ensure the seq (with gaps) has the same length as the
+            # reference seq
+            assert len(seq) == len(ref_seq)
+            # Remove the LTR by chopping seq (which includes the gap
+            # character '-') to only include ltr_5_end:ltr_3_start
+            seq_no_ltr = seq[ltr_5_end:ltr_3_start]
+            # Remove gaps from the sequence
+            seq_no_ltr = seq_no_ltr.replace('-', '')
+            yield (name, seq_no_ltr)
+    seq_io.write_fasta(iterate_seqs_no_ltrs(), args.o)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
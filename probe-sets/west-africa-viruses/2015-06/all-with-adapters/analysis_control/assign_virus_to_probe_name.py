@@ -1,39 +1,28 @@
+import argparse
 import os
+import sys
 
-DATASETS = [
-            "chikungunya",
-            "crimean_congo",
-            "dengue",
-            "ebola_zaire-with-2014",
-            "ebola_nonzaire",
-            "gbv_c",
-            "hepatitis_a",
-            "hepatitis_c",
-            "hiv1_without_ltr",
-            "hiv2_without_ltr",
-            "influenza",
-            "lassa",
-            "marburg",
-            "measles",
-            "mers",
-            "rhabdovirus",
-            "rift_valley_fever",
-            "sars",
-            "yellow_fever",
-           ]
+# seq_io and registry are shared with the scripts in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..', '..', '..', 'scripts'))
+import registry
+import seq_io
 
-FASTA_RESULT_PATH = "/home/unix/hmetsky/viral/viral-work/results/hybsel_design/viral-probe-set_06-2015_with-adapters/"
+parser = argparse.ArgumentParser()
+registry.add_collection_args(parser, "viral-probe-set_06-2015")
+args = parser.parse_args()
+collection = registry.collection_from_args(args)
+
+DATASETS = collection.dataset_names
+
+FASTA_RESULT_PATH = collection.path('fasta_results_with_adapters')
 
 SKIP_REVERSE_COMPLEMENT_PROBES = True
 
 for dataset in DATASETS:
     fasta_path = os.path.join(FASTA_RESULT_PATH, dataset + ".fasta")
-    with open(fasta_path) as f:
-        for line in f:
-            line = line.rstrip()
-            if line.startswith('>'):
-                # Header
-                if "reverse complement of" in line and SKIP_REVERSE_COMPLEMENT_PROBES:
-                    continue
-                probe_name = line[1:].split(' | ')[0]
-                print(probe_name + "\t" + dataset)
+    for header in seq_io.iterate_fasta_headers(fasta_path):
+        if "reverse complement of" in header and SKIP_REVERSE_COMPLEMENT_PROBES:
+            continue
+        probe_name = header.split(' | ')[0]
+        print(probe_name + "\t" + dataset)
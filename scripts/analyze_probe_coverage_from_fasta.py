@@ -1,41 +1,21 @@
 import argparse
 import os
-from subprocess import call
 import sys
 
 import numpy as np
 
+import job_executors
+import registry
+import utils
+
 ANALYZE_BIN = "bin/analyze_probe_coverage.py"
 
-DEFAULT_TMP_DIR = "/home/unix/hmetsky/tmp/analyzeprobes/"
-
-DATASETS = [
-            "chikungunya",
-            "crimean_congo",
-            "dengue",
-            (["ebola_zaire", "ebola2014"], "ebola_zaire-with-2014"),
-            "ebola_nonzaire",
-            "gbv_c",
-            "hepatitis_a",
-            "hepatitis_c",
-            "hiv1_without_ltr",
-            "hiv2_without_ltr",
-            "influenza",
-            "lassa",
-            "marburg",
-            "measles",
-            "mers",
-            "rhabdovirus",
-            "rift_valley_fever",
-            "sars",
-            "yellow_fever",
-           ]
-
-# parameter space is (mismatches, lcf_thres, cover_extension)
-PARAMETER_SPACE = [(mismatches, lcf_thres, cover_extension)
-                   for mismatches in range(0, 10)
-                   for lcf_thres in [100]
-                   for cover_extension in range(0, 51, 10)]
+# collection of datasets in the registry (see registry.py) to use by
+# default; its parameter space must be (mismatches, lcf_thres,
+# cover_extension)
+DEFAULT_COLLECTION = "viral-probe-set_06-2015"
+
+PARAM_NAMES = ["mismatches", "lcf_thres", "cover_extension"]
 
 
 def analysis_path(tmp_dir, dataset_name, mismatches,
@@ -48,38 +28,64 @@ def analysis_path(tmp_dir, dataset_name, mismatches,
     return path
 
 
-def iter_dataset():
-    # yield (dataset, name)
-    for dataset in DATASETS:
-        if isinstance(dataset, tuple):
-            # dataset is a tuple (x, y) where x is an array of datasets
-            # and y is the name that should be given to this collection of
-            # datasets
-            dataset, name = dataset
-        else:
-            # This is a single dataset: the name should be the same as
-            # dataset
-            name = dataset
-            dataset = [dataset]
+def parse_subcommand_args(parser):
+    # add the arguments shared by all commands to parser and parse the
+    # command's arguments; returns (args, collection), with args.tmp_dir
+    # set to the collection's 'analysis_tmp_dir' path if not given
+    parser.add_argument("--tmp_dir",
+                        help=("tmp directory (default: the collection's "
+                              "'analysis_tmp_dir' path)"))
+    registry.add_collection_args(parser, DEFAULT_COLLECTION)
+    args = parser.parse_args(sys.argv[2:])
+
+    collection = registry.collection_from_args(args)
+    if collection.param_names != PARAM_NAMES:
+        raise ValueError(("The parameter space of collection '%s' must be "
+                          "(%s)") % (collection.name, ', '.join(PARAM_NAMES)))
+    if args.tmp_dir is None:
+        args.tmp_dir = collection.path('analysis_tmp_dir')
+        if args.tmp_dir is None:
+            raise ValueError(("Collection '%s' has no 'analysis_tmp_dir' "
+                              "path; use --tmp_dir") % collection.name)
+    return args, collection
+
+
+def iter_dataset(collection):
+    # yield (dataset, name), where dataset is a list of the datasets
+    # whose results are given the name name
+    for dataset, name in collection.datasets:
         yield (dataset, name)
 
 
-def iter_dataset_and_params():
+def iter_dataset_and_params(collection):
     # yield (dataset, name, params)
-    for dataset, name in iter_dataset():
-        for params in PARAMETER_SPACE:
+    parameter_space = collection.parameter_space
+    for dataset, name in iter_dataset(collection):
+        for params in parameter_space:
             yield (dataset, name, params)
 
 
 def run_analysis():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--tmp_dir", default=DEFAULT_TMP_DIR,
-                        help="tmp directory")
     parser.add_argument("-f", "--probes_fasta", required=True,
                         help="path to fasta with probes")
-    args = parser.parse_args(sys.argv[2:])
-
-    for dataset, name, params in iter_dataset_and_params():
+    parser.add_argument("--num_processes_per_job", type=int, default=4,
+                        help=("number of processes each analysis job uses; "
+                              "LSF reserves this many cores, while 'local' "
+                              "and 'parallel' only use it to decide how "
+                              "many jobs to run at once"))
+    parser.add_argument("--mem_per_job_gb", type=float,
+                        help=("memory (GB) each analysis job is expected to "
+                              "use; LSF reserves it, while 'local' only uses "
+                              "it to decide how many jobs to run at once "
+                              "(a job that uses more is not killed)"))
+    job_executors.add_executor_args(parser)
+    args, collection = parse_subcommand_args(parser)
+
+    # Only make jobs whose output does not exist yet, so that a sweep
+    # that was interrupted resumes where it stopped
+    jobs = []
+    for dataset, name, params in iter_dataset_and_params(collection):
         mismatches, lcf_thres, cover_extension = params
         path = analysis_path(args.tmp_dir, name, mismatches, lcf_thres,
                              cover_extension)
@@ -88,14 +94,8 @@ def run_analysis():
             # skip b/c the output file already exists
             continue
 
-        num_processes = 4
-        cmd = ["bsub"]
-        cmd += ["-o", path +  ".out"]
-        cmd += ["-q", "forest"]
-        cmd += ["-P", "hybseldesign"]
-        cmd += ["-n", str(num_processes)]
-        cmd += ["-R", "\"span[hosts=1]\""]
-        cmd += ["python", ANALYZE_BIN]
+        num_processes = args.num_processes_per_job
+        cmd = ["python", ANALYZE_BIN]
         cmd += ["--mismatches", str(mismatches)]
         cmd += ["--lcf_thres", "100"]
         cmd += ["--cover_extension", str(cover_extension)]
@@ -103,14 +103,23 @@ def run_analysis():
         cmd += ["--probes_fasta", args.probes_fasta]
         cmd += ["--write_analysis_to_tsv", path_analysis]
         cmd += ["--max_num_processes", str(num_processes)]
-        #call(cmd)
-        print(' '.join(cmd))
+        jobs += [job_executors.Job(cmd, path + ".out", path_analysis,
+                                   num_processes, args.mem_per_job_gb)]
+
+    if args.executor != 'lsf' and not os.path.isdir(args.tmp_dir):
+        os.makedirs(args.tmp_dir)
+    executor = job_executors.executor_from_args(args, "forest",
+                                                project="hybseldesign")
+    num_failed = executor.run(jobs)
+    if num_failed > 0:
+        print("%d of %d jobs failed" % (num_failed, len(jobs)),
+              file=sys.stderr)
+        exit(1)
 
 
 def clean():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--tmp_dir", default=DEFAULT_TMP_DIR)
-    args = parser.parse_args(sys.argv[2:])
+    args, _ = parse_subcommand_args(parser)
 
     # remove all files (but not subdirs) in the tmp dir
     for f in os.listdir(args.tmp_dir):
@@ -119,32 +128,6 @@ def clean():
             os.unlink(fp)
 
 
-def read_frac_of_covered_genome(fn):
-    # Returns list of fracs of unambig bases covered, one per genome
-    # (skips reverse complement genomes)
-    fracs = []
-    with open(fn) as f:
-        next(f) # skip header
-        for line in f:
-            ls = line.rstrip().split('\t')
-            genome_name = ls[0]
-            if genome_name.endswith('(rc)'):
-                # skip reverse complement genome
-                continue
-            frac_unambig_covered = float(ls[3])
-            fracs += [frac_unambig_covered]
-    return fracs
-
-
-def coverage_is_acceptable(fracs_unambig_covered):
-    # input: for each genome, fraction of unambiguous bases that are covered
-    # acceptable if the 5'th percentile (i.e., 5% of least covered genomes)
-    #  has this frac as > 0.99 (i.e., > 99% covered)
-    #  (in other words, 95% of genomes are > 99% covered)
-    prctile = np.percentile(fracs_unambig_covered, 5.0)
-    return prctile > 0.99
-
-
 def params_loss(params):
     mismatches, lcf_thres, cover_extension = params
     return (mismatches**2.0 +
@@ -152,26 +135,33 @@ def params_loss(params):
             (cover_extension / 5.0)**2.0)
 
 
-def best_params_giving_acceptable_coverage(covg_for_params):
-    # input: dict mapping params (tuple) to fracs_unambig_covered
-    best_acceptable = None
-    for params in covg_for_params.keys():
-        fracs_unambig_covered = covg_for_params[params]
-        if coverage_is_acceptable(fracs_unambig_covered):
-            if best_acceptable is None:
-                best_acceptable = params
-            elif params_loss(params) < params_loss(best_acceptable):
-                best_acceptable = params
-    return best_acceptable
+def best_params_giving_acceptable_coverage_all(prctiles, param_choices):
+    # input: array (num datasets x num param choices) giving, for each
+    # dataset and param choice, the 5th percentile of the frac of unambig
+    # bases covered (nan if unknown), and the list of param choices
+    # output: for each dataset, the param choice with the smallest loss
+    #  among those giving acceptable coverage (the first such in
+    #  param_choices if there are ties), or None if there are none
+    losses = np.array([params_loss(params) for params in param_choices])
+    acceptable = utils.coverage_is_acceptable(prctiles)
+    losses = np.where(acceptable, losses[np.newaxis, :], np.inf)
+    best = np.argmin(losses, axis=1)
+    return [param_choices[j] if np.isfinite(losses[i, j]) else None
+            for i, j in enumerate(best)]
 
 
 def summarize():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--tmp_dir", default=DEFAULT_TMP_DIR)
-    args = parser.parse_args(sys.argv[2:])
-
-    dataset_params_covg = {}
-    for dataset, name, params in iter_dataset_and_params():
+    parser.add_argument("--num_workers", type=int,
+                        help=("number of processes with which to parse "
+                              "analysis files (default: number of CPUs)"))
+    parser.add_argument("--no_cache", dest="use_cache", action="store_false",
+                        help=("do not reuse or update the cache of "
+                              "summaries of analysis files in the tmp dir"))
+    args, collection = parse_subcommand_args(parser)
+
+    paths = {}
+    for dataset, name, params in iter_dataset_and_params(collection):
         mismatches, lcf_thres, cover_extension = params
         path = analysis_path(args.tmp_dir, name, mismatches, lcf_thres,
                              cover_extension)
@@ -179,25 +169,42 @@ def summarize():
         if not os.path.exists(path_full):
             print("MISSING FILE", path_full, file=sys.stderr)
             continue
-        fracs_unambig_covered = read_frac_of_covered_genome(path_full)
-
-        if name not in dataset_params_covg:
-            dataset_params_covg[name] = {}
-        dataset_params_covg[name][params] = fracs_unambig_covered
-
-    for dataset_name in sorted(dataset_params_covg.keys()):
-        best_acceptable_params = best_params_giving_acceptable_coverage(
-            dataset_params_covg[dataset_name])
+        paths[(name, params)] = path_full
+
+    cache = None
+    if args.use_cache:
+        cache = utils.FileFingerprintCache(os.path.join(args.tmp_dir,
+            utils.COVERAGE_SUMMARY_CACHE_FN))
+    summaries = utils.summarize_analysis_files(list(paths.values()),
+        cache=cache, num_workers=args.num_workers)
+    if cache is not None:
+        cache.save()
+
+    # 5th percentile of coverage for each dataset (row) and param choice
+    # (column), nan where the analysis file is missing
+    dataset_names = sorted(set(name for name, _ in paths.keys()))
+    parameter_space = collection.parameter_space
+    param_idx = {params: j for j, params in enumerate(parameter_space)}
+    dataset_idx = {name: i for i, name in enumerate(dataset_names)}
+    prctile_idx = utils.COVERAGE_SUMMARY_PERCENTILES.index(
+        utils.ACCEPTABLE_COVERAGE_PERCENTILE)
+    prctiles = np.full((len(dataset_names), len(parameter_space)), np.nan)
+    for (name, params), path_full in paths.items():
+        prctiles[dataset_idx[name], param_idx[params]] = \
+            summaries[path_full]['percentiles'][prctile_idx]
+
+    best = best_params_giving_acceptable_coverage_all(prctiles,
+                                                      parameter_space)
+    for dataset_name, best_acceptable_params in zip(dataset_names, best):
         print(dataset_name, best_acceptable_params)
 
 
 def specified_param(percentiles=[0, 5, 25, 50, 75, 95, 100], default_lcf=100):
     parser = argparse.ArgumentParser()
-    parser.add_argument("--tmp_dir", default=DEFAULT_TMP_DIR)
     parser.add_argument("--param_choices", required=True,
         help=("file giving, on each line, "
               "'[dataset name]  [param choices as tuple]'"))
-    args = parser.parse_args(sys.argv[2:])
+    args, _ = parse_subcommand_args(parser)
 
     dataset_params = {}
     with open(args.param_choices) as f:
@@ -219,7 +226,7 @@ def specified_param(percentiles=[0, 5, 25, 50, 75, 95, 100], default_lcf=100):
         if not os.path.exists(path_full):
             print("MISSING FILE", path_full, file=sys.stderr)
             continue
-        fracs_unambig_covered = read_frac_of_covered_genome(path_full)
+        fracs_unambig_covered = utils.read_frac_of_covered_genome(path_full)
 
         covgs = np.percentile(fracs_unambig_covered, percentiles)
         covgs = [min(1.0, c) for c in covgs]
@@ -235,7 +242,9 @@ if __name__ == "__main__":
         The available commands are:
             clean           delete contents of the tmp dir
             run_analysis    run hybseldesign's coverage analyzer for each
-                            dataset and param combination
+                            dataset and param combination (print bsub
+                            commands, run locally, or write commands for
+                            GNU parallel; see --executor)
             summarize       collect information from all of the runs, across
                             all datasets and param combinations
             specified_param summarize coverage information for each dataset,
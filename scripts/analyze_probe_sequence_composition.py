@@ -13,28 +13,23 @@ from scipy.stats import hypergeom
 import plotly.plotly as py
 from plotly.graph_objs import *
 
+import seq_io
+
 
 def read_probe_seqs(args):
     probe_seqs = {}
-    with open(args.probe_seqs) as f:
-        curr_header = None
-        for line in f:
-            line = line.rstrip()
-            if line.startswith('>'):
-                curr_header = line[1:]
-                continue
-            if ("reverse complement of" in curr_header and
-                    args.skip_reverse_complement_probes):
-                continue
-            probe_name = curr_header.split(' | ')[0]
-            seq = line
-            if args.skip_adapters:
-                for adapter in args.adapters:
-                    if seq.startswith(adapter):
-                        seq = seq[len(adapter):]
-                    if seq.endswith(adapter):
-                        seq = seq[:-len(adapter)]
-            probe_seqs[probe_name] = seq
+    for header, seq in seq_io.iterate_fasta_records(args.probe_seqs):
+        if ("reverse complement of" in header and
+                args.skip_reverse_complement_probes):
+            continue
+        probe_name = header.split(' | ')[0]
+        if args.skip_adapters:
+            for adapter in args.adapters:
+                if seq.startswith(adapter):
+                    seq = seq[len(adapter):]
+                if seq.endswith(adapter):
+                    seq = seq[:-len(adapter)]
+        probe_seqs[probe_name] = seq
     return probe_seqs
 
 
@@ -193,8 +188,8 @@ def find_significant_kmers_by_probe(foreground_seqs, background_seqs, k=1,
 
         # Compute the fraction of foreground sequences with this kmer that
         # may 'hairpin' due to this kmer
-        rc = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
-        kmer_rc = ''.join([rc.get(b, b) for b in kmer][::-1])
+        kmer_rc = seq_io.decode_seq(seq_io.reverse_complement(
+            seq_io.encode_seq(kmer)))
         num_foreground_with_kmer_hairpin = sum(1 for seq in foreground_seqs
             if kmer in seq and kmer_rc in seq)
         frac_of_foreground_with_hairpin = num_foreground_with_kmer_hairpin / \
@@ -217,8 +212,7 @@ def print_significant_kmers(significant_kmers, adapters):
 
 
 def create_gc_content_hist(seqs, name, bin_size=0.02):
-    gc_fracs = [float(seq.count('G') + seq.count('C'))/len(seq) for
-                seq in seqs]
+    gc_fracs = [seq_io.gc_fraction(seq_io.encode_seq(seq)) for seq in seqs]
     bins = np.arange(0, 1 + bin_size, bin_size)
     hist, _ = np.histogram(gc_fracs, bins=bins)
     # Values in hist give number of probes (frequency) with gc_frac
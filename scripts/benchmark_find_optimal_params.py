@@ -0,0 +1,345 @@
+#!/bin/python3
+"""Benchmark the parameter optimizer of find_optimal_params on synthetic
+probe counts.
+
+For each number of datasets, this generates a probe count for each
+dataset on a lattice of (mismatches, cover_extension) values, where the
+count decreases with each parameter as in real runs and some lattice
+points are missing (as when make_probes jobs fail or are never run). It
+then runs each stage of find_optimal_params -- building the loss
+function, evaluating it, optimizing it with the barrier method, rounding
+the solution, and solving exactly as a multiple-choice knapsack problem
+-- and reports, for each, the wall time, the number of loss function
+calls, the peak memory, and the quality of the solution (its loss over
+the parameters and total probe count).
+
+Rounded solutions are kept at lattice points with a probe count (as
+with find_optimal_params --require_acceptable_coverage), so that their
+probe count is the measured count rather than an interpolation, as for
+the exact solution.
+
+Results can be saved as a baseline table and compared against in a
+later run.
+"""
+
+import argparse
+import resource
+import sys
+import time
+
+import numpy as np
+
+import find_optimal_params as fop
+import profiling
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# Columns of a table of benchmark results (see write_results)
+RESULT_COLUMNS = ["num_datasets", "stage", "time", "loss_calls",
+                  "peak_mem_mb", "params_loss", "probe_count"]
+
+
+def make_synthetic_probe_counts(num_datasets, missing_frac=0.2, seed=0,
+                                mismatches=range(0, 7),
+                                cover_extensions=range(0, 60, 10)):
+    """Generate probe counts on a lattice of parameter values.
+
+    The count of each dataset is a base count (log-normally distributed
+    across datasets) that decays exponentially with mismatches and
+    hyperbolically with cover_extension, at rates drawn for each dataset,
+    so that it never increases with either parameter. Each lattice point
+    is then missing with probability missing_frac, except the corners
+    of the lattice, so that every dataset can be interpolated anywhere
+    within it.
+
+    Returns:
+        dict {dataset: {(mismatches, cover_extension): probe count}}
+    """
+    random_state = np.random.RandomState(seed)
+    mismatches = list(mismatches)
+    cover_extensions = list(cover_extensions)
+    corners = set((m, e) for m in (mismatches[0], mismatches[-1])
+                  for e in (cover_extensions[0], cover_extensions[-1]))
+
+    probe_counts = {}
+    for i in range(num_datasets):
+        base = random_state.lognormal(np.log(1000), 1.0)
+        mismatches_rate = random_state.uniform(0.2, 0.6)
+        cover_extension_rate = random_state.uniform(0.05, 0.3)
+        d = {}
+        for m in mismatches:
+            for e in cover_extensions:
+                key = (m, e)
+                if key not in corners and \
+                        random_state.uniform() < missing_frac:
+                    continue
+                count = base * np.exp(-mismatches_rate * m) / \
+                    (1.0 + cover_extension_rate * e / 10.0)
+                d[key] = int(count) + 1
+        probe_counts['dataset_%05d' % i] = d
+    return probe_counts
+
+
+def budget_for_probe_counts(probe_counts, budget_frac):
+    """Choose a maximum probe count between the total count at the
+    largest parameter values (budget_frac=0) and at the smallest
+    (budget_frac=1), interpolating on a log scale.
+    """
+    lo = sum(d[max(d.keys())] for d in probe_counts.values())
+    hi = sum(d[min(d.keys())] for d in probe_counts.values())
+    return int(lo * (float(hi) / lo)**budget_frac)
+
+
+def reset_peak_rss():
+    # Reset the peak resident set size of this process, where supported
+    # (Linux); elsewhere, peak_rss_mb() gives the peak over the life of
+    # the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    # Return the peak resident set size of this process (since it was
+    # last reset, on Linux), in MB
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2.0**10
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (2.0**20 if sys.platform == 'darwin' else 2.0**10)
+
+
+def run_stage(fn):
+    """Run fn, measuring its wall time, the number of loss function
+    calls it makes (as counted by the profiling module) and the peak
+    resident memory of the process while it runs.
+
+    Returns:
+        tuple (result of fn, stats) where stats is a dict
+    """
+    profiling.enable()
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak_mem_mb = peak_rss_mb()
+    loss_calls = profiling.get_count('loss_calls')
+    profiling.disable()
+
+    stats = {'time': elapsed, 'loss_calls': loss_calls,
+             'peak_mem_mb': peak_mem_mb}
+    return result, stats
+
+
+def benchmark(num_datasets, args):
+    """Benchmark each stage of the optimizer on synthetic probe counts
+    for num_datasets datasets.
+
+    Returns:
+        list of dicts, one per stage, keyed by RESULT_COLUMNS
+    """
+    probe_counts = make_synthetic_probe_counts(num_datasets,
+        missing_frac=args.missing_frac, seed=args.seed)
+    max_probe_count = budget_for_probe_counts(probe_counts, args.budget_frac)
+    dims = fop.DEFAULT_PARAM_DIMS
+    total_probe_count = fop.make_total_probe_count_across_datasets_fn(
+        probe_counts, dims)
+    results = []
+
+    def add_result(stage, stats, params=None, measured=True):
+        # Report the measured probe count of parameter values at lattice
+        # points (which fails if one is missing), and otherwise (for the
+        # continuous solution) the interpolated count
+        row = dict(stats, num_datasets=num_datasets, stage=stage,
+                   params_loss=None, probe_count=None)
+        if params is not None:
+            row['params_loss'] = fop.params_loss(params, dims)
+            if measured:
+                row['probe_count'] = fop.total_probe_count_without_interp(
+                    params, probe_counts, dims)
+            else:
+                row['probe_count'] = total_probe_count(params)
+        results.append(row)
+
+    if 'loss_fn' in args.stages:
+        loss_fn, stats = run_stage(
+            lambda: fop.make_loss_fn(probe_counts, max_probe_count, dims))
+        add_result('make_loss_fn', stats)
+
+        # Time repeated calls at random points within the bounds
+        bounds = fop.make_param_bounds(probe_counts, args.hard_max_mismatches,
+                                       args.hard_max_cover_extension)
+        random_state = np.random.RandomState(args.seed)
+        lo, hi = np.array(bounds).T
+        xs = [random_state.uniform(lo, hi)
+              for _ in range(args.num_loss_calls)]
+        _, stats = run_stage(lambda: [loss_fn(x, 1.0) for x in xs])
+        stats['loss_calls'] = len(xs)
+        add_result('loss_fn_calls', stats)
+
+    x_sol = None
+    if 'barrier' in args.stages:
+        def solve():
+            bounds = fop.make_param_bounds(probe_counts,
+                                           args.hard_max_mismatches,
+                                           args.hard_max_cover_extension)
+            x0 = fop.make_initial_guess(probe_counts, bounds,
+                max_probe_count,
+                random_state=np.random.RandomState(args.seed))
+            if args.gradient == 'analytic':
+                loss_fn = fop.make_loss_and_grad_fn(probe_counts,
+                                                    max_probe_count)
+                return fop.optimize_loss(probe_counts, loss_fn, bounds, x0,
+                                         approx_grad=False, max_restarts=10,
+                                         verbose=False)
+            else:
+                loss_fn = fop.make_loss_fn(probe_counts, max_probe_count)
+                return fop.optimize_loss(probe_counts, loss_fn, bounds, x0,
+                                         approx_grad=True, verbose=False)
+        x_sol, stats = run_stage(solve)
+        add_result('optimize_loss', stats, x_sol, measured=False)
+
+        for local_search in [False, True]:
+            def round_sol():
+                try:
+                    return fop.round_params(x_sol, probe_counts,
+                        max_probe_count, local_search=local_search,
+                        hard_max_mismatches=args.hard_max_mismatches,
+                        hard_max_cover_extension=args.hard_max_cover_extension,
+                        measured_only=True)
+                except AssertionError:
+                    # The rounded parameter values did not satisfy the
+                    # budget
+                    return None
+            params, stats = run_stage(round_sol)
+            add_result('round_params' +
+                       ('+local_search' if local_search else ''),
+                       stats, params)
+
+    if 'mckp' in args.stages:
+        (params, _), stats = run_stage(
+            lambda: fop.choose_params_exactly(probe_counts, max_probe_count,
+                                              args.hard_max_mismatches,
+                                              args.hard_max_cover_extension))
+        add_result('mckp', stats, params)
+
+    return results
+
+
+def fmt(x, spec):
+    return 'NA' if x is None else spec % x
+
+
+def write_results(results, path):
+    # Write results as a tsv table with columns RESULT_COLUMNS
+    specs = {'num_datasets': '%d', 'stage': '%s', 'time': '%.4f',
+             'loss_calls': '%d', 'peak_mem_mb': '%.2f',
+             'params_loss': '%.2f', 'probe_count': '%.1f'}
+    with open(path, 'w') as f:
+        f.write('\t'.join(RESULT_COLUMNS) + '\n')
+        for row in results:
+            f.write('\t'.join(fmt(row[col], specs[col])
+                              for col in RESULT_COLUMNS) + '\n')
+
+
+def read_results(path):
+    # Read a table written by write_results, as a dict
+    # {(num_datasets, stage): row}
+    results = {}
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').split('\t')))
+            for col in row:
+                if col == 'stage':
+                    continue
+                row[col] = None if row[col] == 'NA' else float(row[col])
+            row['num_datasets'] = int(row['num_datasets'])
+            results[(row['num_datasets'], row['stage'])] = row
+    return results
+
+
+def print_results(results, baseline=None):
+    # Print results, along with the ratio of each time to that in the
+    # baseline and the change in the loss from the baseline (if given)
+    header = ["num_datasets", "stage", "time", "loss_calls", "peak_mem_mb",
+              "params_loss", "probe_count"]
+    if baseline is not None:
+        header += ["time_vs_baseline", "params_loss_vs_baseline"]
+    print('\t'.join(header))
+    for row in results:
+        cols = [str(row['num_datasets']), row['stage'],
+                fmt(row['time'], '%.3f'), fmt(row['loss_calls'], '%d'),
+                fmt(row['peak_mem_mb'], '%.1f'),
+                fmt(row['params_loss'], '%.2f'),
+                fmt(row['probe_count'], '%.1f')]
+        if baseline is not None:
+            base = baseline.get((row['num_datasets'], row['stage']))
+            if base is None:
+                cols += ['NA', 'NA']
+            else:
+                cols += [fmt(row['time'] / base['time']
+                             if base['time'] else None, '%.2fx')]
+                if row['params_loss'] is None or base['params_loss'] is None:
+                    cols += ['NA']
+                else:
+                    cols += ['%+.2f' % (row['params_loss'] -
+                                        base['params_loss'])]
+        print('\t'.join(cols))
+
+
+def main(args):
+    baseline = read_results(args.baseline) if args.baseline else None
+
+    results = []
+    for num_datasets in args.num_datasets:
+        results += benchmark(num_datasets, args)
+
+    print_results(results, baseline)
+    if args.save_baseline:
+        write_results(results, args.save_baseline)
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser()
+    argparse.add_argument('--num_datasets', type=int, nargs='+',
+        default=[10, 100, 500, 2000],
+        help="Numbers of synthetic datasets to benchmark")
+    argparse.add_argument('--stages', nargs='+',
+        choices=['loss_fn', 'barrier', 'mckp'],
+        default=['loss_fn', 'barrier', 'mckp'],
+        help=("Stages to run: 'loss_fn' builds the loss function and "
+              "calls it; 'barrier' optimizes the loss and rounds the "
+              "solution (with and without local search); 'mckp' solves "
+              "exactly"))
+    argparse.add_argument('--gradient', choices=['analytic', 'approx'],
+        default='analytic',
+        help="How to compute the gradient of the loss in the barrier stage")
+    argparse.add_argument('--missing_frac', type=float, default=0.2,
+        help="Fraction of lattice points at which counts are missing")
+    argparse.add_argument('--budget_frac', type=float, default=0.3,
+        help=("Where to put the maximum probe count between the total "
+              "count at the largest (0) and smallest (1) parameter "
+              "values, on a log scale"))
+    argparse.add_argument('--hard_max_mismatches', type=int, default=6)
+    argparse.add_argument('--hard_max_cover_extension', type=int, default=50)
+    argparse.add_argument('--num_loss_calls', type=int, default=100,
+        help="Number of loss function calls to time in the 'loss_fn' stage")
+    argparse.add_argument('--seed', type=int, default=0,
+        help="Seed for the synthetic probe counts and initial guess")
+    argparse.add_argument('--baseline',
+        help=("Table of results saved with --save_baseline to compare "
+              "against"))
+    argparse.add_argument('--save_baseline',
+        help="Write a table of the results to this path")
+    args = argparse.parse_args()
+
+    main(args)
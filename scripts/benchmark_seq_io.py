@@ -0,0 +1,135 @@
+#!/bin/python3
+"""Benchmark reading and writing a FASTA file with seq_io against the
+original implementations.
+
+The original reader (kept here as legacy_read_fasta) built each sequence
+by repeated string concatenation and held the entire file in memory;
+seq_io now streams records and joins the lines of each sequence once.
+The original writer (kept here as legacy_write_fasta) wrapped lines with
+textwrap; seq_io now slices fixed-width lines and writes through a large
+buffer.
+"""
+
+import argparse
+from collections import OrderedDict
+import os
+import tempfile
+import textwrap
+import time
+import tracemalloc
+
+import seq_io
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def legacy_read_fasta(fn):
+    """Read a FASTA file as seq_io.read_fasta originally did.
+    """
+    m = OrderedDict()
+    with open(fn) as f:
+        curr_seq_name = ""
+        for line in f:
+            line = line.rstrip()
+            if len(line) == 0:
+                continue
+            if line.startswith('>'):
+                curr_seq_name = line[1:]
+                m[curr_seq_name] = ''
+            else:
+                m[curr_seq_name] += line
+    return m
+
+
+def legacy_write_fasta(seqs, out_fn, chars_per_line=70):
+    """Write a FASTA file as seq_io.write_fasta originally did.
+    """
+    with open(out_fn, 'w') as f:
+        for seq_name, seq in seqs.items():
+            f.write('>' + seq_name + '\n')
+            seq_wrapped = textwrap.wrap(seq, chars_per_line)
+            for seq_line in seq_wrapped:
+                f.write(seq_line + '\n')
+            f.write('\n')
+
+
+def time_fn(fn, repeats, trace_memory):
+    times = []
+    peak_mem = None
+    for i in range(repeats):
+        if trace_memory and i == 0:
+            tracemalloc.start()
+        start = time.perf_counter()
+        total_len = fn()
+        times += [time.perf_counter() - start]
+        if trace_memory and i == 0:
+            _, peak_mem = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return min(times), peak_mem, total_len
+
+
+def main(args):
+    readers = [
+        ("legacy read_fasta",
+         lambda: sum(len(s) for s in legacy_read_fasta(args.fasta).values())),
+        ("seq_io.read_fasta",
+         lambda: sum(len(s) for s in seq_io.read_fasta(args.fasta).values())),
+        ("seq_io.iterate_fasta_records",
+         lambda: sum(len(s) for _, s in
+                     seq_io.iterate_fasta_records(args.fasta))),
+    ]
+    if args.skip_legacy:
+        readers = readers[1:]
+
+    for name, fn in readers:
+        t, peak_mem, total_len = time_fn(fn, args.repeats, args.trace_memory)
+        line = "%s: %.3f sec (%d bases)" % (name, t, total_len)
+        if peak_mem is not None:
+            line += ", peak memory %.1f MB" % (peak_mem / 2.0**20)
+        print(line)
+
+    if args.write:
+        seqs = seq_io.read_fasta(args.fasta)
+        total_len = sum(len(s) for s in seqs.values())
+        out_fn = os.path.join(tempfile.mkdtemp(), 'out.fasta')
+        writers = [
+            ("legacy write_fasta",
+             lambda: legacy_write_fasta(seqs, out_fn)),
+            ("seq_io.write_fasta",
+             lambda: seq_io.write_fasta(seqs, out_fn)),
+            ("seq_io.write_fasta (bgzip)",
+             lambda: seq_io.write_fasta(seqs, out_fn + '.gz')),
+        ]
+        if args.skip_legacy:
+            writers = writers[1:]
+        for name, fn in writers:
+            t, peak_mem, _ = time_fn(fn, args.repeats, args.trace_memory)
+            line = "%s: %.3f sec (%d bases)" % (name, t, total_len)
+            if peak_mem is not None:
+                line += ", peak memory %.1f MB" % (peak_mem / 2.0**20)
+            print(line)
+        for fn in [out_fn, out_fn + '.gz']:
+            if os.path.exists(fn):
+                os.unlink(fn)
+        os.rmdir(os.path.dirname(out_fn))
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser()
+    argparse.add_argument('--fasta', required=True,
+        help="FASTA file (plain or gzip/bgzip) to read")
+    argparse.add_argument('--repeats', type=int, default=3,
+        help="Number of times to read the file; the fastest is reported")
+    argparse.add_argument('--trace_memory', dest='trace_memory',
+        action='store_true',
+        help="When set, report peak memory (slows down the first read)")
+    argparse.add_argument('--skip_legacy', dest='skip_legacy',
+        action='store_true',
+        help=("When set, do not run the legacy reader/writer (e.g., on a "
+              "gzip-compressed file, which the legacy reader cannot read)"))
+    argparse.add_argument('--write', dest='write', action='store_true',
+        help=("When set, also benchmark writing the sequences in the FASTA "
+              "file"))
+    args = argparse.parse_args()
+
+    main(args)
@@ -9,11 +9,15 @@ import seq_io
 
 
 def compute_unsegmented_dataset_stats(data_dir, fasta_fn):
-    fasta = seq_io.read_fasta(os.path.join(data_dir, fasta_fn))
+    num_genomes = 0
+    total_seq_len = 0
+    for _, seq in seq_io.iterate_fasta_records(os.path.join(data_dir,
+                                                            fasta_fn)):
+        num_genomes += 1
+        total_seq_len += len(seq)
 
-    num_genomes = len(fasta)
     num_seqs = num_genomes
-    avg_seq_len = sum([len(seq) for seq in fasta.values()]) / float(num_seqs)
+    avg_seq_len = total_seq_len / float(num_seqs)
 
     return (num_genomes, num_seqs, avg_seq_len)
 
@@ -27,11 +31,10 @@ def compute_segmented_dataset_stats(data_dir, dataset_folder):
         fasta_fn_path = os.path.join(data_dir, dataset_folder, fasta_fn)
         assert os.path.isfile(fasta_fn_path)
 
-        fasta = seq_io.read_fasta(fasta_fn_path)
-        
         num_genomes += 1
-        num_seqs += len(fasta)
-        total_seq_len += sum([len(seq) for seq in fasta.values()])
+        for _, seq in seq_io.iterate_fasta_records(fasta_fn_path):
+            num_seqs += 1
+            total_seq_len += len(seq)
 
     avg_seq_len = total_seq_len / float(num_seqs)
 
@@ -43,8 +46,11 @@ def compute_dataset_stats(data_dir):
     for fn in os.listdir(data_dir):
         fn_path = os.path.join(data_dir, fn)
         if os.path.isfile(fn_path):
-            assert fn.endswith('.fasta')
-            dataset_name = fn[:-len('.fasta')]
+            if fn.endswith('.fasta.gz'):
+                dataset_name = fn[:-len('.fasta.gz')]
+            else:
+                assert fn.endswith('.fasta')
+                dataset_name = fn[:-len('.fasta')]
             stats[dataset_name] = compute_unsegmented_dataset_stats(data_dir,
                                                                     fn)
         else:
@@ -13,14 +13,30 @@ function.
 """
 
 import argparse
-from collections import defaultdict
+import concurrent.futures
+import hashlib
+import heapq
+import itertools
+import json
 import math
+import os
+import time
 
 import numpy as np
 from scipy import optimize
 
+import mckp
+import probe_count_grid
+import probe_count_surrogate
+import profiling
 import utils
 
+DEFAULT_PARAM_DIMS = probe_count_grid.DEFAULT_PARAM_DIMS
+
+# Largest exact (mckp) dynamic programming table, in cells, to build only
+# to report the optimality gap of the barrier solver (~800 MB)
+MAX_GAP_TABLE_SIZE = 10**8
+
 
 def round_up(x, b):
     """Round float x up to the nearest multiple of int b
@@ -32,231 +48,111 @@ def round_down(x, b):
     return int(math.floor(float(x) / b)) * b
 
 
-def make_interp_probe_count_for_dataset_fn(probe_counts):
+def make_probe_count_grid(probe_counts, dims=DEFAULT_PARAM_DIMS):
+    # Interpolate with a vectorized lattice of probe counts; for datasets
+    # whose lattice cell lacks a measured corner, the grid uses a bounding
+    # box, comparing boxes by their size relative to the step of each
+    # parameter. The boxes are found when the grid is made, so make it
+    # once and pass it (as grid) to each stage of the optimization
+    return probe_count_grid.ProbeCountGrid(probe_counts,
+        steps=[dim.step for dim in dims])
 
-    memoized_bounding_boxes = {dataset: {} for dataset in probe_counts.keys()}
-    def immediate_bounding_box(mismatches, cover_extension):
-        """Return the box around the values rounded down/up to the nearest int
-        to use when memoizing bounding boxes.
 
-        Since the cover_extensions are multiples of 10, we could really round
-        down/up cover_extension to the nearest 10. But just do the nearest
-        integer here to make it easier to generalize.
-        """
-        return (round_down(mismatches, 1),
-                round_up(mismatches, 1),
-                round_down(cover_extension, 1),
-                round_up(cover_extension, 1))
-
-    def find_bounding_box_around_point(dataset, mismatches, cover_extension):
-        """Return a rectangular bounding box around given parameters.
-
-        Based on probe_counts[dataset], choose parameter values that form the
-        smallest box around (mismatches, cover_extension) so that we can
-        use actual computed probe counts (based on the box's parameter values)
-        to interpolate the probe count for (mismatches, cover_extension).
-        """
-        # 'mismatches' may be a float between the min/max mismatches for
-        # dataset. 'cover_extension' may be a float between the min/max
-        # cover_extension for dataset. Find the mismatches and cover_extension
-        # parameters for dataset that form the smallest rectangle encompassing
-        # 'mismatches' and 'cover_extension', so that we can use the points of
-        # this rectangle to perform bilinear interpolation. We brute force over
-        # all possible rectangles encompassing 'mismatches' and
-        # 'cover_extension' (with some heuristics to not be completely
-        # exhaustive), which takes O(n^3) time; there are faster methods, but
-        # this should suffice here.
-        # Consider mismatches on the x-axis (left to right) and cover_extension
-        # on the y-axis (bottom to top)
-        points = set(probe_counts[dataset].keys())
-        points_topleft = set()
-        points_topright = set()
-        points_bottomleft = set()
-        points_bottomright = set()
-        for p in points:
-            m, ce = p
-            if m == mismatches:
-                if ce == cover_extension:
-                    points_topleft.add(p)
-                    points_topright.add(p)
-                    points_bottomleft.add(p)
-                    points_bottomright.add(p)
-                elif ce > cover_extension:
-                    points_topleft.add(p)
-                    points_topright.add(p)
-                else:
-                    points_bottomleft.add(p)
-                    points_bottomright.add(p)
-            elif m > mismatches:
-                if ce == cover_extension:
-                    points_topright.add(p)
-                    points_bottomright.add(p)
-                elif ce > cover_extension:
-                    points_topright.add(p)
-                else:
-                    points_bottomright.add(p)
-            else:
-                if ce == cover_extension:
-                    points_topleft.add(p)
-                    points_bottomleft.add(p)
-                elif ce > cover_extension:
-                    points_topleft.add(p)
-                else:
-                    points_bottomleft.add(p)
-
-        points_topright_by_y = defaultdict(set)
-        for p in points_topright:
-            m, ce = p
-            points_topright_by_y[ce].add(p)
-        points_bottomleft_by_x = defaultdict(set)
-        for p in points_bottomleft:
-            m, ce = p
-            points_bottomleft_by_x[m].add(p)
-
-        min_rectangle, min_area = None, float('inf')
-        for p_topleft in points_topleft:
-            p_topleft_m, p_topleft_ce = p_topleft
-            # find all points in the top-right with the same cover_extension
-            # (y-value) as p_topleft
-            for p_topright in points_topright_by_y[p_topleft_ce]:
-                p_topright_m, p_topright_ce = p_topright
-                # find all points in the bottom-left with the same mismatches
-                # (x-value) as p_topleft
-                for p_bottomleft in points_bottomleft_by_x[p_topleft_m]:
-                    p_bottomleft_m, p_bottomleft_ce = p_bottomleft
-                    # to form a rectangle, we need the point (p_topright_m,
-                    # p_bottomleft_ce); this point should be in the
-                    # bottom-right, so check if it exists
-                    p_bottomright = (p_topright_m, p_bottomleft_ce)
-                    if p_bottomright in points_bottomright:
-                        # we found a valid rectangle; now compute its 'area'
-                        width = p_topright_m - p_topleft_m
-                        height = (p_topright_ce - p_bottomleft_ce) / 10.0
-                        # add pseudocounts to width and height because if
-                        # width or height is 0, we still want the other
-                        # dimension to be accounted for
-                        area = (width + 0.001) * (height + 0.001)
-                        if area < min_area:
-                            min_rectangle = (p_topleft, p_bottomright)
-                            min_area = area
-        return min_rectangle
-
-    def interp_probe_count_for_dataset(dataset, mismatches, cover_extension):
-        """
-        Using the given probe counts at particular parameter values, interpolate
-        the number of probes for 'dataset' and 'mismatches' mismatches and
-        at a cover extension of 'cover_extension', where each of these may be
-        floats
-        """
-        immediate_bb = immediate_bounding_box(mismatches, cover_extension)
-        if immediate_bb in memoized_bounding_boxes[dataset]:
-            # The bounding box for (mismatches, cover_extension) has been
-            # memoized
-            min_rectangle = memoized_bounding_boxes[dataset][immediate_bb]
-        else:
-            # Compute and memoize the bounding box for (mismatches,
-            # cover_extension)
-            min_rectangle = find_bounding_box_around_point(dataset,
-                                                           mismatches,
-                                                           cover_extension)
-            if min_rectangle is None:
-                raise ValueError(("Unable to find rectangular bounding box around "
-                                  "(mismatches, cover_extension)=(%f, %f) for "
-                                  "dataset %s") % (mismatches, cover_extension,
-                                  dataset))
-            memoized_bounding_boxes[dataset][immediate_bb] = min_rectangle
-
-        rect_topleft, rect_bottomright = min_rectangle
-        mismatches_floor, cover_extension_ceil = rect_topleft
-        mismatches_ceil, cover_extension_floor = rect_bottomright
-
-        # At cover_extension_floor and at cover_extension_ceil, interpolate the
-        # number of probes at 'mismatches' mismatches (interpolate linearly)
-        for ce in [cover_extension_floor, cover_extension_ceil]:
-            count_left = probe_counts[dataset][(mismatches_floor, ce)]
-            count_right = probe_counts[dataset][(mismatches_ceil, ce)]
-            mismatches_diff = mismatches_ceil - mismatches_floor
-            if mismatches_diff == 0:
-                # count_left should equal count_right
-                assert count_left == count_right
-                count = count_left
-            elif count_left <= count_right:
-                count_diff = count_right - count_left
-                f = float(mismatches - mismatches_floor) / mismatches_diff
-                count = f * count_diff + count_left
-            else:
-                count_diff = count_left - count_right
-                f = float(mismatches - mismatches_floor) / mismatches_diff
-                count = count_left - f * count_diff
-            if ce == cover_extension_floor:
-                count_floor = count
-            if ce == cover_extension_ceil:
-                count_ceil = count
-
-        # Interpolate between cover_extension_floor and cover_extension_ceil
-        # using count_floor and count_ceil (interpolate linearly)
-        cover_extension_diff = cover_extension_ceil - cover_extension_floor
-        if cover_extension_diff == 0:
-            # count_floor should equal count_ceil
-            assert count_floor == count_ceil
-            final_interp = count_floor
-        elif count_floor <= count_ceil:
-            count_diff = count_ceil - count_floor
-            f = float(cover_extension - cover_extension_floor) / cover_extension_diff
-            final_interp = f * count_diff + count_floor
-        else:
-            count_diff = count_floor - count_ceil
-            f = float(cover_extension - cover_extension_floor) / cover_extension_diff
-            final_interp = count_floor - f * count_diff
-
-        return final_interp
-
-    return interp_probe_count_for_dataset
-
-
-def make_total_probe_count_across_datasets_fn(probe_counts):
-    interp_probe_count_for_dataset = make_interp_probe_count_for_dataset_fn(
-        probe_counts)
+def make_total_probe_count_across_datasets_fn(probe_counts,
+                                              dims=DEFAULT_PARAM_DIMS,
+                                              grid=None):
+    if grid is None:
+        grid = make_probe_count_grid(probe_counts, dims)
 
     def total_probe_count_across_datasets(x):
         """
         Sum the (interpolated) probe counts across datasets.
 
         x is a list giving all the parameter values across datasets,
-        such that for even i, x_i gives the number of mismatches for the
-        (i/2)'th dataset and x_{i+1} gives the cover extension for the
-        (i/2)'th dataset
+        such that, with N parameters (dims), x_{N*i+j} gives the value
+        of the j'th parameter for the i'th dataset (by default, for even
+        i, x_i gives the number of mismatches for the (i/2)'th dataset
+        and x_{i+1} gives the cover extension for the (i/2)'th dataset)
         """
-        s = 0
-        for i, dataset in enumerate(sorted(probe_counts.keys())):
-            mismatches, cover_extension = x[2 * i], x[2 * i + 1]
-            s += interp_probe_count_for_dataset(dataset, mismatches,
-                                                cover_extension)
-        return s
+        return grid.total(x)
 
     return total_probe_count_across_datasets
 
 
-def make_loss_fn(probe_counts, max_probe_count):
+def params_loss(x, dims=DEFAULT_PARAM_DIMS):
+    """
+    Compute the loss over the parameters, by taking their L2-norm with
+    each parameter weighted by the loss weight of its dimension (by
+    default, down-weighting cover_extension by a factor of 10.0). This is
+    the function we really want to minimize.
+
+    x is a list giving all the parameter values across datasets (see
+    make_loss_fn)
+    """
+    x = np.asarray(x, dtype=float).reshape(-1, len(dims))
+    weights = np.array([dim.loss_weight for dim in dims])
+    return float(np.sum(weights * np.power(x, 2.0)))
+
+
+def params_loss_grad(x, dims=DEFAULT_PARAM_DIMS):
+    """
+    Compute the gradient of params_loss with respect to x.
+    """
+    x = np.asarray(x, dtype=float).reshape(-1, len(dims))
+    weights = np.array([dim.loss_weight for dim in dims])
+    return (2.0 * weights * x).ravel()
+
+
+def barrier(total_probe_count, max_probe_count, eps):
+    """
+    Compute the barrier function that enforces the constraint that the
+    total probe count be less than max_probe_count, weighted by eps.
+
+    Returns:
+        tuple (value of the barrier, derivative of the barrier with
+        respect to total_probe_count)
+    """
+    if total_probe_count >= max_probe_count:
+        # Since the count is beyond the barrier, we should in theory
+        # return infinity. But if the optimizer does indeed try parameters
+        # that put the probe count here, it would be unable to compute
+        # an approximate gradient and may get stuck. So help it out
+        # by giving a value such that the negative gradient points toward
+        # a direction outside the barrier.
+        # Add 1 so that, if total_probe_count == max_probe_count, we do
+        # not take log(0).
+        over = total_probe_count - max_probe_count + 1
+        return 9999 + 10000.0 * np.log(over), 10000.0 / over
+    else:
+        # The barrier function is -log(max_probe_count - total_probe_count), to
+        # enforce the constraint that total_probe_count be less than
+        # max_probe_count.
+        # Add 1 so that, if max_probe_count - total_probe_count < 1,
+        # the argument to log(..) remains >= 1.
+        under = max_probe_count - total_probe_count + 1
+        return -1.0 * eps * np.log(under), eps / under
+
+
+def make_loss_fn(probe_counts, max_probe_count, dims=DEFAULT_PARAM_DIMS,
+                 grid=None):
     total_probe_count_across_datasets = make_total_probe_count_across_datasets_fn(
-        probe_counts)
+        probe_counts, dims, grid)
 
     def loss(x, *func_args):
         """
         Compute a loss.
 
         x is a list giving all the parameter values across datasets,
-        such that for even i, x_i gives the number of mismatches for the
-        (i/2)'th dataset and x_{i+1} gives the cover extension for the
-        (i/2)'th dataset
+        such that, with N parameters (dims), x_{N*i+j} gives the value of
+        the j'th parameter for the i'th dataset (by default, for even i,
+        x_i gives the number of mismatches for the (i/2)'th dataset and
+        x_{i+1} gives the cover extension for the (i/2)'th dataset)
         """
-        # First compute a loss over the parameters by taking their L2-norm (and
-        # down-weighting cover_extension by a factor of 10.0)
+        # First compute a loss over the parameters by taking their
+        # weighted L2-norm (by default, down-weighting cover_extension by
+        # a factor of 10.0)
         # This is the function we really want to minimize
-        opt_val = 0
-        for i, dataset in enumerate(sorted(probe_counts.keys())):
-            mismatches, cover_extension = x[2 * i], x[2 * i + 1]
-            opt_val += np.power(mismatches, 2.0) + np.power(cover_extension / 10.0, 2.0)
+        opt_val = params_loss(x, dims)
 
         # We also have the constraint that the total probe count be less than
         # max_probe_count
@@ -264,75 +160,143 @@ def make_loss_fn(probe_counts, max_probe_count):
         # barrier by eps
         eps = func_args[0]
         total_probe_count = total_probe_count_across_datasets(x)
-        if total_probe_count >= max_probe_count:
-            # Since the count is beyond the barrier, we should in theory
-            # return infinity. But if the optimizer does indeed try parameters
-            # that put the probe count here, it would be unable to compute
-            # an approximate gradient and may get stuck. So help it out
-            # by giving a value such that the negative gradient points toward
-            # a direction outside the barrier.
-            # Add 1 so that, if total_probe_count == max_probe_count, we do
-            # not take log(0).
-            barrier_val = 9999 + 10000.0 * np.log((total_probe_count -
-                                                  max_probe_count + 1))
-        else:
-            # The barrier function is -log(max_probe_count - total_probe_count), to
-            # enforce the constraint that total_probe_count be less than
-            # max_probe_count.
-            # Add 1 so that, if max_probe_count - total_probe_count < 1,
-            # the argument to log(..) remains >= 1.
-            barrier_val = -1.0 * eps * np.log((max_probe_count -
-                                               total_probe_count + 1))
+        barrier_val, _ = barrier(total_probe_count, max_probe_count, eps)
 
         return opt_val + barrier_val
 
     return loss
 
 
+def make_loss_and_grad_fn(probe_counts, max_probe_count,
+                          dims=DEFAULT_PARAM_DIMS, grid=None):
+    if grid is None:
+        grid = make_probe_count_grid(probe_counts, dims)
+
+    def loss_and_grad(x, *func_args):
+        """
+        Compute the same loss as make_loss_fn, along with its gradient.
+
+        The interpolated probe counts are piecewise multilinear, so the
+        gradient of the barrier is computed exactly (within each
+        interpolation cell) from the slopes of the cells rather than
+        approximated by finite differences that may straddle the kinks
+        between cells.
+
+        x is a list giving all the parameter values across datasets (see
+        make_loss_fn)
+        """
+        eps = func_args[0]
+        total_probe_count, total_probe_count_grad = grid.total_with_grad(x)
+        barrier_val, barrier_deriv = barrier(total_probe_count,
+                                             max_probe_count, eps)
+
+        val = params_loss(x, dims) + barrier_val
+        grad = (params_loss_grad(x, dims) +
+                barrier_deriv * total_probe_count_grad)
+        return val, grad
+
+    return loss_and_grad
+
+
+def hard_maxes_for_dims(dims, hard_max_mismatches, hard_max_cover_extension):
+    """
+    Return a list giving, for each parameter in dims, its hard maximum:
+    the given ones for mismatches and cover_extension, and None (no
+    maximum) for any other parameter.
+    """
+    hard_max = {'mismatches': hard_max_mismatches,
+                'cover_extension': hard_max_cover_extension}
+    return [hard_max.get(dim.name) for dim in dims]
+
+
+def best_complete_box(dataset_probe_counts, vals_within_max):
+    # Find a box, with one corner at the lowest value of every parameter,
+    # such that the dataset has a probe count at all of the parameter
+    # values in it (i.e., at every combination of the dataset's values of
+    # each parameter within the box). Among these, choose the box whose
+    # highest corner has the smallest probe count, so that the box leaves
+    # the most room to meet the budget; ties go to the box containing the
+    # most parameter values. Returns a list giving the (lowest, highest)
+    # value of each parameter in the box.
+    axes = [sorted(set(vals)) for vals in vals_within_max]
+    best, best_score = None, None
+    for corner in itertools.product(*axes):
+        if corner not in dataset_probe_counts:
+            continue
+        box_axes = [[v for v in axis if v <= c]
+                    for axis, c in zip(axes, corner)]
+        score = (dataset_probe_counts[corner],
+                 -int(np.prod([len(axis) for axis in box_axes])))
+        if best_score is not None and score >= best_score:
+            continue
+        if all(k in dataset_probe_counts
+               for k in itertools.product(*box_axes)):
+            best, best_score = corner, score
+    return [(axis[0], c) for axis, c in zip(axes, best)]
+
+
 def make_param_bounds(probe_counts, hard_max_mismatches,
-                      hard_max_cover_extension, step_size=0.001):
+                      hard_max_cover_extension, step_size=0.001,
+                      dims=DEFAULT_PARAM_DIMS, complete_boxes=False):
+    # If complete_boxes is True, each dataset is bounded by a box at all
+    # of whose parameter values it has a probe count (see
+    # best_complete_box). This is needed when probe counts have been
+    # removed from the interior of the region that would otherwise be
+    # chosen (e.g., by mask_by_coverage), since a count could then not be
+    # interpolated everywhere within that region.
+    hard_max = hard_maxes_for_dims(dims, hard_max_mismatches,
+                                   hard_max_cover_extension)
     bounds = []
     for dataset in sorted(probe_counts.keys()):
         params = probe_counts[dataset].keys()
-
-        # bound cover_extensions by the lowest and highest value for
-        # which we have a probe count result
-        cover_extensions = [k[1] for k in params
-                            if k[1] <= hard_max_cover_extension]
-        cover_extensions_lo = min(cover_extensions)
-        cover_extensions_hi = max(cover_extensions)
-
-        # to ensure we can find a rectangular bounding box around an
-        # arbitrary point ((mismatches, cover_extension)), our lower
-        # bound on mismatches should have a corresponding cover extension
-        # of min(cover_extensions) and of max(cover_extensions);
-        # so should our upper bound on mismatches
-        mismatches = [k[0] for k in params
-                      if k[0] <= hard_max_mismatches]
-        mismatches_with_valid_cover_extension = \
-            [m for m in mismatches if ((m, cover_extensions_lo) in params and
-             (m, cover_extensions_hi) in params)]
-        mismatches_lo = min(mismatches_with_valid_cover_extension)
-        mismatches_hi = max(mismatches_with_valid_cover_extension)
-
-        bounds += [(mismatches_lo, mismatches_hi - step_size)]
-        bounds += [(min(cover_extensions), max(cover_extensions) - step_size)]
+        vals_within_max = [[k[j] for k in params
+                            if hard_max[j] is None or k[j] <= hard_max[j]]
+                           for j in range(len(dims))]
+
+        if complete_boxes:
+            box = best_complete_box(probe_counts[dataset], vals_within_max)
+            bounds += [(lo, hi - step_size) if hi > lo else (lo, hi)
+                       for lo, hi in box]
+            continue
+
+        # bound each parameter other than the first (by default,
+        # cover_extension) by the lowest and highest value for which we
+        # have a probe count result
+        others_lo_hi = [(min(vals), max(vals))
+                        for vals in vals_within_max[1:]]
+
+        # to ensure we can find a bounding box around an arbitrary point,
+        # our lower bound on the first parameter (by default, mismatches)
+        # should have a probe count at every combination of the lowest
+        # and highest values of the other parameters; so should our
+        # upper bound on it
+        firsts_with_valid_others = \
+            [v for v in set(vals_within_max[0])
+             if all((v,) + corner in params
+                    for corner in itertools.product(*others_lo_hi))]
+        first_lo = min(firsts_with_valid_others)
+        first_hi = max(firsts_with_valid_others)
+
+        bounds += [(first_lo, first_hi - step_size)]
+        bounds += [(lo, hi - step_size) for lo, hi in others_lo_hi]
     return bounds
 
 
-def make_initial_guess(probe_counts, bounds, max_probe_count):
-    # Guess uniformly within bounds for each dataset
-    x0 = np.zeros(2 * len(probe_counts))
-    for i, dataset in enumerate(sorted(probe_counts.keys())):
-        mismatches_lo, mismatches_hi = bounds[2 * i]
-        x0[2 * i] = np.random.uniform(mismatches_lo, mismatches_hi)
-        cover_extension_lo, cover_extension_hi = bounds[2 * i + 1]
-        x0[2 * i + 1] = np.random.uniform(cover_extension_lo,
-                                          cover_extension_hi)
+def make_initial_guess(probe_counts, bounds, max_probe_count,
+                       random_state=None, dims=DEFAULT_PARAM_DIMS, grid=None):
+    # Guess uniformly within bounds for each parameter, drawing from
+    # random_state (a numpy RandomState) if given
+    if random_state is None:
+        random_state = np.random
+    x0 = np.zeros(len(dims) * len(probe_counts))
+    for i in range(len(x0)):
+        lo, hi = bounds[i]
+        x0[i] = random_state.uniform(lo, hi)
 
     # Verify that this yields fewer probes than the maximum allowed
     # (i.e., is not beyond the barrier)
-    guess_probe_count = make_total_probe_count_across_datasets_fn(probe_counts)(x0)
+    guess_probe_count = make_total_probe_count_across_datasets_fn(
+        probe_counts, dims, grid)(x0)
     if guess_probe_count >= max_probe_count:
         print(("WARNING: Initial guess is beyond the probe barrier (%d, but "
                "the max is %d)") % (guess_probe_count, max_probe_count))
@@ -342,54 +306,125 @@ def make_initial_guess(probe_counts, bounds, max_probe_count):
 
 
 def optimize_loss(probe_counts, loss_fn, bounds, x0,
-                  initial_eps=10.0, step_size=0.001):
+                  initial_eps=10.0, step_size=0.001, approx_grad=True,
+                  max_restarts=0, verbose=True, dims=DEFAULT_PARAM_DIMS,
+                  grid=None):
     # Keep minimizing loss_fn while decreasing eps (so that the weight
     # of the barrier function is decreased until it is very small).
     # On each iteration, start the initial guess/position at the solution
     # of the previous iteration.
+    #
+    # If approx_grad is False, loss_fn must return both the loss and its
+    # gradient (e.g., as made by make_loss_and_grad_fn); otherwise, the
+    # gradient is approximated by finite differences with step_size.
+    #
+    # The interpolated probe counts have kinks between interpolation
+    # cells, at which the optimizer's line search may fail (rc == 4); it
+    # may also stop after reaching maxfun (rc == 3). In these cases,
+    # restart the optimizer from its solution, up to max_restarts times
+    # per iteration, as long as doing so improves the loss.
+    #
+    # If verbose is False, do not report progress; otherwise, grid (if
+    # given) is used to report the probe count at the start of each
+    # iteration.
+
+    if verbose:
+        total_probe_count_across_datasets = \
+            make_total_probe_count_across_datasets_fn(probe_counts, dims,
+                                                      grid)
 
+    num_loss_calls = [0]
+    def counted_loss_fn(x, *func_args):
+        num_loss_calls[0] += 1
+        return loss_fn(x, *func_args)
+
+    def loss_val(x, eps):
+        val = loss_fn(x, eps)
+        return val if approx_grad else val[0]
+
+    total_nfeval, total_loss_calls, total_time = 0, 0, 0.0
     eps = initial_eps
     while eps >= 0.01:
-        x0_probe_count = make_total_probe_count_across_datasets_fn(probe_counts)(x0)
-        print("Starting an iteration with eps=%f, with x0 yielding %f probes" % \
-              (eps, x0_probe_count))
-
-        sol, nfeval, rc = optimize.fmin_tnc(loss_fn, x0, bounds=bounds,
-                                            args=(eps,),
-                                            approx_grad=True,
-                                            epsilon=step_size, disp=1, maxfun=2500)
-
-        if rc in [0, 1, 2]:
-            # rc == 0 indicates reaching the local minimum, and rc == 1 or
-            # rc == 2 indicates the function value converged
-            print("  Iteration was successful")
-        else:
-            print("  Iteration failed to converge!")
+        if verbose:
+            x0_probe_count = total_probe_count_across_datasets(x0)
+            print("Starting an iteration with eps=%f, with x0 yielding %f probes" % \
+                  (eps, x0_probe_count))
+
+        num_loss_calls[0] = 0
+        iter_nfeval = 0
+        start_time = time.time()
+        prev_val = None
+        with profiling.phase('eps=%g' % eps):
+            for restart in range(max_restarts + 1):
+                sol, nfeval, rc = optimize.fmin_tnc(counted_loss_fn, x0,
+                                                    bounds=bounds,
+                                                    args=(eps,),
+                                                    approx_grad=approx_grad,
+                                                    epsilon=step_size,
+                                                    disp=(1 if verbose else 0),
+                                                    maxfun=2500)
+                iter_nfeval += nfeval
+                x0 = sol
+                if rc not in [3, 4] or restart == max_restarts:
+                    break
+                val = loss_val(sol, eps)
+                if prev_val is not None and prev_val - val <= 1e-9 * abs(val):
+                    # Restarting no longer improves the loss
+                    break
+                if verbose:
+                    print("  Restarting the iteration (rc=%d)" % rc)
+                prev_val = val
+        elapsed_time = time.time() - start_time
+        profiling.count('loss_calls', num_loss_calls[0])
+        profiling.add_event('annealing_stages', eps=eps, time=elapsed_time,
+                            nfeval=iter_nfeval,
+                            loss_calls=num_loss_calls[0],
+                            restarts=restart, rc=rc)
+
+        if verbose:
+            if rc in [0, 1, 2]:
+                # rc == 0 indicates reaching the local minimum, and rc == 1 or
+                # rc == 2 indicates the function value converged
+                print("  Iteration was successful")
+            else:
+                print("  Iteration failed to converge! (rc=%d)" % rc)
+            print(("  %d function evaluations (%d loss calls) in %.2f sec") %
+                  (iter_nfeval, num_loss_calls[0], elapsed_time))
+        total_nfeval += iter_nfeval
+        total_loss_calls += num_loss_calls[0]
+        total_time += elapsed_time
 
-        x0 = sol
         eps = 0.1 * eps
 
+    if verbose:
+        print(("Optimization made %d function evaluations (%d loss calls) in "
+               "%.2f sec") % (total_nfeval, total_loss_calls, total_time))
+
     return sol
 
 
-def total_probe_count_without_interp(params, probe_counts):
+def total_probe_count_without_interp(params, probe_counts,
+                                     dims=DEFAULT_PARAM_DIMS):
     """
     The result of make_total_probe_count_across_datasets_fn should give
     the same count as this function, assuming that params are keys in
     the datasets of probe_counts. But this uses probe_counts directly
     as a sanity check (i.e., does not do any interpolation).
     """
+    n = len(dims)
     s = 0
     for i, dataset in enumerate(sorted(probe_counts.keys())):
-        mismatches, cover_extension = params[2 * i], params[2 * i + 1]
-        s += probe_counts[dataset][(mismatches, cover_extension)]
+        s += probe_counts[dataset][tuple(params[n * i:n * i + n])]
     return s
 
 
 def round_params(params, probe_counts, max_probe_count,
-        mismatches_eps=0.01, cover_extension_eps=0.1):
-    # Params are floats. We want the mismatches parameters to be integers
-    # and the cover_extension parameters to be multiples of 10.
+        round_down_eps=0.01, local_search=False,
+        hard_max_mismatches=None, hard_max_cover_extension=None,
+        dims=DEFAULT_PARAM_DIMS, grid=None, measured_only=False):
+    # Params are floats. We want each parameter to be a multiple of the
+    # step of its dimension (by default, the mismatches parameters to be
+    # integers and the cover_extension parameters to be multiples of 10).
     #
     # The floats, as given in params, should satisfy the constraint (i.e.,
     # the interpolated total number of probes is less than max_probe_count).
@@ -397,8 +432,9 @@ def round_params(params, probe_counts, max_probe_count,
     # values will decrease the number of probes; therefore, after rounding up
     # they should still satisfy the constraint.
     #
-    # But we also check if the parameter values are within eps of their
-    # rounded-down value. The loss optimizer has a tendency to make this happen
+    # But we also check if the parameter values are within eps (i.e.,
+    # round_down_eps times the step) of their rounded-down value. The
+    # loss optimizer has a tendency to make this happen
     # for some parameters (e.g., finding an optimal mismatches parameter value
     # of 1.00001). The reason likely has to do with the fact that, because
     # we are linearly interpolating total probe counts, the gradient of the
@@ -411,136 +447,1096 @@ def round_params(params, probe_counts, max_probe_count,
     # After rounding up, some parameters are decreased; we repeatedly
     # choose to decrease the parameter whose reduction yields the smallest
     # loss while still yielding a number of probes that is less than
-    # max_probe_count.
+    # max_probe_count. If local_search is True, the result is then improved
+    # by swapping a decrease in one dataset's parameters for an increase in
+    # another's (see improve_params_by_swaps).
+    #
+    # If measured_only is True, each dataset's parameter values are kept at
+    # values for which it has a probe count (e.g., when values that do not
+    # give acceptable coverage have been removed from probe_counts): after
+    # rounding, values without a count are moved to ones with a count (see
+    # snap_to_measured), and are only decreased to values with a count.
 
     params_rounded = []
-    for i, dataset in enumerate(sorted(probe_counts.keys())):
-        mismatches, cover_extension = params[2 * i], params[2 * i + 1]
-
-        if mismatches - round_down(mismatches, 1) < mismatches_eps:
-            # Round mismatches down
-            mismatches = round_down(mismatches, 1)
+    for i in range(len(params)):
+        step = dims[i % len(dims)].step
+        if params[i] - round_down(params[i], step) < round_down_eps * step:
+            # Round the parameter down
+            params_rounded += [round_down(params[i], step)]
         else:
-            # Round mismatches up
-            mismatches = round_up(mismatches, 1)
-
-        if cover_extension - round_down(cover_extension, 10) < cover_extension_eps:
-            # Round cover_extension down
-            cover_extension = round_down(cover_extension, 10)
-        else:
-            # Round cover_extension up
-            cover_extension = round_up(cover_extension, 10)
-
-        params_rounded += [mismatches, cover_extension]
-
-    total_probe_count = make_total_probe_count_across_datasets_fn(probe_counts)
+            # Round the parameter up
+            params_rounded += [round_up(params[i], step)]
+
+    if grid is None:
+        grid = make_probe_count_grid(probe_counts, dims)
+    if measured_only:
+        params_rounded = snap_to_measured(params_rounded, probe_counts, grid,
+                                          dims)
+    counts = grid.interp(params_rounded)
     # Verify that the probe count satisfies the constraint
     # Note that this assertion may fail if we are dealing with datasets
     # for which few actual probe counts have been computed; in these
     # cases, the interpolation may severely underestimate the number
     # of probes at a particular parameter choice
-    assert total_probe_count(params_rounded) < max_probe_count
+    assert np.sum(counts) < max_probe_count
+
+    with profiling.phase('decrease_greedily'):
+        params_rounded = decrease_params_greedily(params_rounded, grid,
+            counts, max_probe_count, dims,
+            allowed=(probe_counts if measured_only else None))
+    if local_search:
+        with profiling.phase('local_search'):
+            params_rounded = improve_params_by_swaps(params_rounded,
+                probe_counts, grid, max_probe_count, hard_max_mismatches,
+                hard_max_cover_extension, dims,
+                allowed=(probe_counts if measured_only else None))
+
+    return params_rounded
+
+
+def snap_to_measured(params_rounded, probe_counts, grid,
+                     dims=DEFAULT_PARAM_DIMS):
+    """
+    Move the parameter values of each dataset that has no probe count at
+    them to values at which it does: those with the smallest loss among
+    the values whose probe count is at most the interpolated count at the
+    current values (so that the total probe count does not increase), or,
+    if there are none, those with the smallest probe count.
+    """
+    n = len(dims)
+    params_rounded = list(params_rounded)
+    counts = grid.interp(params_rounded)
+    for i, dataset in enumerate(sorted(probe_counts.keys())):
+        key = tuple(params_rounded[n * i:n * i + n])
+        d = probe_counts[dataset]
+        if key in d:
+            continue
+        candidates = [k for k in d.keys() if d[k] <= counts[i]]
+        if candidates:
+            best = min(candidates, key=lambda k: (params_loss(k, dims), d[k]))
+        else:
+            best = min(d.keys(), key=lambda k: (d[k], params_loss(k, dims)))
+        params_rounded[n * i:n * i + n] = list(best)
+    return params_rounded
 
+
+def param_loss_delta(i, old_val, new_val, dims=DEFAULT_PARAM_DIMS):
+    """
+    Return the change in params_loss from changing the value of the i'th
+    parameter from old_val to new_val.
+    """
+    return dims[i % len(dims)].loss_weight * float(new_val**2 - old_val**2)
+
+
+def decrease_params_greedily(params_rounded, grid, counts, max_probe_count,
+                             dims=DEFAULT_PARAM_DIMS, allowed=None):
     # Keep decreasing parameters while satisfying the constraint.
     # In particular, choose to decrease the parameter whose reduction
     # yields the smallest loss while still satisfying the constraint.
-    loss_fn = make_loss_fn(probe_counts, max_probe_count)
-    while True:
-        curr_loss = loss_fn(params_rounded, 0)
-        # Find a parameter to decrease
-        min_loss, min_loss_new_params = curr_loss, None
-        for i in range(len(params_rounded)):
-            params_tmp = list(params_rounded)
-            if params_tmp[i] == 0:
-                # This cannot be decreased
-                continue
-            if i % 2 == 0:
-                # This is a mismatch, so decrease by 1
-                params_tmp[i] -= 1
-            else:
-                # This is a cover_extension, so decrease by 10
-                params_tmp[i] -= 10
-            if total_probe_count(params_tmp) >= max_probe_count:
-                # This change yields too many probes, so skip it
+    #
+    # The loss over the parameters is a sum over datasets, and the probe
+    # count of each dataset only depends on its own parameters, so a
+    # decrease only changes the loss and probe count of one dataset. Keep
+    # the possible decreases in a heap ordered by the change in loss (and
+    # then by parameter index, to break ties), and after decreasing a
+    # parameter only recompute the decreases for its dataset.
+    #
+    # counts gives the (interpolated) probe count of each dataset at
+    # params_rounded. Parameters are not decreased below the lowest value
+    # for which there are probe counts (by default, 0). If allowed is set,
+    # it is a dict {dataset: collection of param values} and parameters
+    # are only decreased to values in it.
+    n = len(dims)
+    params_rounded = list(params_rounded)
+    counts = np.array(counts, dtype=float)
+    total = float(np.sum(counts))
+
+    # version[d] is incremented whenever dataset d's parameters change, so
+    # that stale decreases in the heap can be skipped
+    version = [0] * len(counts)
+
+    def decreases(dataset_idx):
+        # Return the possible decreases for the parameters of the given
+        # datasets as tuples (loss delta, param index, count delta,
+        # version)
+        moves = []
+        for j, dim in enumerate(dims):
+            idx = [d for d in dataset_idx
+                   if params_rounded[n * d + j] - dim.step >= grid.axes[j][0]]
+            if allowed is not None:
+                idx = [d for d in idx if tuple(
+                    params_rounded[n * d + k] - (dim.step if k == j else 0)
+                    for k in range(n)) in allowed[grid.datasets[d]]]
+            if not idx:
                 continue
-            new_loss = loss_fn(params_tmp, 0)
-            if new_loss < min_loss:
-                min_loss = new_loss
-                min_loss_new_params = params_tmp
-
-        if min_loss_new_params != None:
-            # There was a change that led to a better loss, so
-            # update params_rounded
-            params_rounded = min_loss_new_params
-        else:
-            # No parameter change satisfies the constraint and
-            # yields an improvement in the loss
+            x = np.array([params_rounded[n * d:n * d + n] for d in idx],
+                         dtype=float)
+            x[:, j] -= dim.step
+            new_counts = grid.interp(x.ravel(), idx=idx)
+            for d, new_count in zip(idx, new_counts):
+                i = n * d + j
+                moves += [(param_loss_delta(i, params_rounded[i],
+                                            params_rounded[i] - dim.step,
+                                            dims),
+                           i, new_count - counts[d], version[d])]
+        return moves
+
+    heap = decreases(range(len(counts)))
+    heapq.heapify(heap)
+    # Decreases that would exceed max_probe_count; these stay infeasible
+    # while the total probe count does not decrease
+    parked = []
+    while heap:
+        move = heapq.heappop(heap)
+        loss_delta, i, count_delta, move_version = move
+        d = i // n
+        if move_version != version[d]:
+            # Dataset d's parameters have changed since this was computed
+            continue
+        if total + count_delta >= max_probe_count:
+            # This change yields too many probes, so skip it
+            parked += [move]
+            continue
+
+        params_rounded[i] -= dims[i % n].step
+        counts[d] += count_delta
+        total += count_delta
+        version[d] += 1
+        for new_move in decreases([d]):
+            heapq.heappush(heap, new_move)
+        if count_delta < 0:
+            # The total probe count decreased, so skipped decreases may now
+            # satisfy the constraint
+            for parked_move in parked:
+                heapq.heappush(heap, parked_move)
+            parked = []
+
+    return params_rounded
+
+
+def improve_params_by_swaps(params_rounded, probe_counts, grid,
+                            max_probe_count, hard_max_mismatches=None,
+                            hard_max_cover_extension=None,
+                            dims=DEFAULT_PARAM_DIMS, allowed=None):
+    # Improve the loss by local search: repeatedly decrease a parameter of
+    # one dataset while increasing a parameter of another dataset (to
+    # offset the added probes), choosing the pair that most decreases the
+    # loss while satisfying the constraint, and then decrease parameters
+    # greedily again. Increases are only made to parameter values for which
+    # there is a probe count and that are within the hard maxima (if
+    # given); see decrease_params_greedily for allowed.
+    n = len(dims)
+    datasets = sorted(probe_counts.keys())
+    hard_max = hard_maxes_for_dims(dims, hard_max_mismatches,
+                                   hard_max_cover_extension)
+    params_rounded = list(params_rounded)
+
+    while True:
+        counts = grid.interp(params_rounded)
+        total = float(np.sum(counts))
+
+        # Collect possible decreases and increases as arrays of (param index,
+        # loss delta, count delta)
+        dec, inc = [], []
+        for d, dataset in enumerate(datasets):
+            for j, dim in enumerate(dims):
+                i = n * d + j
+                for sign, moves in [(-1, dec), (1, inc)]:
+                    new_val = params_rounded[i] + sign * dim.step
+                    if new_val < 0:
+                        continue
+                    if sign > 0 and hard_max[j] is not None and \
+                            new_val > hard_max[j]:
+                        continue
+                    key = list(params_rounded[n * d:n * d + n])
+                    key[j] = new_val
+                    key = tuple(key)
+                    if key not in probe_counts[dataset]:
+                        continue
+                    moves += [(i, param_loss_delta(i, params_rounded[i],
+                                                   new_val, dims),
+                               probe_counts[dataset][key] - counts[d])]
+        if not dec or not inc:
+            break
+        dec = np.array(dec)
+        inc = np.array(inc)
+
+        # Evaluate all pairs of a decrease and an increase for different
+        # datasets
+        loss_delta = dec[:, 1][:, np.newaxis] + inc[:, 1][np.newaxis, :]
+        count_delta = dec[:, 2][:, np.newaxis] + inc[:, 2][np.newaxis, :]
+        valid = ((loss_delta < 0) &
+                 (total + count_delta < max_probe_count) &
+                 (dec[:, 0][:, np.newaxis] // n !=
+                  inc[:, 0][np.newaxis, :] // n))
+        if not np.any(valid):
             break
+        loss_delta[~valid] = np.inf
+        a, b = np.unravel_index(np.argmin(loss_delta), loss_delta.shape)
+        i_dec, i_inc = int(dec[a, 0]), int(inc[b, 0])
+        params_rounded[i_dec] -= dims[i_dec % n].step
+        params_rounded[i_inc] += dims[i_inc % n].step
+
+        params_rounded = decrease_params_greedily(params_rounded, grid,
+            grid.interp(params_rounded), max_probe_count, dims, allowed)
 
     return params_rounded
 
 
-def print_params_by_dataset(params, probe_counts, type="float"):
-    for i, dataset in enumerate(sorted(probe_counts.keys())):
-        mismatches, cover_extension = params[2 * i], params[2 * i + 1]
-        if type == "float":
-            print("%s: (%f, %f)" % (dataset, mismatches, cover_extension))
-        elif type == "int":
-            print("%s: (%d, %d)" % (dataset, mismatches, cover_extension))
+def make_choices_by_dataset(probe_counts, hard_max_mismatches,
+                            hard_max_cover_extension,
+                            dims=DEFAULT_PARAM_DIMS):
+    """
+    Return, for each dataset (in sorted order), the list of parameter
+    values (e.g., (mismatches, cover_extension)) for which there is a
+    probe count and that are within the hard maxima.
+    """
+    hard_max = hard_maxes_for_dims(dims, hard_max_mismatches,
+                                   hard_max_cover_extension)
+    choices = []
+    for dataset in sorted(probe_counts.keys()):
+        choices += [sorted(k for k in probe_counts[dataset].keys()
+                           if all(m is None or v <= m
+                                  for v, m in zip(k, hard_max)))]
+    return choices
+
+
+def make_exact_problem(probe_counts, hard_max_mismatches,
+                       hard_max_cover_extension, dims=DEFAULT_PARAM_DIMS):
+    # Rather than relaxing the choice of parameter values into a continuous
+    # problem, choose, for each dataset, one of the parameter values for
+    # which there is a probe count; this is a multiple-choice knapsack
+    # problem, which we can solve exactly because the loss over
+    # the parameters (by default, mismatches^2 + (cover_extension/10)^2)
+    # is an integer whenever mismatches is an integer and cover_extension
+    # is a multiple of 10. With other parameters or loss weights, the loss
+    # may not be an integer, in which case mckp rounds it and the solution
+    # may be (slightly) suboptimal.
+    #
+    # Returns a tuple (choices, losses, counts) where, for each dataset,
+    # choices gives its parameter values and losses and counts give the
+    # loss and probe count of each.
+    choices = make_choices_by_dataset(probe_counts, hard_max_mismatches,
+                                      hard_max_cover_extension, dims)
+    losses = [[params_loss(c, dims) for c in dataset_choices]
+              for dataset_choices in choices]
+    counts = [[probe_counts[dataset][c] for c in dataset_choices]
+              for dataset, dataset_choices in
+              zip(sorted(probe_counts.keys()), choices)]
+    return choices, losses, counts
+
+
+def losses_are_integers(losses):
+    # Return True iff every loss in an exact problem is an integer, in
+    # which case mckp solves it exactly
+    return all(abs(l - round(l)) <= 1e-6 for ls in losses for l in ls)
+
+
+def warn_if_losses_rounded(losses):
+    if not losses_are_integers(losses):
+        print(("WARNING: Losses over the parameters are not all integers, "
+               "so the exact solver rounds them"))
+
+
+def params_from_exact_solution(choices, sol):
+    # Convert a solution from mckp into a list of parameter values (as
+    # used throughout), or None if there is no solution
+    if sol is None:
+        return None
+    chosen, _, _ = sol
+    params = []
+    for dataset_choices, j in zip(choices, chosen):
+        params += list(dataset_choices[j])
+    return params
+
+
+def choose_params_exactly(probe_counts, max_probe_count,
+                          hard_max_mismatches, hard_max_cover_extension,
+                          dims=DEFAULT_PARAM_DIMS, problem=None):
+    # Returns a tuple (params, lower bound on loss), where params is None if
+    # no choice of parameter values yields fewer than max_probe_count probes
+    # and the lower bound is from a Lagrangian relaxation. problem, if
+    # given, is the exact problem as returned by make_exact_problem.
+    if problem is None:
+        problem = make_exact_problem(probe_counts, hard_max_mismatches,
+                                     hard_max_cover_extension, dims)
+    choices, losses, counts = problem
+    warn_if_losses_rounded(losses)
+    lower_bound = mckp.lagrangian_lower_bound(losses, counts, max_probe_count)
+    sol = mckp.solve(losses, counts, max_probe_count)
+    return params_from_exact_solution(choices, sol), lower_bound
+
+
+def choose_params_exactly_for_budgets(probe_counts, max_probe_counts,
+                                      hard_max_mismatches,
+                                      hard_max_cover_extension,
+                                      dims=DEFAULT_PARAM_DIMS):
+    # Returns a list, parallel to max_probe_counts, of params (or None, as
+    # in choose_params_exactly); all are traced back from a single
+    # dynamic programming table.
+    choices, losses, counts = make_exact_problem(probe_counts,
+        hard_max_mismatches, hard_max_cover_extension, dims)
+    warn_if_losses_rounded(losses)
+    sols = mckp.solve_for_max_counts(losses, counts, max_probe_counts)
+    return [params_from_exact_solution(choices, sol) for sol in sols]
+
+
+def solve_with_barrier(probe_counts, max_probe_count, bounds, x0,
+                       gradient='analytic', initial_eps=10.0, verbose=True,
+                       local_search=False, hard_max_mismatches=None,
+                       hard_max_cover_extension=None,
+                       dims=DEFAULT_PARAM_DIMS, grid=None,
+                       measured_only=False):
+    # Minimize the loss with the barrier method starting at x0, and round
+    # the solution (see round_params for local_search, the hard maxima and
+    # measured_only).
+    # Returns a tuple (continuous solution, rounded params).
+    if grid is None:
+        grid = make_probe_count_grid(probe_counts, dims)
+    with profiling.phase('optimize'):
+        if gradient == 'analytic':
+            # Restarts are cheap with an exact gradient
+            optimizer_loss_fn = make_loss_and_grad_fn(probe_counts,
+                                                      max_probe_count, dims,
+                                                      grid)
+            x_sol = optimize_loss(probe_counts, optimizer_loss_fn, bounds,
+                                  x0, initial_eps=initial_eps,
+                                  approx_grad=False, max_restarts=10,
+                                  verbose=verbose, dims=dims, grid=grid)
         else:
-            raise ValueError("Unknown type %s", type)
+            optimizer_loss_fn = make_loss_fn(probe_counts, max_probe_count,
+                                             dims, grid)
+            x_sol = optimize_loss(probe_counts, optimizer_loss_fn, bounds,
+                                  x0, initial_eps=initial_eps,
+                                  approx_grad=True, verbose=verbose,
+                                  dims=dims, grid=grid)
+
+    if verbose:
+        print("##############################")
+        print("Continuous parameter values:")
+        print_params_by_dataset(x_sol, probe_counts, "float", dims)
+        x_sol_count = grid.total(x_sol)
+        print("TOTAL INTERPOLATED PROBE COUNT: %f" % x_sol_count)
+        print("##############################")
+        print()
+
+    with profiling.phase('rounding'):
+        opt_params = round_params(x_sol, probe_counts, max_probe_count,
+            local_search=local_search,
+            hard_max_mismatches=hard_max_mismatches,
+            hard_max_cover_extension=hard_max_cover_extension, dims=dims,
+            grid=grid, measured_only=measured_only)
+    return x_sol, opt_params
+
+
+def sweep_budgets_with_barrier(probe_counts, max_probe_counts,
+                               hard_max_mismatches, hard_max_cover_extension,
+                               gradient='analytic', seed=None,
+                               local_search=False, dims=DEFAULT_PARAM_DIMS,
+                               measured_only=False):
+    # Solve with the barrier method for each budget in max_probe_counts,
+    # in increasing order, starting each at the (continuous) solution for
+    # the previous budget; that solution yields fewer probes than the
+    # previous budget, so it is within the barrier for the next one.
+    # Returns a list of (budget, params) where params is None if rounding
+    # the solution failed.
+    random_state = np.random.RandomState(seed)
+    grid = make_probe_count_grid(probe_counts, dims)
+    bounds = make_param_bounds(probe_counts, hard_max_mismatches,
+                               hard_max_cover_extension, dims=dims,
+                               complete_boxes=measured_only)
+    results = []
+    x0 = None
+    for max_probe_count in sorted(max_probe_counts):
+        if x0 is None:
+            x0 = make_initial_guess(probe_counts, bounds, max_probe_count,
+                                    random_state=random_state, dims=dims,
+                                    grid=grid)
+        try:
+            x_sol, opt_params = solve_with_barrier(probe_counts,
+                max_probe_count, bounds, x0, gradient=gradient,
+                verbose=False, local_search=local_search,
+                hard_max_mismatches=hard_max_mismatches,
+                hard_max_cover_extension=hard_max_cover_extension,
+                dims=dims, grid=grid, measured_only=measured_only)
+            x0 = x_sol
+        except AssertionError:
+            # The rounded parameter values did not satisfy the budget
+            opt_params = None
+        results += [(max_probe_count, opt_params)]
+    return results
+
+
+def solve_from_random_start(probe_counts, max_probe_count,
+                            hard_max_mismatches, hard_max_cover_extension,
+                            gradient='analytic', seed=None,
+                            local_search=False, dims=DEFAULT_PARAM_DIMS,
+                            measured_only=False):
+    # Solve with the barrier method starting at a random initial guess
+    # drawn with the given seed. Returns a tuple (params, stats) where
+    # params is None if rounding the solution failed and stats is a
+    # dict of statistics about the start.
+    start_time = time.time()
+    random_state = np.random.RandomState(seed)
+    grid = make_probe_count_grid(probe_counts, dims)
+    bounds = make_param_bounds(probe_counts, hard_max_mismatches,
+                               hard_max_cover_extension, dims=dims,
+                               complete_boxes=measured_only)
+    x0 = make_initial_guess(probe_counts, bounds, max_probe_count,
+                            random_state=random_state, dims=dims, grid=grid)
+    stats = {'seed': seed}
+    try:
+        x_sol, opt_params = solve_with_barrier(probe_counts,
+            max_probe_count, bounds, x0, gradient=gradient, verbose=False,
+            local_search=local_search,
+            hard_max_mismatches=hard_max_mismatches,
+            hard_max_cover_extension=hard_max_cover_extension, dims=dims,
+            grid=grid, measured_only=measured_only)
+        stats['continuous_loss'] = params_loss(x_sol, dims)
+        stats['loss'] = params_loss(opt_params, dims)
+        stats['probe_count'] = total_probe_count_without_interp(opt_params,
+                                                                probe_counts,
+                                                                dims)
+    except AssertionError:
+        # The rounded parameter values did not satisfy the budget
+        opt_params = None
+    stats['time'] = time.time() - start_time
+    return opt_params, stats
+
+
+def multi_start(args, probe_counts):
+    # Solve with the barrier method from args.num_starts random initial
+    # guesses, in parallel, and return the params yielding the smallest
+    # loss (or None if no start yielded a solution within the budget).
+    # Start i uses the seed args.seed + i; if no seed is given, choose one
+    # (and report it) so that the run can be reproduced.
+    if args.seed is None:
+        base_seed = np.random.randint(2**31 - args.num_starts)
+    else:
+        base_seed = args.seed
+    seeds = [base_seed + i for i in range(args.num_starts)]
+    num_processes = args.num_processes or os.cpu_count() or 1
+
+    start_time = time.time()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(num_processes, len(seeds))) as executor:
+        futures = [executor.submit(solve_from_random_start, probe_counts,
+                                   args.max_probe_count,
+                                   args.hard_max_mismatches,
+                                   args.hard_max_cover_extension,
+                                   args.gradient, seed, args.local_search,
+                                   args.param_dims,
+                                   args.require_acceptable_coverage)
+                   for seed in seeds]
+        results = [future.result() for future in futures]
+    elapsed_time = time.time() - start_time
+
+    best_params, best_loss = None, float('inf')
+    print("##############################")
+    print("Starts (base seed %d):" % base_seed)
+    print("seed\tcontinuous_loss\tloss\tprobe_count\ttime")
+    for params, stats in results:
+        if params is None:
+            print("%d\tNA\tNA\tNA\t%.2f" % (stats['seed'], stats['time']))
+            continue
+        print("%d\t%f\t%f\t%d\t%.2f" % (stats['seed'],
+              stats['continuous_loss'], stats['loss'], stats['probe_count'],
+              stats['time']))
+        if stats['loss'] < best_loss:
+            best_params, best_loss = params, stats['loss']
+    num_feasible = sum(1 for params, _ in results if params is not None)
+    print(("%d of %d starts yielded a solution within the budget, in %.2f "
+           "sec") % (num_feasible, len(results), elapsed_time))
+    print("##############################")
+    print()
 
+    return best_params
 
-def write_params_to_file(params, probe_counts, path, type="int"):
-    lines = []
+
+def dataset_fingerprint(dataset_probe_counts):
+    """
+    Return a fingerprint of the probe counts of a dataset, which changes
+    whenever a count is added, removed, or changed.
+    """
+    items = sorted([list(k), v] for k, v in dataset_probe_counts.items())
+    return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+def read_state(path):
+    # Read the state saved by write_state, or return None if there is none
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        # The state is corrupt; ignore it
+        return None
+
+
+def write_state(path, args, probe_counts, x_sol, opt_params):
+    # Save the solution, along with fingerprints of the probe counts it was
+    # found from, so that a later run can be updated incrementally;
+    # x_sol is the continuous solution (None if there is none)
+    state = state_settings(args)
+    state['datasets'] = {}
+    n = len(args.param_dims)
     for i, dataset in enumerate(sorted(probe_counts.keys())):
-        mismatches, cover_extension = params[2 * i], params[2 * i + 1]
-        if type == "float":
-            lines += ["%s\t(%f, %f)" % (dataset, mismatches, cover_extension)]
-        elif type == "int":
-            lines += ["%s\t(%d, %d)" % (dataset, mismatches, cover_extension)]
+        state['datasets'][dataset] = {
+            'fingerprint': dataset_fingerprint(probe_counts[dataset]),
+            'params': [int(v) for v in opt_params[n * i:n * i + n]],
+            'continuous_params': (None if x_sol is None else
+                                  [float(v) for v in x_sol[n * i:n * i + n]])}
+
+    # Write to a temporary file and rename it so that an interrupted
+    # write does not leave a corrupt state
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def state_settings(args):
+    # Return the settings, saved in a state, that determine the probe
+    # counts that are optimized over (e.g., through a coverage mask or
+    # surrogate fill) and the solution found from them
+    return {'max_probe_count': args.max_probe_count,
+            'hard_max_mismatches': args.hard_max_mismatches,
+            'hard_max_cover_extension': args.hard_max_cover_extension,
+            'use_n_expanded_counts': args.use_n_expanded_counts,
+            'solver': args.solver,
+            'param_dims': [list(dim) for dim in args.param_dims],
+            'local_search': args.local_search,
+            'require_acceptable_coverage': args.require_acceptable_coverage,
+            'fill_with_surrogate': args.fill_with_surrogate,
+            'surrogate_max_rel_error': (args.surrogate_max_rel_error
+                                        if args.fill_with_surrogate
+                                        else None),
+            'seed': args.seed}
+
+
+def state_matches_settings(state, args):
+    # Return True iff the state was saved with the same settings as args
+    # (other than the datasets and their probe counts); a state saved
+    # before a setting was recorded does not match
+    settings = state_settings(args)
+    if 'param_dims' not in state:
+        # states saved before param_dims was recorded used the default
+        state = dict(state,
+                     param_dims=[list(dim) for dim in DEFAULT_PARAM_DIMS])
+    return all(key in state and state[key] == value
+               for key, value in settings.items())
+
+
+def diff_state(state, probe_counts):
+    """
+    Compare the datasets in a saved state against probe_counts.
+
+    Returns:
+        tuple (added, removed, changed, unchanged) of sorted lists of
+        datasets
+    """
+    prev = state['datasets']
+    added, changed, unchanged = [], [], []
+    for dataset in sorted(probe_counts.keys()):
+        if dataset not in prev:
+            added += [dataset]
+        elif (prev[dataset]['fingerprint'] !=
+                dataset_fingerprint(probe_counts[dataset])):
+            changed += [dataset]
         else:
-            raise ValueError("Unknown type %s", type)
+            unchanged += [dataset]
+    removed = sorted(d for d in prev.keys() if d not in probe_counts)
+    return added, removed, changed, unchanged
+
+
+def make_warm_start(state, probe_counts, bounds, dims=DEFAULT_PARAM_DIMS):
+    # Start each unchanged dataset at its previous (continuous, if
+    # available) parameter values, clipped to the bounds; start each added
+    # or changed dataset at the upper bounds of its parameter values,
+    # which generally yield the fewest probes, so that the start is as
+    # close as possible to satisfying the constraint
+    _, _, _, unchanged = diff_state(state, probe_counts)
+    unchanged = set(unchanged)
+    n = len(dims)
+    x0 = np.zeros(n * len(probe_counts))
+    for i, dataset in enumerate(sorted(probe_counts.keys())):
+        for j in range(n):
+            lo, hi = bounds[n * i + j]
+            if dataset in unchanged:
+                prev = state['datasets'][dataset]
+                v = (prev['continuous_params'] or prev['params'])[j]
+                x0[n * i + j] = min(max(v, lo), hi)
+            else:
+                x0[n * i + j] = hi
+    return x0
+
+
+def solve_from_state(args, state, probe_counts, grid):
+    # Solve with the barrier method starting at the previous solution in
+    # state (see make_warm_start), re-annealing only from a small eps
+    # since that solution is already near the barrier. Starting there can
+    # end in a worse optimum than a cold start (e.g., when datasets were
+    # added or the budget changed), so also solve from a random initial
+    # guess, as is done without a state, and keep the rounded params with
+    # the smaller loss (the warm start's on a tie).
+    # Returns a tuple (continuous solution, rounded params).
+    dims = args.param_dims
+    with profiling.phase('bounds'):
+        bounds = make_param_bounds(probe_counts, args.hard_max_mismatches,
+            args.hard_max_cover_extension, dims=dims,
+            complete_boxes=args.require_acceptable_coverage)
+    with profiling.phase('initial_guess'):
+        starts = [('warm', make_warm_start(state, probe_counts, bounds, dims),
+                   0.1),
+                  ('cold', make_initial_guess(probe_counts, bounds,
+                       args.max_probe_count,
+                       random_state=np.random.RandomState(args.seed),
+                       dims=dims, grid=grid), 10.0)]
+
+    best, best_loss = None, float('inf')
+    losses = []
+    for name, x0, initial_eps in starts:
+        with profiling.phase(name + '_barrier'):
+            try:
+                x_sol, opt_params = solve_with_barrier(probe_counts,
+                    args.max_probe_count, bounds, x0,
+                    gradient=args.gradient, initial_eps=initial_eps,
+                    local_search=args.local_search,
+                    hard_max_mismatches=args.hard_max_mismatches,
+                    hard_max_cover_extension=args.hard_max_cover_extension,
+                    dims=dims, grid=grid,
+                    measured_only=args.require_acceptable_coverage)
+            except AssertionError:
+                # The rounded parameter values did not satisfy the budget
+                losses += [(name, None)]
+                continue
+        loss = params_loss(opt_params, dims)
+        losses += [(name, loss)]
+        if loss < best_loss:
+            best, best_loss = (name, x_sol, opt_params), loss
+
+    print("##############################")
+    for name, loss in losses:
+        print("Loss from the %s start: %s" % (name,
+              "NA" if loss is None else "%f" % loss))
+    if best is None:
+        raise ValueError(("Neither the warm nor the cold start yielded a "
+                          "solution with fewer than %d probes") %
+                         args.max_probe_count)
+    print("Keeping the solution from the %s start" % best[0])
+    print("##############################")
+    print()
+    return best[1], best[2]
+
+
+def parse_budgets(tokens):
+    """
+    Parse a list of budgets (maximum probe counts), where each token is
+    either an integer or a range START:STOP:STEP (including STOP).
+    """
+    budgets = set()
+    for token in tokens:
+        if ':' in token:
+            start, stop, step = [int(v) for v in token.split(':')]
+            budgets.update(range(start, stop + 1, step))
+        else:
+            budgets.add(int(token))
+    return sorted(budgets)
+
+
+def write_sweep_to_file(results, probe_counts, path, dims=DEFAULT_PARAM_DIMS):
+    # Write a table with one row per budget, giving the total probe count,
+    # the loss over the parameters, and the parameter values for each
+    # dataset (NA when no solution was found)
+    datasets = sorted(probe_counts.keys())
+    lines = ['\t'.join(["max_probe_count", "probe_count", "params_loss"] +
+                       datasets)]
+    for max_probe_count, params in results:
+        if params is None:
+            cols = [str(max_probe_count), "NA", "NA"] + ["NA"] * len(datasets)
+        else:
+            cols = [str(max_probe_count),
+                    "%d" % total_probe_count_without_interp(params,
+                                                            probe_counts,
+                                                            dims),
+                    "%f" % params_loss(params, dims)]
+            cols += [format_params(params, i, dims, "int")
+                     for i in range(len(datasets))]
+        lines += ['\t'.join(cols)]
 
     with open(path, 'w') as f:
         for line in lines:
             f.write(line + '\n')
 
 
-def main(args):
-    probe_counts = utils.read_probe_counts(args,
-        use_n_expanded_counts=args.use_n_expanded_counts)
+def sweep(args, probe_counts):
+    budgets = parse_budgets(args.sweep_max_probe_counts)
+    dims = args.param_dims
+
+    start_time = time.time()
+    if args.solver == 'mckp':
+        # A single dynamic programming table gives the solution for every
+        # budget
+        results = list(zip(budgets, choose_params_exactly_for_budgets(
+            probe_counts, budgets, args.hard_max_mismatches,
+            args.hard_max_cover_extension, dims)))
+    else:
+        # Split the budgets into contiguous chunks, so that warm starts
+        # within each chunk come from neighboring budgets, and solve the
+        # chunks in parallel
+        num_processes = args.num_processes or os.cpu_count() or 1
+        chunks = [list(c) for c in
+                  np.array_split(budgets, min(num_processes, len(budgets)))]
+        results = []
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=len(chunks)) as executor:
+            futures = [executor.submit(sweep_budgets_with_barrier,
+                                       probe_counts, [int(b) for b in chunk],
+                                       args.hard_max_mismatches,
+                                       args.hard_max_cover_extension,
+                                       args.gradient,
+                                       (None if args.seed is None else
+                                        args.seed + i),
+                                       args.local_search, dims,
+                                       args.require_acceptable_coverage)
+                       for i, chunk in enumerate(chunks)]
+            for future in futures:
+                results += future.result()
+    elapsed_time = time.time() - start_time
+
+    print("##############################")
+    print("max_probe_count\tprobe_count\tparams_loss")
+    for max_probe_count, params in results:
+        if params is None:
+            print("%d\tNA\tNA" % max_probe_count)
+        else:
+            print("%d\t%d\t%f" % (max_probe_count,
+                  total_probe_count_without_interp(params, probe_counts,
+                                                   dims),
+                  params_loss(params, dims)))
+    print("Solved %d budgets in %.2f sec" % (len(results), elapsed_time))
+    print("##############################")
+
+    if args.sweep_output:
+        write_sweep_to_file(results, probe_counts, args.sweep_output, dims)
+
+
+def format_params(params, i, dims=DEFAULT_PARAM_DIMS, type="float"):
+    # Format the parameter values of the i'th dataset as a tuple (e.g.,
+    # "(mismatches, cover_extension)")
+    n = len(dims)
+    if type == "float":
+        fmt = "%f"
+    elif type == "int":
+        fmt = "%d"
+    else:
+        raise ValueError("Unknown type %s", type)
+    return "(" + ", ".join(fmt % v for v in params[n * i:n * i + n]) + ")"
+
+
+def print_params_by_dataset(params, probe_counts, type="float",
+                            dims=DEFAULT_PARAM_DIMS):
+    for i, dataset in enumerate(sorted(probe_counts.keys())):
+        print("%s: %s" % (dataset, format_params(params, i, dims, type)))
 
-    loss_fn = make_loss_fn(probe_counts, args.max_probe_count)
-    bounds = make_param_bounds(probe_counts,
-                               args.hard_max_mismatches,
-                               args.hard_max_cover_extension)
-    x0 = make_initial_guess(probe_counts, bounds, args.max_probe_count)
 
-    x_sol = optimize_loss(probe_counts, loss_fn, bounds, x0)
+def write_params_to_file(params, probe_counts, path, type="int",
+                         dims=DEFAULT_PARAM_DIMS):
+    lines = []
+    for i, dataset in enumerate(sorted(probe_counts.keys())):
+        lines += ["%s\t%s" % (dataset, format_params(params, i, dims, type))]
 
+    with open(path, 'w') as f:
+        for line in lines:
+            f.write(line + '\n')
+
+
+def read_probe_counts(args):
+    # read probe counts from a table, if one is given, and otherwise
+    # by scanning the results directory; either way, keyed by the values
+    # of the parameters in args.param_dims
+    param_names = [dim.name for dim in args.param_dims]
+    if args.probe_count_table:
+        table = utils.read_probe_count_table(args.probe_count_table)
+        return utils.probe_counts_from_table(table,
+            use_n_expanded_counts=args.use_n_expanded_counts,
+            limit_datasets=args.limit_datasets,
+            param_names=param_names)
+    else:
+        if tuple(args.param_dims) == DEFAULT_PARAM_DIMS:
+            # Read filenames with the default pattern
+            param_names = None
+        return utils.read_probe_counts(args,
+            use_n_expanded_counts=args.use_n_expanded_counts,
+            param_names=param_names)
+
+
+def read_coverage(args, datasets):
+    # read, for each dataset and parameter values, the 5th percentile
+    # across genomes of the fraction of unambiguous bases covered (as
+    # summarized from the analysis tsv files written by each make_probes
+    # job), from a table if one is given and otherwise from the analysis
+    # tsv files in the results directory
+    if args.probe_count_table:
+        table = utils.read_probe_count_table(args.probe_count_table)
+        return utils.coverage_from_table(table,
+            limit_datasets=args.limit_datasets,
+            param_names=[dim.name for dim in args.param_dims])
+    else:
+        if tuple(args.param_dims) != DEFAULT_PARAM_DIMS:
+            raise ValueError(("Coverage can only be read from a results "
+                              "directory for the default parameters; use "
+                              "a probe count table"))
+        summaries = utils.scan_coverage_summaries(args.results_dir,
+            datasets,
+            num_workers=args.num_scan_workers)
+        return {dataset: {k: p5 for k, (p5, _) in d.items()}
+                for dataset, d in summaries.items()}
+
+
+def mask_by_coverage(probe_counts, coverage):
+    # Remove, from probe_counts, the parameter values of each dataset at
+    # which coverage is not acceptable (see utils.coverage_is_acceptable)
+    # or is unknown, so that every solver treats them as infeasible.
+    # Returns the masked probe counts.
+    masked = {}
+    for dataset in sorted(probe_counts.keys()):
+        keys = list(probe_counts[dataset].keys())
+        covg = coverage.get(dataset, {})
+        acceptable = utils.coverage_is_acceptable(
+            [covg.get(k, float('nan')) for k in keys])
+        masked[dataset] = {k: probe_counts[dataset][k]
+                           for k, ok in zip(keys, acceptable) if ok}
+
+    num_removed = sum(len(probe_counts[d]) - len(masked[d]) for d in masked)
     print("##############################")
-    print("Continuous parameter values:")
-    print_params_by_dataset(x_sol, probe_counts, "float")
-    x_sol_count = make_total_probe_count_across_datasets_fn(probe_counts)(x_sol)
-    print("TOTAL INTERPOLATED PROBE COUNT: %f" % x_sol_count)
+    print(("Removed %d of %d parameter choices at which coverage is not "
+           "acceptable (or unknown)") % (num_removed,
+           sum(len(d) for d in probe_counts.values())))
     print("##############################")
     print()
+    no_choices = [d for d in sorted(masked.keys()) if not masked[d]]
+    if no_choices:
+        raise ValueError(("No parameter values give acceptable coverage "
+                          "for datasets: %s") % ' '.join(no_choices))
+    return masked
+
+
+def fill_with_surrogate(probe_counts, max_rel_error):
+    # Fill in probe counts missing from the lattice of parameter values
+    # with predictions from a surrogate model (see probe_count_surrogate),
+    # so that the whole range of parameter values can be used. Returns a
+    # tuple (filled probe counts, {dataset: set of param values whose
+    # count is predicted}).
+    predictions = probe_count_surrogate.predict_missing_counts(probe_counts)
+    filled, predicted = probe_count_surrogate.fill_probe_counts(
+        probe_counts, predictions, max_rel_error=max_rel_error)
+    num_missing = sum(len(v) for v in predictions.values())
+    num_filled = sum(len(v) for v in predicted.values())
+    print("##############################")
+    print(("Filled in %d of %d missing probe counts with surrogate "
+           "predictions") % (num_filled, num_missing))
+    print("##############################")
+    print()
+    return filled, predicted
+
+
+def print_predicted_params(params, predicted, probe_counts,
+                           dims=DEFAULT_PARAM_DIMS):
+    # Report the datasets whose probe count at their chosen parameter
+    # values is predicted by the surrogate rather than measured
+    n = len(dims)
+    datasets = [dataset for i, dataset in
+                enumerate(sorted(probe_counts.keys()))
+                if tuple(params[n * i:n * i + n]) in predicted[dataset]]
+    if datasets:
+        print(("WARNING: The probe counts of %d datasets at their chosen "
+               "parameter values are predicted rather than measured: %s") %
+              (len(datasets), ' '.join(datasets)))
+
+
+def solve_exactly_for_gap(args, probe_counts):
+    # Solve exactly (with mckp) only to report the optimality gap of the
+    # barrier solver. This is skipped, with a warning, when the exact
+    # solution would be inexact (the losses are not integers) or its table
+    # would be too large, or when there is no feasible choice; a
+    # diagnostic should not abort or exhaust memory in the barrier solver.
+    # Returns a tuple (params, lower bound on loss, time in sec), where
+    # params is None if skipped.
+    dims = args.param_dims
+    problem = make_exact_problem(probe_counts, args.hard_max_mismatches,
+                                 args.hard_max_cover_extension, dims)
+    _, losses, _ = problem
+    if not losses_are_integers(losses):
+        print(("WARNING: Not reporting the optimality gap, since the losses "
+               "over the parameters are not all integers and the exact "
+               "solver would round them"))
+        return None, None, None
+    num_cells = mckp.table_size(losses)
+    if num_cells > MAX_GAP_TABLE_SIZE:
+        print(("WARNING: Not reporting the optimality gap, since the exact "
+               "solver's table would have %d cells (more than %d)") %
+              (num_cells, MAX_GAP_TABLE_SIZE))
+        return None, None, None
+
+    start_time = time.time()
+    with profiling.phase('exact_solve'):
+        exact_params, loss_lower_bound = choose_params_exactly(
+            probe_counts, args.max_probe_count, args.hard_max_mismatches,
+            args.hard_max_cover_extension, dims, problem=problem)
+    exact_time = time.time() - start_time
+    if exact_params is None:
+        print(("WARNING: Not reporting the optimality gap, since no choice "
+               "of parameter values yields fewer than %d probes") %
+              args.max_probe_count)
+        return None, None, None
+    return exact_params, loss_lower_bound, exact_time
 
-    opt_params = round_params(x_sol, probe_counts, args.max_probe_count)
+
+def main(args):
+    if args.profile:
+        profiling.enable()
+
+    with profiling.phase('read_probe_counts'):
+        probe_counts = read_probe_counts(args)
+    profiling.set_value('num_datasets', len(probe_counts))
+    profiling.set_value('num_probe_counts',
+                        sum(len(v) for v in probe_counts.values()))
+
+    predicted = None
+    if args.fill_with_surrogate:
+        with profiling.phase('surrogate'):
+            probe_counts, predicted = fill_with_surrogate(probe_counts,
+                args.surrogate_max_rel_error)
+
+    if args.require_acceptable_coverage:
+        with profiling.phase('coverage'):
+            probe_counts = mask_by_coverage(probe_counts,
+                read_coverage(args, sorted(probe_counts.keys())))
+
+    if args.sweep_max_probe_counts:
+        with profiling.phase('sweep'):
+            sweep(args, probe_counts)
+        if args.profile:
+            profiling.write(args.profile)
+        return
+
+    dims = args.param_dims
+    with profiling.phase('build_grid'):
+        grid = make_probe_count_grid(probe_counts, dims)
+    loss_fn = make_loss_fn(probe_counts, args.max_probe_count, dims, grid)
+
+    state = read_state(args.state_file) if args.state_file else None
+    up_to_date = False
+    if state is not None:
+        added, removed, changed, unchanged = diff_state(state, probe_counts)
+        print("##############################")
+        print(("Previous state: %d datasets added, %d removed, %d changed, "
+               "%d unchanged") % (len(added), len(removed), len(changed),
+               len(unchanged)))
+        for name, datasets in [("Added", added), ("Removed", removed),
+                               ("Changed", changed)]:
+            if datasets:
+                print("%s: %s" % (name, ' '.join(datasets)))
+        print("##############################")
+        print()
+        if not state_matches_settings(state, args):
+            print(("The previous state was saved with different settings; "
+                   "only using it to start the barrier solver"))
+            up_to_date = False
+        else:
+            up_to_date = not (added or removed or changed)
+
+    # Nothing needs to be solved (exactly, or to report a gap) if the
+    # previous solution is reused
+    if up_to_date:
+        exact_params = None
+    elif args.solver == 'mckp':
+        start_time = time.time()
+        with profiling.phase('exact_solve'):
+            exact_params, loss_lower_bound = choose_params_exactly(
+                probe_counts, args.max_probe_count, args.hard_max_mismatches,
+                args.hard_max_cover_extension, dims)
+        exact_time = time.time() - start_time
+        if exact_params is None:
+            raise ValueError(("No choice of parameter values yields fewer "
+                              "than %d probes") % args.max_probe_count)
+    elif args.report_gap:
+        exact_params, loss_lower_bound, exact_time = solve_exactly_for_gap(
+            args, probe_counts)
+    else:
+        exact_params = None
+
+    x_sol = None
+    if state is not None and up_to_date:
+        # Nothing changed, so reuse the previous solution
+        print("Reusing the previous solution")
+        opt_params = []
+        for dataset in sorted(probe_counts.keys()):
+            opt_params += state['datasets'][dataset]['params']
+        x_sol = [v for dataset in sorted(probe_counts.keys())
+                 for v in (state['datasets'][dataset]['continuous_params'] or
+                           state['datasets'][dataset]['params'])]
+    elif state is not None and args.solver == 'barrier':
+        x_sol, opt_params = solve_from_state(args, state, probe_counts, grid)
+    elif args.solver == 'barrier' and args.num_starts > 1:
+        with profiling.phase('multi_start'):
+            opt_params = multi_start(args, probe_counts)
+        if opt_params is None:
+            raise ValueError(("None of the %d starts yielded a solution "
+                              "with fewer than %d probes") %
+                             (args.num_starts, args.max_probe_count))
+    elif args.solver == 'barrier':
+        with profiling.phase('bounds'):
+            bounds = make_param_bounds(probe_counts,
+                args.hard_max_mismatches, args.hard_max_cover_extension,
+                dims=dims, complete_boxes=args.require_acceptable_coverage)
+        with profiling.phase('initial_guess'):
+            x0 = make_initial_guess(probe_counts, bounds,
+                args.max_probe_count,
+                random_state=np.random.RandomState(args.seed), dims=dims,
+                grid=grid)
+        with profiling.phase('barrier'):
+            x_sol, opt_params = solve_with_barrier(probe_counts,
+                args.max_probe_count, bounds, x0, gradient=args.gradient,
+                local_search=args.local_search,
+                hard_max_mismatches=args.hard_max_mismatches,
+                hard_max_cover_extension=args.hard_max_cover_extension,
+                dims=dims, grid=grid,
+                measured_only=args.require_acceptable_coverage)
+    else:
+        opt_params = exact_params
 
     print("##############################")
     print("Rounded parameter values:")
-    print_params_by_dataset(opt_params, probe_counts, "int")
-    opt_params_count = make_total_probe_count_across_datasets_fn(probe_counts)(opt_params)
+    print_params_by_dataset(opt_params, probe_counts, "int", dims)
+    opt_params_count = grid.total(opt_params)
     opt_params_loss = loss_fn(opt_params, 0)
     print("TOTAL PROBE COUNT: %d" % opt_params_count)
     print("TOTAL PARAMS LOSS: %f" % opt_params_loss)
+    if predicted is not None:
+        print_predicted_params(opt_params, predicted, probe_counts, dims)
     print("##############################")
     print()
 
+    exact_loss = None
+    if exact_params is not None:
+        exact_loss = params_loss(exact_params, dims)
+        print("##############################")
+        print("OPTIMAL PARAMS LOSS: %f (solved exactly in %.2f sec)" %
+              (exact_loss, exact_time))
+        print("LAGRANGIAN LOWER BOUND ON PARAMS LOSS: %f" % loss_lower_bound)
+        if args.solver == 'barrier':
+            gap = opt_params_loss - exact_loss
+            print("OPTIMALITY GAP: %f (%.2f%%)" %
+                  (gap, 100.0 * gap / exact_loss if exact_loss > 0 else 0.0))
+        print("##############################")
+        print()
+
     print("##############################")
-    opt_params_count_no_interp = total_probe_count_without_interp(opt_params, probe_counts)
+    opt_params_count_no_interp = total_probe_count_without_interp(opt_params,
+        probe_counts, dims)
     print("TOTAL PROBE COUNT WITHOUT INTERP: %d" % opt_params_count_no_interp)
     print("##############################")
     if args.verify_without_interp:
@@ -549,12 +1545,29 @@ def main(args):
         assert opt_params_count == opt_params_count_no_interp
 
     if args.output_params:
-        write_params_to_file(opt_params, probe_counts, args.output_params)
+        write_params_to_file(opt_params, probe_counts, args.output_params,
+                             dims=dims)
+    if args.state_file:
+        write_state(args.state_file, args, probe_counts, x_sol, opt_params)
+
+    if args.profile:
+        profiling.set_value('params_loss', opt_params_loss)
+        if exact_loss is not None:
+            profiling.set_value('optimal_params_loss', exact_loss)
+        profiling.set_value('probe_count', opt_params_count_no_interp)
+        profiling.write(args.profile)
 
 
 if __name__ == "__main__":
     argparse = argparse.ArgumentParser()
-    argparse.add_argument('--results_dir', '-i', required=True)
+    input_group = argparse.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--results_dir', '-i',
+                             help=("Directory containing a folder of "
+                                   "results for each dataset"))
+    input_group.add_argument('--probe_count_table', '-t',
+                             help=("Table of probe counts written by "
+                                   "index_probe_counts.py, to use instead "
+                                   "of scanning a results directory"))
     argparse.add_argument('--limit_datasets', '-d', nargs='+')
     argparse.add_argument('--max_probe_count', '-n', type=int, default=90000)
     argparse.add_argument('--output_params', '-o')
@@ -566,6 +1579,137 @@ if __name__ == "__main__":
     argparse.add_argument('--use_n_expanded_counts',
                           dest='use_n_expanded_counts',
                           action='store_true')
+    argparse.add_argument('--param_dims', nargs='+',
+                          type=probe_count_grid.parse_param_dim,
+                          default=list(DEFAULT_PARAM_DIMS),
+                          help=("Parameters to choose for each dataset, "
+                                "each given as NAME:STEP:LOSS_WEIGHT, where "
+                                "NAME is a column of the probe count table "
+                                "(or, without underscores, part of the "
+                                "name of each fasta file, e.g., "
+                                "'lcfthres_100'), values are rounded to "
+                                "multiples of STEP, and LOSS_WEIGHT weights "
+                                "the parameter's squared value in the loss "
+                                "(default: mismatches:1:1 "
+                                "cover_extension:10:0.01)"))
+    argparse.add_argument('--solver', choices=['barrier', 'mckp'],
+                          default='barrier',
+                          help=("How to choose parameter values: 'barrier' "
+                                "minimizes a continuous relaxation of the "
+                                "loss (with a barrier on the probe count) "
+                                "and then rounds the values; 'mckp' "
+                                "chooses, exactly, among the parameter "
+                                "values with a probe count for each "
+                                "dataset (a multiple-choice knapsack "
+                                "problem)"))
+    argparse.add_argument('--report_gap', dest='report_gap',
+                          action='store_true',
+                          help=("With the barrier solver, also solve "
+                                "exactly (as with --solver mckp) to report "
+                                "the optimality gap of the solution; this "
+                                "is skipped when the losses over the "
+                                "parameters are not integers or the exact "
+                                "problem is too large"))
+    argparse.add_argument('--gradient', choices=['analytic', 'approx'],
+                          default='analytic',
+                          help=("How to compute the gradient of the loss "
+                                "during optimization: 'analytic' computes "
+                                "it exactly from the slopes of the "
+                                "interpolated probe counts; 'approx' "
+                                "approximates it with finite differences"))
+    argparse.add_argument('--local_search', dest='local_search',
+                          action='store_true',
+                          help=("With the barrier solver, improve the "
+                                "rounded parameter values by swapping a "
+                                "decrease in one dataset's parameters for "
+                                "an increase in another's"))
+    argparse.add_argument('--num_starts', type=int, default=1,
+                          help=("With the barrier solver, number of random "
+                                "initial guesses to optimize from (in "
+                                "parallel); the best solution is kept"))
+    argparse.add_argument('--seed', type=int,
+                          help=("Seed for the random initial guess(es) of "
+                                "the barrier solver; start i uses seed+i"))
+    argparse.add_argument('--state_file',
+                          help=("JSON file in which to save the solution "
+                                "along with fingerprints of each dataset's "
+                                "probe counts; if it exists, the previous "
+                                "solution is reused when nothing changed "
+                                "and otherwise (with the barrier solver) "
+                                "the optimizer also starts from it and "
+                                "keeps the better of that solution and "
+                                "one from a cold start"))
+    argparse.add_argument('--sweep_max_probe_counts', nargs='+',
+                          help=("Solve for each of these maximum probe "
+                                "counts (each an integer or a range "
+                                "START:STOP:STEP, including STOP) rather "
+                                "than for --max_probe_count, and report "
+                                "the loss against probe count"))
+    argparse.add_argument('--sweep_output',
+                          help=("With --sweep_max_probe_counts, write a "
+                                "table of the probe count, loss, and "
+                                "parameter values for each maximum probe "
+                                "count to this path"))
+    argparse.add_argument('--num_processes', type=int,
+                          help=("With the barrier solver and "
+                                "--num_starts or --sweep_max_probe_counts, "
+                                "number of processes to use (default: "
+                                "number of CPUs)"))
+    argparse.add_argument('--require_acceptable_coverage',
+                          dest='require_acceptable_coverage',
+                          action='store_true',
+                          help=("Only choose, for each dataset, parameter "
+                                "values at which coverage is acceptable "
+                                "(the 5th percentile across genomes of "
+                                "the fraction of unambiguous bases "
+                                "covered is > 0.99), as summarized in the "
+                                "probe count table or read from the "
+                                "analysis tsv files in the results "
+                                "directory; values without a coverage "
+                                "summary are not chosen"))
+    argparse.add_argument('--fill_with_surrogate',
+                          dest='fill_with_surrogate',
+                          action='store_true',
+                          help=("Before optimizing, fill in probe counts "
+                                "missing from the lattice of parameter "
+                                "values with predictions from a monotone "
+                                "surrogate model fit to each dataset, so "
+                                "that the whole range of parameter values "
+                                "can be used; cannot be used with "
+                                "--require_acceptable_coverage, since "
+                                "predictions have no coverage summary"))
+    argparse.add_argument('--surrogate_max_rel_error', type=float,
+                          default=float('inf'),
+                          help=("With --fill_with_surrogate, only fill in "
+                                "predictions whose estimated relative "
+                                "error is at most this (default: fill in "
+                                "all)"))
+    argparse.add_argument('--profile',
+                          help=("Write a JSON profile of the run to this "
+                                "path ('-' for stdout): the time spent in "
+                                "each phase (reading probe counts, "
+                                "bounds, each annealing stage, rounding, "
+                                "etc.), the statistics of each annealing "
+                                "stage, and counts of loss calls, "
+                                "interpolations and interpolations that "
+                                "fell back on a bounding box (in this "
+                                "process only, not in "
+                                "the processes of --num_starts or a "
+                                "sweep)"))
+    argparse.add_argument('--num_scan_workers', type=int,
+                          default=utils.DEFAULT_NUM_SCAN_WORKERS,
+                          help=("Number of threads to use when counting "
+                                "probes in the results directory"))
+    argparse.add_argument('--show_progress', dest='show_progress',
+                          action='store_true',
+                          help=("When set, report progress while counting "
+                                "probes in the results directory"))
     args = argparse.parse_args()
 
+    if args.fill_with_surrogate and args.require_acceptable_coverage:
+        # Predicted probe counts have no coverage summary, so requiring
+        # acceptable coverage would remove every one of them
+        argparse.error("--fill_with_surrogate cannot be used with "
+                       "--require_acceptable_coverage")
+
     main(args)
@@ -1,39 +1,53 @@
-from collections import OrderedDict
+import argparse
+import math
 import os
+import sys
+
+import job_cost_model
+import predict_probe_counts
+import registry
+
+# collection of datasets in the registry (see registry.py) to use by
+# default; its parameter space must be (mismatches, cover_extension) and
+# it must give a datasets file with dataset stats and a 'results' path
+DEFAULT_COLLECTION = "all-human-host-viruses"
+
+# table of benchmark runs (time and peak memory) used, along with the
+# LSF output files of previous jobs, to predict the memory and run time
+# of each job (see job_cost_model)
+DEFAULT_BENCHMARK_STATS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "experiments",
+    "benchmark-lsh", "data", "stats.tsv")
+
+
+# output of 'bjobs -w | grep RUN' is at the collection's 'running_jobs'
+# path, if it has one; don't submit commands that are running
+def read_running(collection):
+    running = []
+    running_cmd_list = collection.path('running_jobs')
+    if running_cmd_list is not None:
+        with open(running_cmd_list) as f:
+            for line in f:
+                running += [line.rstrip()]
+    return running
+
+
+# table written by predict_probe_counts.py, given by --predicted_probe_counts
+# or else at the collection's 'predicted_probe_counts' path, if it has
+# one; don't submit commands for parameter values whose probe count it
+# predicts confidently
+def read_confidently_predicted(args, collection):
+    path = args.predicted_probe_counts
+    if path is None:
+        path = collection.path('predicted_probe_counts')
+    if path is None:
+        return set()
+    return predict_probe_counts.read_confident_predictions(path)
 
 
-RESULTS_PATH = "/home/unix/hmetsky/viral/viral-work/results/hybsel_design/viral-probe-set_all-human-host-viruses/recent-data/"
-
-DATASETS = OrderedDict()
-with open(RESULTS_PATH + "datasets.txt") as f:
-    for line in f:
-        ls = line.split('\t')
-        dataset = ls[0]
-        stats = (int(ls[1]), int(ls[2]), float(ls[3]))
-        DATASETS[dataset] = stats
-
-# if re-running some jobs because they failed due to memory limits
-# (submitted with too little memory requested), re-run them with
-# double the initial requested amount
-DOUBLE_MEM = True
-DOUBLE_MEM_TWICE = True
-
-# output of 'bjobs -w | grep RUN'; don't submit commands
-# that are running
-RUNNING_CMD_LIST = "/home/unix/hmetsky/tmp/running"
-RUNNING = []
-if RUNNING_CMD_LIST is not None:
-    with open(RUNNING_CMD_LIST) as f:
-        for line in f:
-            RUNNING += [line.rstrip()]
-
-
-# parameter space is (mismatches, cover_extension)
-PARAMETER_SPACE = [(mismatches, cover_extension)
-                   for mismatches in range(0, 7)
-                   for cover_extension in range(0, 51, 10)]
-
 def mem_requested(num_seqs, avg_seq_len, mismatches):
+    # guess memory (GB) from the size of the dataset; used when there are
+    # too few previous runs to fit a cost model
     cost = num_seqs * avg_seq_len
     if cost > 3 * 10**7:
         if mismatches >= 7:
@@ -56,11 +70,6 @@ def mem_requested(num_seqs, avg_seq_len, mismatches):
             mem = 4
         else:
             mem = 2
-
-    if DOUBLE_MEM:
-        mem *= 2
-    if DOUBLE_MEM_TWICE:
-        mem *= 2
     return mem
 
 def queue_requested(num_seqs, avg_seq_len, mismatches, mem):
@@ -73,70 +82,137 @@ def queue_requested(num_seqs, avg_seq_len, mismatches, mem):
         else:
             return "hour"
 
-def job_completed_successfully(out_path):
-    if not os.path.isfile(out_path):
-        return False
-    with open(out_path) as f:
-        for line in f:
-            if 'Successfully completed' in line:
-                return True
-    return False
-
-for dataset, stats in DATASETS.items():
-    if isinstance(dataset, tuple):
-        # dataset is a tuple (x, y) where x is an array of datasets
-        # and y is the name that should be given to this collection of
-        # datasets
-        dataset, name = dataset
+def fit_cost_model(args, collection, records):
+    # fit a cost model to records of previous runs and those in the
+    # benchmark stats table; returns None if there are too few records
+    if args.benchmark_stats and os.path.isfile(args.benchmark_stats):
+        records = records + job_cost_model.read_benchmark_stats(
+            args.benchmark_stats, collection.dataset_stats)
+    if len(records) < job_cost_model.MIN_RECORDS:
+        print(("Only %d records of previous runs; guessing memory and "
+               "queue from dataset size") % len(records), file=sys.stderr)
+        return None
+    model = job_cost_model.JobCostModel(records)
+    print(model.describe(), file=sys.stderr)
+    return model
+
+def resources_requested(model, outcome, num_seqs, avg_seq_len, mismatches,
+                        cover_extension, safety_sigmas,
+                        queues=job_cost_model.QUEUES):
+    # return (mem, queue) for a job, where outcome is the parsed LSF output
+    # file of its previous run (or None); jobs whose previous run was
+    # killed for exceeding its memory or run time limit are escalated
+    if model is None:
+        mem = mem_requested(num_seqs, avg_seq_len, mismatches)
+        time_hr = 0
     else:
-        # This is a single dataset: the name should be the same as
-        # dataset
-        name = dataset
-        dataset = [dataset]
-
-    num_genomes, num_seqs, avg_seq_len = stats
-
-    # Make the directory for this dataset's results
-    if not os.path.exists(RESULTS_PATH + name):
-        os.makedirs(RESULTS_PATH + name)
-    for params in PARAMETER_SPACE:
-        mismatches, cover_extension = params
-        path = (RESULTS_PATH + name + "/mismatches_" + str(mismatches) +
-                "-coverextension_" + str(cover_extension))
-
-        if job_completed_successfully(path + '.out'):
-            continue
+        mem, time_hr = model.predict(num_seqs * avg_seq_len, mismatches,
+                                     cover_extension, safety_sigmas)
+    mem, time_hr, min_queue = job_cost_model.escalate(outcome, mem, time_hr)
+    mem = max(1, int(math.ceil(mem)))
 
-        mem = mem_requested(num_seqs, avg_seq_len, mismatches)
+    if model is None and min_queue is None:
         queue = queue_requested(num_seqs, avg_seq_len, mismatches, mem)
-
-        bsub_cmd = ["bsub"]
-        bsub_cmd += ["-o", path +  ".out"]
-        bsub_cmd += ["-q", queue]
-        bsub_cmd += ["-R", "\"rusage[mem=" + str(mem) + "]\""]
-        bsub_cmd += ["-P", "hybseldesign"]
-
-        cmd = ["python", "bin/make_probes.py"]
-        cmd += ["--probe_length", "75"]
-        cmd += ["--probe_stride", "25"]
-        cmd += ["--mismatches", str(mismatches)]
-        cmd += ["--island_of_exact_match", "30"]
-        cmd += ["--cover_extension", str(cover_extension)]
-        cmd += ["--dataset"] + dataset
-        cmd += ["--skip_adapters"]
-        cmd += ["--skip_reverse_complements"]
-        cmd += ["--print_analysis"]
-        cmd += ["--write_analysis_to_tsv", path + ".analysis.tsv"]
-        cmd += ["--write_sliding_window_coverage", path + ".covg"]
-        cmd += ["-o", path + ".fasta"]
-        cmd += ["--verbose"]
-
-        skip_cmd = False
-        for r in RUNNING:
-            if path in r:
-                skip_cmd = True
-                break
-        if skip_cmd:
-            continue
-
-        print(' '.join(bsub_cmd + cmd))
+    else:
+        queue = job_cost_model.choose_queue(mem, time_hr, min_queue,
+                                             queues)
+    return mem, queue
+
+def main(args):
+    collection = registry.collection_from_args(args)
+    if collection.param_names != ["mismatches", "cover_extension"]:
+        raise ValueError(("The parameter space of collection '%s' must be "
+                          "(mismatches, cover_extension)") % collection.name)
+    results_path = collection.path('results')
+    running = read_running(collection)
+    confidently_predicted = read_confidently_predicted(args, collection)
+
+    records, outcomes = job_cost_model.read_lsf_history(results_path,
+        collection.dataset_stats)
+    model = fit_cost_model(args, collection, records)
+
+    # dataset is a list of the datasets whose results should be given the
+    # name name (usually just one dataset, also named name)
+    for dataset, name in collection.datasets:
+        num_genomes, num_seqs, avg_seq_len = collection.dataset_stats[name]
+
+        # Make the directory for this dataset's results
+        if not os.path.exists(os.path.join(results_path, name)):
+            os.makedirs(os.path.join(results_path, name))
+        for params in collection.parameter_space:
+            mismatches, cover_extension = params
+            path = os.path.join(results_path, name,
+                                "mismatches_" + str(mismatches) +
+                                "-coverextension_" + str(cover_extension))
+
+            outcome = outcomes.get((name, params))
+            if outcome is not None and outcome['status'] == 'done':
+                continue
+            if (name, params) in confidently_predicted:
+                continue
+
+            mem, queue = resources_requested(model, outcome, num_seqs,
+                avg_seq_len, mismatches, cover_extension,
+                args.safety_sigmas, args.queues)
+
+            bsub_cmd = ["bsub"]
+            bsub_cmd += ["-o", path +  ".out"]
+            bsub_cmd += ["-q", queue]
+            bsub_cmd += ["-R", "\"rusage[mem=" + str(mem) + "]\""]
+            bsub_cmd += ["-P", "hybseldesign"]
+
+            cmd = ["python", "bin/make_probes.py"]
+            cmd += ["--probe_length", "75"]
+            cmd += ["--probe_stride", "25"]
+            cmd += ["--mismatches", str(mismatches)]
+            cmd += ["--island_of_exact_match", "30"]
+            cmd += ["--cover_extension", str(cover_extension)]
+            cmd += ["--dataset"] + dataset
+            cmd += ["--skip_adapters"]
+            cmd += ["--skip_reverse_complements"]
+            cmd += ["--print_analysis"]
+            cmd += ["--write_analysis_to_tsv", path + ".analysis.tsv"]
+            cmd += ["--write_sliding_window_coverage", path + ".covg"]
+            cmd += ["-o", path + ".fasta"]
+            cmd += ["--verbose"]
+
+            skip_cmd = False
+            for r in running:
+                if path in r:
+                    skip_cmd = True
+                    break
+            if skip_cmd:
+                continue
+
+            print(' '.join(bsub_cmd + cmd))
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser()
+    registry.add_collection_args(argparse, DEFAULT_COLLECTION)
+    argparse.add_argument('--benchmark_stats',
+                          default=DEFAULT_BENCHMARK_STATS,
+                          help=("Table of benchmark runs with which, along "
+                                "with the LSF output of previous jobs, to "
+                                "predict memory and run time"))
+    argparse.add_argument('--predicted_probe_counts',
+                          help=("Table written by predict_probe_counts.py; "
+                                "don't submit jobs for parameter values "
+                                "whose probe count it predicts confidently "
+                                "(default: the collection's "
+                                "'predicted_probe_counts' path, if any)"))
+    argparse.add_argument('--safety_sigmas', type=float, default=2.0,
+                          help=("Request the predicted memory and run time "
+                                "plus this many residual standard "
+                                "deviations of the cost model"))
+    argparse.add_argument('--queues', nargs='+',
+                          type=job_cost_model.parse_queue,
+                          default=job_cost_model.QUEUES,
+                          help=("LSF queues to choose among when the cost "
+                                "model is used, in order, each as "
+                                "NAME[:MAX_HR[:MAX_MEM_GB]] where an "
+                                "omitted limit is no limit (default: "
+                                "hour:4:64 week:168:64 forest)"))
+    args = argparse.parse_args()
+
+    main(args)
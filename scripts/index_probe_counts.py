@@ -0,0 +1,65 @@
+#!/bin/python3
+"""Index a results directory into a single probe count table.
+
+This walks a results directory once, counting the probes in each fasta
+file (plain and n_expanded) and summarizing coverage from each analysis
+tsv file, and writes one row per (dataset, mismatches, cover_extension)
+to a tsv table. find_optimal_params.py (via --probe_count_table) can
+then start from this small table rather than re-walking and re-counting
+thousands of fasta files.
+"""
+
+import argparse
+import os
+
+import utils
+
+
+def main(args):
+    probe_counts, n_expanded_probe_counts = utils.scan_probe_counts(
+        args.results_dir,
+        limit_datasets=args.limit_datasets,
+        use_cache=args.use_cache,
+        num_workers=args.num_scan_workers,
+        show_progress=args.show_progress)
+
+    if args.skip_coverage:
+        coverage_summaries = None
+    else:
+        coverage_summaries = utils.scan_coverage_summaries(
+            args.results_dir, probe_counts.keys(),
+            num_workers=args.num_scan_workers,
+            use_cache=args.use_cache)
+
+    out_path = args.output
+    if out_path is None:
+        out_path = os.path.join(args.results_dir, utils.PROBE_COUNT_TABLE_FN)
+    utils.write_probe_count_table(out_path, probe_counts,
+                                  n_expanded_probe_counts,
+                                  coverage_summaries)
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser()
+    argparse.add_argument('--results_dir', '-i', required=True)
+    argparse.add_argument('--limit_datasets', '-d', nargs='+')
+    argparse.add_argument('--output', '-o',
+        help=("Path to tsv table to write (default: '%s' in the results "
+              "directory)" % utils.PROBE_COUNT_TABLE_FN))
+    argparse.add_argument('--skip_coverage', dest='skip_coverage',
+        action='store_true',
+        help=("When set, do not summarize coverage from the analysis "
+              "tsv files"))
+    argparse.add_argument('--num_scan_workers', type=int,
+        default=utils.DEFAULT_NUM_SCAN_WORKERS,
+        help=("Number of threads to use when counting probes, and of "
+              "processes to use when summarizing coverage"))
+    argparse.add_argument('--no_cache', dest='use_cache',
+        action='store_false',
+        help=("When set, do not reuse or update the caches of probe "
+              "counts and coverage summaries in the results directory"))
+    argparse.add_argument('--show_progress', dest='show_progress',
+        action='store_true')
+    args = argparse.parse_args()
+
+    main(args)
@@ -0,0 +1,323 @@
+"""Predict the memory and run time of make_probes jobs from previous runs.
+
+Records of previous runs come from two sources:
+  - the LSF output (.out) files of make_probes jobs in a results
+    directory, which give each job's max memory and run time (and, for
+    jobs that failed, whether they were killed for exceeding their
+    memory or run time limit)
+  - a table of benchmark runs such as experiments/benchmark-lsh/data/
+    stats.tsv, which gives the time (sec) and peak RSS (KB) of runs on
+    samples of genomes of datasets
+
+For each of memory and run time, a model is fit in which the log of the
+quantity is linear in the log of the dataset's size (number of
+sequences times their average length), mismatches and cover_extension.
+A prediction is the model's estimate plus a number of residual standard
+deviations (safety_sigmas), so that most jobs are within it.
+
+A job that was killed for exceeding its memory or run time limit is
+escalated: it is given at least twice the memory (or run time) of its
+failed run. Other jobs are not escalated, so memory is not wasted on
+jobs that never failed.
+"""
+
+from collections import namedtuple
+import math
+import os
+import re
+import time
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# LSF output file of a make_probes job, named by its parameters
+OUT_PATTERN = re.compile(r'mismatches_([0-9]+)-coverextension_([0-9]+)\.out$')
+
+# a record of a previous run: cost is the number of sequences in the
+# dataset times their average length, mem_gb is the max memory (GB) and
+# time_hr is the run time (hours)
+JobRecord = namedtuple('JobRecord', ['cost', 'mismatches', 'cover_extension',
+                                     'mem_gb', 'time_hr'])
+
+# LSF queues, in the order in which to consider them, as (name, run
+# limit in hours, memory limit in GB); None is no limit. These are the
+# queues of the cluster that generate_bsubs.py was written for, and the
+# memory limits match its queue_requested() (jobs needing more than 64 GB
+# go to 'forest'). The run limits are taken from the queue names, so
+# check them against `bqueues -l`; generate_bsubs.py --queues gives the
+# queues of another cluster (see parse_queue).
+QUEUES = [("hour", 4, 64),
+          ("week", 7 * 24, 64),
+          ("forest", None, None)]
+
+# fewest records with which to fit a model
+MIN_RECORDS = 8
+
+
+def _parse_mem_gb(value, unit):
+    # convert a memory value from LSF's resource usage summary to GB
+    scale = {'KB': 1.0 / 2**20, 'MB': 1.0 / 2**10, 'GB': 1.0, 'TB': 2**10}
+    return float(value) * scale[unit.upper()]
+
+
+def parse_lsf_out(path):
+    """Parse the header and resource usage summary of an LSF output file.
+
+    LSF appends to the output file when a job is rerun, so this parses
+    the summary of the last run in it.
+
+    Returns:
+        dict with keys 'status' ('done', 'memlimit', 'runlimit', 'failed',
+        or None if the job has not finished), 'queue', 'max_mem_gb',
+        'requested_mem_gb' and 'time_hr' (each None if not reported)
+    """
+    def new_run():
+        return {'status': None, 'queue': None, 'max_mem_gb': None,
+                'requested_mem_gb': None, 'time_hr': None}
+    out = new_run()
+    started, reported = None, None
+    in_job_output = False
+    with open(path) as f:
+        for line in f:
+            if line.startswith('Sender: LSF System'):
+                # the summary of another run of the job
+                out = new_run()
+                started, reported = None, None
+                in_job_output = False
+                continue
+            if in_job_output:
+                continue
+            if line.startswith('The output (if any) follows'):
+                # what follows, until the summary of another run, is the
+                # output of the job itself
+                in_job_output = True
+                continue
+            line = line.strip()
+            if line.startswith('Successfully completed'):
+                out['status'] = 'done'
+            elif 'TERM_MEMLIMIT' in line:
+                out['status'] = 'memlimit'
+            elif 'TERM_RUNLIMIT' in line:
+                out['status'] = 'runlimit'
+            elif line.startswith('Exited with') or line.startswith('TERM_'):
+                if out['status'] is None:
+                    out['status'] = 'failed'
+            elif line.startswith('Job was executed on host'):
+                m = re.search('in queue <([^>]+)>', line)
+                if m:
+                    out['queue'] = m.group(1)
+            elif line.startswith('Started at'):
+                started = line[len('Started at'):].strip()
+            elif line.startswith('Results reported on') or \
+                    line.startswith('Terminated at'):
+                reported = re.sub('^(Results reported on|Terminated at)', '',
+                                  line).strip()
+            elif line.startswith('Max Memory') or \
+                    line.startswith('Total Requested Memory'):
+                m = re.search(r':\s*([0-9.]+)\s*([KMGT]B)', line)
+                if m:
+                    key = ('max_mem_gb' if line.startswith('Max')
+                           else 'requested_mem_gb')
+                    out[key] = _parse_mem_gb(m.group(1), m.group(2))
+            elif line.startswith('Run time'):
+                m = re.search(r':\s*([0-9.]+)\s*sec', line)
+                if m:
+                    out['time_hr'] = float(m.group(1)) / 3600.0
+
+    if out['time_hr'] is None and started and reported:
+        try:
+            fmt = '%a %b %d %H:%M:%S %Y'
+            elapsed = (time.mktime(time.strptime(reported, fmt)) -
+                       time.mktime(time.strptime(started, fmt)))
+            out['time_hr'] = elapsed / 3600.0
+        except ValueError:
+            pass
+    return out
+
+
+def read_lsf_history(results_path, dataset_stats):
+    """Read the LSF output files of make_probes jobs in a results
+    directory.
+
+    Args:
+        results_path: directory containing a folder for each dataset,
+            each with an output file for each choice of parameters
+        dataset_stats: dict {dataset: (number of genomes, number of
+            sequences, average sequence length)}
+
+    Returns:
+        tuple (records, outcomes) where records is a list of JobRecord
+        for jobs that completed successfully and outcomes is a dict
+        {(dataset, (mismatches, cover_extension)): parsed output file
+        (see parse_lsf_out)}
+    """
+    records = []
+    outcomes = {}
+    for dataset, (_, num_seqs, avg_seq_len) in dataset_stats.items():
+        dataset_path = os.path.join(results_path, dataset)
+        if not os.path.isdir(dataset_path):
+            continue
+        for fn in os.listdir(dataset_path):
+            m = OUT_PATTERN.match(fn)
+            if not m:
+                continue
+            params = (int(m.group(1)), int(m.group(2)))
+            out = parse_lsf_out(os.path.join(dataset_path, fn))
+            outcomes[(dataset, params)] = out
+            if out['status'] == 'done' and out['max_mem_gb'] is not None \
+                    and out['time_hr'] is not None:
+                records += [JobRecord(num_seqs * avg_seq_len, params[0],
+                                      params[1], out['max_mem_gb'],
+                                      out['time_hr'])]
+    return records, outcomes
+
+
+def read_benchmark_stats(path, dataset_stats, lsh='nolsh'):
+    """Read records of benchmark runs from a table like
+    experiments/benchmark-lsh/data/stats.tsv.
+
+    Its 'data' column gives '[dataset],m=[mismatches],e=[cover_extension]'
+    and 'sample.size' the number of genomes sampled from the dataset;
+    'time' is in seconds and 'mem' (peak RSS) in KB. Only runs with the
+    given 'lsh' value, and of datasets in dataset_stats (whose sizes give
+    the number and length of sequences per genome), are read.
+
+    Returns:
+        list of JobRecord
+    """
+    records = []
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').split('\t')))
+            if row.get('lsh') != lsh:
+                continue
+            fields = row['data'].split(',')
+            dataset = fields[0]
+            if dataset not in dataset_stats:
+                continue
+            params = dict(field.split('=') for field in fields[1:])
+            num_genomes, num_seqs, avg_seq_len = dataset_stats[dataset]
+            seqs_per_genome = float(num_seqs) / num_genomes
+            cost = (int(row['sample.size']) * seqs_per_genome *
+                    avg_seq_len)
+            records += [JobRecord(cost, int(params['m']), int(params['e']),
+                                  float(row['mem']) / 2**20,
+                                  float(row['time']) / 3600.0)]
+    return records
+
+
+def _features(cost, mismatches, cover_extension):
+    return np.array([1.0, math.log(max(cost, 1.0)), float(mismatches),
+                     float(cover_extension)])
+
+
+def _fit(x, y):
+    # least squares fit of y on x, whose first column is the intercept;
+    # returns (coef, residual standard deviation). A feature that does not
+    # vary across the records (e.g., cover_extension, if all benchmark runs
+    # used the same value) cannot be estimated and is given a coefficient
+    # of 0, rather than one that is arbitrary and extrapolates wildly.
+    active = np.ptp(x, axis=0) > 0
+    active[0] = True
+    coef = np.zeros(x.shape[1])
+    coef[active] = np.linalg.lstsq(x[:, active], y, rcond=None)[0]
+    residuals = y - x @ coef
+    dof = max(len(y) - int(np.sum(active)), 1)
+    return coef, float(np.sqrt(np.sum(residuals**2) / dof))
+
+
+class JobCostModel:
+    """Log-linear models of the memory and run time of a job.
+    """
+
+    def __init__(self, records):
+        if len(records) < MIN_RECORDS:
+            raise ValueError(("Need at least %d records of previous runs to "
+                              "fit a model, but there are %d") %
+                             (MIN_RECORDS, len(records)))
+        x = np.array([_features(r.cost, r.mismatches, r.cover_extension)
+                      for r in records])
+        self.num_records = len(records)
+        self.mem_coef, self.mem_sigma = _fit(
+            x, np.log([max(r.mem_gb, 1e-3) for r in records]))
+        self.time_coef, self.time_sigma = _fit(
+            x, np.log([max(r.time_hr, 1e-4) for r in records]))
+
+    def predict(self, cost, mismatches, cover_extension, safety_sigmas=2.0):
+        """Predict the memory (GB) and run time (hours) of a job.
+
+        Returns:
+            tuple (mem_gb, time_hr)
+        """
+        x = _features(cost, mismatches, cover_extension)
+        mem = math.exp(x @ self.mem_coef + safety_sigmas * self.mem_sigma)
+        time_hr = math.exp(x @ self.time_coef +
+                           safety_sigmas * self.time_sigma)
+        return mem, time_hr
+
+    def describe(self):
+        names = ['intercept', 'log(cost)', 'mismatches', 'cover_extension']
+        lines = ["Fit to %d records of previous runs" % self.num_records]
+        for label, coef, sigma in [('log(mem GB)', self.mem_coef,
+                                    self.mem_sigma),
+                                   ('log(time hr)', self.time_coef,
+                                    self.time_sigma)]:
+            terms = ', '.join('%s=%.4g' % (n, c) for n, c in zip(names, coef))
+            lines += ["  %s: %s; residual sd=%.3f" % (label, terms, sigma)]
+        return '\n'.join(lines)
+
+
+def escalate(outcome, mem_gb, time_hr):
+    """Escalate the memory or run time of a job whose previous run was
+    killed for exceeding its limit.
+
+    Args:
+        outcome: parsed output file of the previous run (see
+            parse_lsf_out), or None
+        mem_gb, time_hr: predicted memory and run time
+
+    Returns:
+        tuple (mem_gb, time_hr, min_queue) where min_queue is the name of
+        the queue the previous run was in if it exceeded its run limit
+        (so a queue with a longer run limit should be chosen), else None
+    """
+    if outcome is None:
+        return mem_gb, time_hr, None
+    if outcome['status'] == 'memlimit':
+        failed_mem = outcome['requested_mem_gb'] or outcome['max_mem_gb']
+        if failed_mem is not None:
+            mem_gb = max(mem_gb, 2 * failed_mem)
+    elif outcome['status'] == 'runlimit':
+        if outcome['time_hr'] is not None:
+            time_hr = max(time_hr, 2 * outcome['time_hr'])
+        return mem_gb, time_hr, outcome['queue']
+    return mem_gb, time_hr, None
+
+
+def parse_queue(s):
+    """Parse a queue given as 'NAME[:MAX_HR[:MAX_MEM_GB]]' (e.g.,
+    'week:168:64') into a tuple as in QUEUES; an omitted or empty limit
+    is no limit.
+    """
+    ls = s.split(':')
+    if len(ls) > 3 or not ls[0]:
+        raise ValueError("Queue must be NAME[:MAX_HR[:MAX_MEM_GB]], not " + s)
+    limits = [float(v) if v else None for v in ls[1:]]
+    limits += [None] * (2 - len(limits))
+    return (ls[0], limits[0], limits[1])
+
+
+def choose_queue(mem_gb, time_hr, min_queue=None, queues=QUEUES):
+    """Choose the first queue in queues (as in QUEUES) whose limits fit
+    the job, and that comes after min_queue (if given).
+    """
+    names = [name for name, _, _ in queues]
+    start = names.index(min_queue) + 1 if min_queue in names else 0
+    for name, max_hr, max_mem in queues[start:]:
+        if (max_hr is None or time_hr <= max_hr) and \
+                (max_mem is None or mem_gb <= max_mem):
+            return name
+    return queues[-1][0]
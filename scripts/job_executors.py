@@ -0,0 +1,222 @@
+"""Run a collection of jobs (commands) on one of several backends.
+
+A job is a command that writes an output file. The backends are:
+  lsf: print a bsub command for each job (to be submitted to LSF)
+  local: run the jobs on this machine, with as many at once as fit
+      within a number of cores and an amount of memory
+  parallel: write a file with one shell command per job, which can be
+      run with GNU parallel (e.g., 'parallel --jobs 8 < FILE')
+
+Jobs are meant to be resumable: a caller should only give jobs whose
+output file does not exist, and the local and parallel backends remove
+the output file of a job that fails so that it is run again next time.
+"""
+
+from collections import namedtuple
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# cmd is a list of arguments; out_path is where to write the job's
+# stdout and stderr; output_path is the file the job writes (removed if
+# the job fails); num_processes and mem_gb are the cores and memory (in
+# GB) the job needs, or None if unknown (LSF reserves them, but the
+# local and parallel backends only use them to decide how many jobs to
+# run at once)
+Job = namedtuple('Job', ['cmd', 'out_path', 'output_path', 'num_processes',
+                         'mem_gb'])
+
+EXECUTORS = ['lsf', 'local', 'parallel']
+
+
+def available_cores():
+    # return the number of cores this process can run on
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+
+
+def total_mem_gb():
+    # return the total physical memory of this machine, in GB
+    return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') /
+            2.0**30)
+
+
+class LSFExecutor:
+    """Print a bsub command for each job.
+    """
+
+    def __init__(self, queue, project=None):
+        self.queue = queue
+        self.project = project
+
+    def bsub_cmd(self, job):
+        cmd = ["bsub"]
+        cmd += ["-o", job.out_path]
+        cmd += ["-q", self.queue]
+        if self.project is not None:
+            cmd += ["-P", self.project]
+        if job.num_processes is not None:
+            cmd += ["-n", str(job.num_processes)]
+            cmd += ["-R", "\"span[hosts=1]\""]
+        if job.mem_gb is not None:
+            cmd += ["-R", "\"rusage[mem=" + str(job.mem_gb) + "]\""]
+        return cmd + job.cmd
+
+    def run(self, jobs):
+        for job in jobs:
+            print(' '.join(self.bsub_cmd(job)))
+        return 0
+
+
+class CommandFileExecutor:
+    """Write a file with a shell command for each job, to be run with
+    GNU parallel.
+    """
+
+    def __init__(self, path, max_cores=None):
+        self.path = path
+        self.max_cores = max_cores or available_cores()
+
+    def shell_cmd(self, job):
+        # redirect output to job.out_path and, if the job fails, remove
+        # its partial output and still exit with failure (so that GNU
+        # parallel reports the job as failed)
+        return (' '.join(shlex.quote(arg) for arg in job.cmd) +
+                ' > ' + shlex.quote(job.out_path) + ' 2>&1' +
+                ' || { rm -f ' + shlex.quote(job.output_path) + '; exit 1; }')
+
+    def run(self, jobs):
+        jobs = list(jobs)
+        with open(self.path, 'w') as f:
+            for job in jobs:
+                f.write(self.shell_cmd(job) + '\n')
+
+        num_processes = max([job.num_processes or 1 for job in jobs] or [1])
+        print(("Wrote %d commands to %s; run them with:\n"
+               "  parallel --jobs %d < %s") % (len(jobs), self.path,
+              max(1, self.max_cores // num_processes), self.path))
+        return 0
+
+
+class LocalExecutor:
+    """Run jobs on this machine.
+
+    A job is started whenever its cores and memory fit within max_cores
+    and max_mem_gb, along with those of the jobs already running (or
+    when no job is running, so that a job needing more than these still
+    runs). A job's num_processes and mem_gb are hints used only for this
+    scheduling: neither is enforced, so a job that uses more cores or
+    memory than it declares is neither pinned to cores nor killed.
+    """
+
+    def __init__(self, max_cores=None, max_mem_gb=None, poll_interval=0.5):
+        self.max_cores = max_cores or available_cores()
+        self.max_mem_gb = max_mem_gb or total_mem_gb()
+        self.poll_interval = poll_interval
+
+    def _start(self, job):
+        out = open(job.out_path, 'w')
+        try:
+            return subprocess.Popen(job.cmd, stdout=out,
+                                    stderr=subprocess.STDOUT)
+        finally:
+            out.close()
+
+    def _remove_output(self, job):
+        if os.path.exists(job.output_path):
+            os.unlink(job.output_path)
+
+    def run(self, jobs):
+        pending = list(jobs)
+        num_jobs = len(pending)
+        running = []    # list of (job, Popen)
+        num_done, failed = 0, []
+        cores_used, mem_used = 0, 0.0
+
+        def fits(job):
+            if not running:
+                return True
+            return (cores_used + (job.num_processes or 1) <= self.max_cores
+                    and mem_used + (job.mem_gb or 0) <= self.max_mem_gb)
+
+        try:
+            while pending or running:
+                # Start jobs, in order, while the next one fits
+                while pending and fits(pending[0]):
+                    job = pending.pop(0)
+                    running += [(job, self._start(job))]
+                    cores_used += job.num_processes or 1
+                    mem_used += job.mem_gb or 0
+
+                time.sleep(self.poll_interval)
+
+                still_running = []
+                for job, proc in running:
+                    returncode = proc.poll()
+                    if returncode is None:
+                        still_running += [(job, proc)]
+                        continue
+                    cores_used -= job.num_processes or 1
+                    mem_used -= job.mem_gb or 0
+                    num_done += 1
+                    if returncode != 0:
+                        failed += [job]
+                        self._remove_output(job)
+                        print("FAILED (exit code %d; see %s)" % (returncode,
+                              job.out_path), file=sys.stderr)
+                    print("Finished %d of %d jobs" % (num_done, num_jobs),
+                          file=sys.stderr)
+                running = still_running
+        except KeyboardInterrupt:
+            # Stop the running jobs and remove their partial output, so
+            # that they are run again when resuming
+            for job, proc in running:
+                proc.terminate()
+            for job, proc in running:
+                proc.wait()
+                self._remove_output(job)
+            raise
+
+        return len(failed)
+
+
+def add_executor_args(parser, default='lsf'):
+    # add arguments to an argparse parser for choosing and configuring
+    # an executor (see executor_from_args)
+    parser.add_argument("--executor", choices=EXECUTORS, default=default,
+                        help=("how to run jobs: 'lsf' prints bsub "
+                              "commands; 'local' runs them on this "
+                              "machine; 'parallel' writes a file of "
+                              "commands for GNU parallel"))
+    parser.add_argument("--max_cores", type=int,
+                        help=("with 'local' or 'parallel', number of cores "
+                              "to schedule jobs on, by the cores each job "
+                              "declares; not enforced (default: all "
+                              "available)"))
+    parser.add_argument("--max_mem_gb", type=float,
+                        help=("with 'local', memory (GB) to schedule jobs "
+                              "within, by the memory each job declares; "
+                              "not enforced (default: all of this "
+                              "machine's)"))
+    parser.add_argument("--commands_file",
+                        help="with 'parallel', path to the file to write")
+
+
+def executor_from_args(args, queue, project=None):
+    # return an executor as chosen by the arguments added with
+    # add_executor_args; queue and project are for LSF
+    if args.executor == 'lsf':
+        return LSFExecutor(queue, project)
+    elif args.executor == 'local':
+        return LocalExecutor(args.max_cores, args.max_mem_gb)
+    else:
+        if args.commands_file is None:
+            raise ValueError("--commands_file is required with 'parallel'")
+        return CommandFileExecutor(args.commands_file, args.max_cores)
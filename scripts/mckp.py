@@ -0,0 +1,207 @@
+"""Solve the multiple-choice knapsack problem (MCKP).
+
+There are groups of items, where each item has a loss and a count; the
+problem is to choose exactly one item from each group so as to minimize
+the total loss, subject to the total count being less than a maximum.
+
+This is solved exactly with dynamic programming over the total loss:
+when losses are (multiples of) small integers, as they are for the loss
+over parameter values in find_optimal_params, the number of achievable
+total losses is small even when counts are very large, so this is much
+faster than dynamic programming over the counts.
+"""
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def _quantize(losses, counts, loss_resolution):
+    q_losses = [np.rint(np.asarray(l, dtype=float) /
+                        loss_resolution).astype(np.int64) for l in losses]
+    counts = [np.asarray(c, dtype=float) for c in counts]
+    if any(np.any(l < 0) for l in q_losses):
+        raise ValueError("Losses must be non-negative")
+    return q_losses, counts
+
+
+def _tabulate(q_losses, counts):
+    """Find the smallest total count achieving each total (quantized) loss.
+
+    Returns:
+        tuple (min_counts, choices) where min_counts[l] is the smallest
+        total count achieving a total loss of l (inf if l is not
+        achievable) and choices[g][l] is the item chosen from group g to
+        achieve it, given the choices for groups 0..g-1
+    """
+    min_counts = np.zeros(1)
+    choices = []
+    for g in range(len(q_losses)):
+        group_losses, group_counts = q_losses[g], counts[g]
+        size = len(min_counts) + int(np.max(group_losses))
+        candidates = np.full((len(group_losses), size), np.inf)
+        for j in range(len(group_losses)):
+            l = group_losses[j]
+            candidates[j, l:l + len(min_counts)] = min_counts + group_counts[j]
+        choice_dtype = np.uint8 if len(group_losses) <= 256 else np.int32
+        group_choices = np.argmin(candidates, axis=0).astype(choice_dtype)
+        min_counts = candidates[group_choices, np.arange(size)]
+        choices += [group_choices]
+    return min_counts, choices
+
+
+def _trace_back(losses, counts, q_losses, choices, total_q_loss):
+    """Find the items chosen to achieve a total (quantized) loss.
+
+    Returns:
+        tuple (choices, total loss, total count), as returned by solve()
+    """
+    chosen = [0] * len(q_losses)
+    l = total_q_loss
+    for g in reversed(range(len(q_losses))):
+        j = int(choices[g][l])
+        chosen[g] = j
+        l -= q_losses[g][j]
+    assert l == 0
+
+    total_loss = sum(float(losses[g][j]) for g, j in enumerate(chosen))
+    total_count = sum(float(counts[g][j]) for g, j in enumerate(chosen))
+    return chosen, total_loss, total_count
+
+
+def table_size(losses, loss_resolution=1.0):
+    """Count the cells in the dynamic programming table.
+
+    The table has, for each group, one row per item and one column per
+    achievable total (quantized) loss, so its size (and memory) grows
+    with the sum of the largest losses; this allows checking that it is
+    feasible to build before solving.
+
+    Returns:
+        number of cells in the table for losses (see solve())
+    """
+    num_cells = 0
+    num_totals = 1
+    for group_losses in losses:
+        q = np.rint(np.asarray(group_losses, dtype=float) / loss_resolution)
+        num_totals += int(np.max(q))
+        num_cells += len(group_losses) * num_totals
+    return num_cells
+
+
+def solve(losses, counts, max_count, loss_resolution=1.0):
+    """Choose one item from each group to minimize total loss.
+
+    Losses are quantized to multiples of loss_resolution; the solution
+    is exact when every loss is a multiple of loss_resolution. Among
+    choices with equal total loss, one with the smallest total count is
+    chosen.
+
+    Args:
+        losses: list, with one element per group, of lists giving the
+            loss of each item in the group (each loss must be >= 0)
+        counts: list, parallel to losses, of lists giving the count of
+            each item in each group
+        max_count: the total count of the chosen items must be less
+            than this
+        loss_resolution: losses are rounded to the nearest multiple of
+            this value
+
+    Returns:
+        tuple (choices, total loss, total count) where choices[g] is the
+        index of the item chosen from group g; or None if no choice of
+        items yields a total count less than max_count
+    """
+    return solve_for_max_counts(losses, counts, [max_count],
+                                loss_resolution=loss_resolution)[0]
+
+
+def solve_for_max_counts(losses, counts, max_counts, loss_resolution=1.0):
+    """Solve the problem for each of many maximum total counts.
+
+    The dynamic programming table does not depend on the maximum total
+    count, so it is computed once and each solution is traced back from
+    it.
+
+    Args:
+        losses: list of lists giving the loss of each item in each group
+            (see solve())
+        counts: list of lists giving the count of each item in each group
+        max_counts: list of maximum total counts (exclusive)
+        loss_resolution: losses are rounded to the nearest multiple of
+            this value
+
+    Returns:
+        list, parallel to max_counts, of solutions as returned by solve()
+    """
+    q_losses, counts_arr = _quantize(losses, counts, loss_resolution)
+    min_counts, choices = _tabulate(q_losses, counts_arr)
+
+    sols = []
+    for max_count in max_counts:
+        feasible = np.flatnonzero(min_counts < max_count)
+        if len(feasible) == 0:
+            sols += [None]
+        else:
+            sols += [_trace_back(losses, counts, q_losses, choices,
+                                 feasible[0])]
+    return sols
+
+
+def lagrangian_lower_bound(losses, counts, max_count, num_iterations=100):
+    """Compute a lower bound on the optimal total loss by Lagrangian
+    relaxation of the constraint on the total count.
+
+    For a multiplier lam >= 0, choosing in each group the item minimizing
+    loss + lam*count, and subtracting lam*max_count, gives a lower bound
+    on the optimal total loss. The bound is a concave function of lam,
+    which is maximized here by bisection on its subgradient.
+
+    Args:
+        losses: list of lists giving the loss of each item in each group
+        counts: list of lists giving the count of each item in each group
+        max_count: bound on the total count of chosen items
+        num_iterations: number of bisection steps
+
+    Returns:
+        lower bound on the optimal total loss
+    """
+    losses = [np.asarray(l, dtype=float) for l in losses]
+    counts = [np.asarray(c, dtype=float) for c in counts]
+
+    def bound_and_subgradient(lam):
+        bound, total_count = -lam * max_count, 0.0
+        for l, c in zip(losses, counts):
+            j = np.argmin(l + lam * c)
+            bound += l[j] + lam * c[j]
+            total_count += c[j]
+        return bound, total_count - max_count
+
+    best_bound, subgradient = bound_and_subgradient(0.0)
+    if subgradient <= 0:
+        # The constraint is not binding
+        return best_bound
+
+    # Find an upper end for the multiplier, at which the relaxed choice
+    # satisfies the constraint
+    lam_lo, lam_hi = 0.0, 1.0
+    while True:
+        bound, subgradient = bound_and_subgradient(lam_hi)
+        best_bound = max(best_bound, bound)
+        if subgradient <= 0:
+            break
+        lam_lo, lam_hi = lam_hi, 2.0 * lam_hi
+        if lam_hi > 1e12:
+            # The constraint cannot be satisfied by any choice; the
+            # bound grows without limit
+            return float('inf')
+
+    for i in range(num_iterations):
+        lam = 0.5 * (lam_lo + lam_hi)
+        bound, subgradient = bound_and_subgradient(lam)
+        best_bound = max(best_bound, bound)
+        if subgradient > 0:
+            lam_lo = lam
+        else:
+            lam_hi = lam
+    return best_bound
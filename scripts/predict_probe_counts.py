@@ -0,0 +1,117 @@
+#!/bin/python3
+"""Predict probe counts at the parameter values for which they are
+missing, and report which can be predicted confidently.
+
+This fits a surrogate model to each dataset's probe counts (see
+probe_count_surrogate) and writes a tsv table with one row per
+(dataset, parameter values) at which a count is missing, giving the
+predicted count, its estimated relative error, and whether that error
+is at most --max_rel_error. make_probes jobs need not be run for
+confidently predicted points; generate_bsubs.py skips them when given
+this table with --predicted_probe_counts, or when the collection's
+'predicted_probe_counts' path in the registry points to it.
+"""
+
+import argparse
+
+import probe_count_surrogate
+import utils
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# columns of a table of predictions, after the parameter columns
+PREDICTION_COLUMNS = ["predicted_num_probes", "rel_error", "confident"]
+
+
+def write_predictions(path, predictions, param_names, max_rel_error):
+    with open(path, 'w') as f:
+        f.write('\t'.join(["dataset"] + list(param_names) +
+                          PREDICTION_COLUMNS) + '\n')
+        for dataset in sorted(predictions.keys()):
+            for params, (count, rel_err) in sorted(
+                    predictions[dataset].items()):
+                row = ([dataset] + [str(v) for v in params] +
+                       [str(count), "%f" % rel_err,
+                        "1" if rel_err <= max_rel_error else "0"])
+                f.write('\t'.join(row) + '\n')
+
+
+def read_confident_predictions(path, param_names=("mismatches",
+                                                  "cover_extension")):
+    """Read the (dataset, parameter values) that are confidently
+    predicted from a table written by this script.
+
+    Returns:
+        set of tuples (dataset, param values)
+    """
+    confident = set()
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        for line in f:
+            row = dict(zip(header, line.rstrip('\n').split('\t')))
+            if row['confident'] == '1':
+                confident.add((row['dataset'],
+                               tuple(int(row[name]) for name in param_names)))
+    return confident
+
+
+def main(args):
+    if args.probe_count_table:
+        table = utils.read_probe_count_table(args.probe_count_table)
+        probe_counts = utils.probe_counts_from_table(table,
+            use_n_expanded_counts=args.use_n_expanded_counts,
+            limit_datasets=args.limit_datasets,
+            param_names=args.param_names)
+    else:
+        param_names = args.param_names
+        if tuple(param_names) == ("mismatches", "cover_extension"):
+            # Read filenames with the default pattern
+            param_names = None
+        probe_counts = utils.read_probe_counts(args,
+            use_n_expanded_counts=args.use_n_expanded_counts,
+            param_names=param_names)
+
+    predictions = probe_count_surrogate.predict_missing_counts(probe_counts)
+    write_predictions(args.output, predictions, args.param_names,
+                      args.max_rel_error)
+
+    num_missing = sum(len(v) for v in predictions.values())
+    num_confident = sum(1 for v in predictions.values()
+                        for _, rel_err in v.values()
+                        if rel_err <= args.max_rel_error)
+    print(("%d probe counts are missing; %d of them are predicted with "
+           "an estimated relative error of at most %f") %
+          (num_missing, num_confident, args.max_rel_error))
+
+
+if __name__ == "__main__":
+    argparse = argparse.ArgumentParser()
+    input_group = argparse.add_mutually_exclusive_group(required=True)
+    input_group.add_argument('--results_dir', '-i',
+                             help=("Directory containing a folder of "
+                                   "results for each dataset"))
+    input_group.add_argument('--probe_count_table', '-t',
+                             help=("Table of probe counts written by "
+                                   "index_probe_counts.py"))
+    argparse.add_argument('--limit_datasets', '-d', nargs='+')
+    argparse.add_argument('--output', '-o', required=True,
+                          help="Path to tsv table of predictions to write")
+    argparse.add_argument('--param_names', nargs='+',
+                          default=["mismatches", "cover_extension"],
+                          help=("Parameters by which probe counts are "
+                                "keyed (columns of the probe count table)"))
+    argparse.add_argument('--max_rel_error', type=float, default=0.05,
+                          help=("Predictions whose estimated relative "
+                                "error is at most this are marked as "
+                                "confident"))
+    argparse.add_argument('--use_n_expanded_counts',
+                          dest='use_n_expanded_counts',
+                          action='store_true')
+    argparse.add_argument('--num_scan_workers', type=int,
+                          default=utils.DEFAULT_NUM_SCAN_WORKERS,
+                          help=("Number of threads to use when counting "
+                                "probes in the results directory"))
+    args = argparse.parse_args()
+
+    main(args)
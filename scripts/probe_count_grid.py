@@ -0,0 +1,442 @@
+"""Vectorized interpolation of probe counts across datasets.
+
+The probe counts of every dataset are stored in a single dense array on
+the lattice of parameter values (e.g., of mismatches and cover_extension)
+for which counts have been computed, so that the interpolated probe
+count of all datasets, at parameter values given for each, can be
+evaluated in one vectorized call. The parameter space may have any
+number of dimensions; counts are interpolated multilinearly.
+"""
+
+from collections import namedtuple
+import itertools
+
+import numpy as np
+
+import profiling
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+# A dimension of the parameter space: its name (as in the columns of a
+# probe count table), the spacing of the values to which it is rounded,
+# and the weight of its squared value in the loss over parameters. Larger
+# values of each parameter should (generally) yield fewer probes.
+ParamDim = namedtuple('ParamDim', ['name', 'step', 'loss_weight'])
+
+# The parameter space of find_optimal_params by default: mismatches and
+# cover_extension, with cover_extension down-weighted by a factor of 10.0
+DEFAULT_PARAM_DIMS = (ParamDim('mismatches', 1, 1.0),
+                      ParamDim('cover_extension', 10, 0.01))
+
+# Number of boxes at a time for which ProbeCountGrid checks which datasets
+# have a probe count at every corner, when finding the smallest box
+# around each position (see ProbeCountGrid._build_box_index)
+BOX_CHUNK_SIZE = 4096
+
+
+def parse_param_dim(s):
+    """Parse a dimension of the parameter space from a string
+    NAME:STEP:LOSS_WEIGHT (e.g., 'cover_extension:10:0.01').
+    """
+    try:
+        name, step, loss_weight = s.split(':')
+        return ParamDim(name, int(step), float(loss_weight))
+    except ValueError:
+        raise ValueError(("Parameter dimension must be given as "
+                          "NAME:STEP:LOSS_WEIGHT, not '%s'") % s)
+
+
+class ProbeCountGrid:
+    """Probe counts of each dataset on a lattice of parameter values.
+
+    Datasets are ordered by name (i.e., as sorted(probe_counts.keys())),
+    which is the order used for parameter vectors throughout
+    find_optimal_params. Lattice points at which a dataset does not have
+    a probe count are NaN in counts.
+    """
+
+    def __init__(self, probe_counts, steps=None):
+        """
+        Args:
+            probe_counts: dict {dataset: {param values: probe count}},
+                where each key of the inner dict is a tuple giving a
+                value for each of the (same) parameters
+            steps: list giving, for each parameter, a scale with which
+                to compare the sizes of boxes around a point (see
+                _build_box_index); if None, 1 for each parameter
+        """
+        self.probe_counts = probe_counts
+        self.datasets = sorted(probe_counts.keys())
+        ndims = set(len(k) for d in probe_counts.values() for k in d.keys())
+        if len(ndims) != 1:
+            raise ValueError(("Probe counts must all be keyed by the same "
+                              "number of parameters"))
+        self.ndim = ndims.pop()
+        self.steps = (np.ones(self.ndim) if steps is None else
+                      np.array(steps, dtype=float))
+        self.axes = [np.array(sorted(set(
+            k[j] for d in probe_counts.values() for k in d.keys())),
+            dtype=float) for j in range(self.ndim)]
+
+        axes_idx = [{v: i for i, v in enumerate(axis)} for axis in self.axes]
+        self.counts = np.full((len(self.datasets),) +
+                              tuple(len(axis) for axis in self.axes), np.nan)
+        for i, dataset in enumerate(self.datasets):
+            for params, count in probe_counts[dataset].items():
+                self.counts[(i,) + tuple(axes_idx[j][v] for j, v in
+                                         enumerate(params))] = count
+
+        # Each corner of a cell, given as whether it is at the upper (1)
+        # or lower (0) value along each dimension; corner k is at the
+        # upper value along dimension j iff bit j of k is set
+        self._corner_bits = np.array([bits[::-1] for bits in
+            itertools.product([0, 1], repeat=self.ndim)], dtype=bool)
+
+        # Offsets, in self.counts (flattened), of each dataset and of
+        # each lattice value along each dimension
+        self._flat_counts = self.counts.ravel()
+        self._offsets = np.array(self.counts.strides) // self.counts.itemsize
+
+        # Whether each corner is at the upper value along each dimension,
+        # as ints with which to add up the offsets of the corner
+        self._corner_steps = self._corner_bits.astype(int)
+
+        # For each dimension, the corners at its lower value
+        self._lower_corners = [np.flatnonzero(~self._corner_bits[:, j])
+                               for j in range(self.ndim)]
+
+        self._build_box_index()
+
+    def _cell(self, axis, vals):
+        """Find the lattice cell along one axis containing each value.
+
+        Returns:
+            tuple (lo, hi, outside) where lo and hi are the indices of
+            the lattice values on each side of each value and outside is
+            a mask of values outside the lattice
+        """
+        n = len(axis)
+        lo = np.clip(np.searchsorted(axis, vals, side='right') - 1, 0,
+                     max(n - 2, 0))
+        hi = np.minimum(lo + 1, n - 1)
+        outside = (vals < axis[0]) | (vals > axis[-1])
+        return lo, hi, outside
+
+    def _build_box_index(self):
+        """Find, up front, the smallest box whose corners all have probe
+        counts around every position in the lattice, for each dataset.
+
+        This is used when the lattice cell around a point is missing a
+        corner. Along each dimension, a point is either below the
+        lattice, at a lattice value, between two lattice values, or
+        above the lattice; position p (0 <= p <= 2*len(axis)) gives
+        which, such that p = left + right where left and right are the
+        indices at which the value would be inserted into the axis on
+        the left and right. Each side of a box may be degenerate (i.e.,
+        if the point is at a lattice value along that dimension). The
+        size of a box is the product, over dimensions, of its width
+        (relative to that dimension's step) plus a pseudocount, so that
+        a box of zero width along one dimension is still compared by
+        its other dimensions; among boxes of equal size, the first in
+        lattice order (i.e., ordered by the indices of its lower and
+        then upper value along the first dimension, then the second,
+        etc.) is chosen.
+
+        The number of boxes grows as the product, over dimensions, of
+        n(n+1)/2 for an axis of n values, so boxes are considered in
+        order of size BOX_CHUNK_SIZE at a time, and only until every
+        position has a box for every dataset (or all have been
+        considered). Only the boxes that are chosen are kept.
+
+        Sets self._box_lo and self._box_hi, giving the indices of the
+        lattice values at the lower and upper corner of each chosen box
+        (ordered by size); self._box_row, giving for each dataset its row
+        in self._box_index or -1 if it has a probe count at every
+        lattice point (so that the lattice cell around a point inside
+        the lattice always has all its corners); and self._box_index,
+        such that self._box_index[self._box_row[d], k] gives the box
+        chosen around the k'th position (flattened over
+        self._positions_shape) for dataset d, or -1 if there is no such
+        box.
+        """
+        sizes = [len(axis) for axis in self.axes]
+        self._positions_shape = tuple(2 * n + 1 for n in sizes)
+
+        num_datasets = len(self.datasets)
+        missing = np.flatnonzero(
+            np.isnan(self.counts.reshape(num_datasets, -1)).any(axis=1))
+        self._box_row = np.full(num_datasets, -1, dtype=np.int64)
+        self._box_row[missing] = np.arange(len(missing))
+        box_index = np.full((len(missing),
+                             int(np.prod(self._positions_shape))),
+                            -1, dtype=np.int64)
+        self._box_lo = np.zeros((0, self.ndim), dtype=int)
+        self._box_hi = np.zeros((0, self.ndim), dtype=int)
+        if len(missing) == 0:
+            self._box_index = box_index.astype(np.int32)
+            return
+
+        # Number every box in lattice order, as a (lo, hi) pair of
+        # indices along each dimension, and order them by size
+        pairs = [np.array([(lo, hi) for lo in range(n)
+                           for hi in range(lo, n)]) for n in sizes]
+        box_size = np.ones(1)
+        for j, (axis, p) in enumerate(zip(self.axes, pairs)):
+            width = (axis[p[:, 1]] - axis[p[:, 0]]) / self.steps[j]
+            box_size = np.multiply.outer(box_size, width + 0.001).ravel()
+        order = np.argsort(box_size, kind='stable')
+        del box_size
+
+        # Positions inside the lattice (points outside it, at position 0
+        # or 2*len(axis) along a dimension, are not contained in any
+        # box), and whether each is still without a box for each dataset
+        inner = np.array(list(itertools.product(*[range(1, 2 * n)
+                                                  for n in sizes])),
+                         dtype=int).reshape(-1, self.ndim)
+        inner_k = np.ravel_multi_index(inner.T, self._positions_shape)
+        unresolved = np.ones((len(missing), len(inner)), dtype=bool)
+
+        chosen = np.full(box_index.shape, -1, dtype=np.int64)
+        for start in range(0, len(order), BOX_CHUNK_SIZE):
+            chunk = order[start:start + BOX_CHUNK_SIZE]
+            pair_idx = np.unravel_index(chunk, [len(p) for p in pairs])
+            box_lo = np.stack([p[i, 0] for p, i in zip(pairs, pair_idx)],
+                              axis=1)
+            box_hi = np.stack([p[i, 1] for p, i in zip(pairs, pair_idx)],
+                              axis=1)
+
+            # Determine which boxes have a probe count at every corner
+            # for each dataset
+            corner_offsets = np.stack([
+                np.where(bits, box_hi, box_lo) @ self._offsets[1:]
+                for bits in self._corner_bits])
+            base = missing * self._offsets[0]
+            complete = np.ones((len(missing), len(chunk)), dtype=bool)
+            for offsets in corner_offsets:
+                complete &= ~np.isnan(self._flat_counts[
+                    base[:, np.newaxis] + offsets[np.newaxis, :]])
+
+            # A box contains the points at position p along dimension j
+            # iff 2*lo + 1 <= p <= 2*hi + 1
+            contains = [(np.arange(2 * n + 1)[:, np.newaxis] >=
+                         2 * box_lo[:, j] + 1) &
+                        (np.arange(2 * n + 1)[:, np.newaxis] <=
+                         2 * box_hi[:, j] + 1)
+                        for j, n in enumerate(sizes)]
+            for i in np.flatnonzero(unresolved.any(axis=0)):
+                in_box = contains[0][inner[i, 0]]
+                for j in range(1, self.ndim):
+                    in_box = in_box & contains[j][inner[i, j]]
+                candidates = np.flatnonzero(in_box)
+                if len(candidates) == 0:
+                    continue
+                rows = np.flatnonzero(unresolved[:, i])
+                c = complete[np.ix_(rows, candidates)]
+                found = c.any(axis=1)
+                chosen[rows[found], inner_k[i]] = \
+                    start + candidates[c[found].argmax(axis=1)]
+                unresolved[rows[found], i] = False
+            if not unresolved.any():
+                break
+
+        # Keep only the chosen boxes, renumbered in order of size
+        used = np.unique(chosen[chosen >= 0])
+        pair_idx = np.unravel_index(order[used], [len(p) for p in pairs])
+        self._box_lo = np.stack([p[i, 0] for p, i in zip(pairs, pair_idx)],
+                                axis=1).reshape(-1, self.ndim)
+        self._box_hi = np.stack([p[i, 1] for p, i in zip(pairs, pair_idx)],
+                                axis=1).reshape(-1, self.ndim)
+        box_index[chosen >= 0] = np.searchsorted(used, chosen[chosen >= 0])
+        self._box_index = box_index.astype(np.int32)
+
+    def _corners(self, x, idx=None):
+        """Find the box of measured parameter values, and the probe
+        counts at its corners, around each dataset's parameter values.
+
+        Args:
+            x: list of parameter values across datasets (see interp())
+            idx: if set, indices of the datasets (in self.datasets) whose
+                parameter values are given in x
+
+        Returns:
+            tuple (x, lo_vals, hi_vals, corner_counts) where x, lo_vals
+            and hi_vals are lists giving, for each dimension, an array of
+            the parameter values of each dataset and of the lower and
+            upper corners of its box, and corner_counts[k] gives the
+            count of each dataset at corner k (ordered as
+            self._corner_bits)
+        """
+        x = np.asarray(x, dtype=float).reshape(-1, self.ndim)
+        x = [x[:, j] for j in range(self.ndim)]
+        d = np.arange(len(self.datasets)) if idx is None else np.asarray(idx)
+        lo, hi = [], []
+        outside = np.zeros(len(d), dtype=bool)
+        for axis, vals in zip(self.axes, x):
+            lo_j, hi_j, outside_j = self._cell(axis, vals)
+            lo += [lo_j]
+            hi += [hi_j]
+            outside |= outside_j
+
+        def corner_counts(rows):
+            # Find the offset, in the flattened counts, of the lower
+            # corner of the box for each row and add, for each corner,
+            # the offsets of the dimensions along which it is at the
+            # upper value
+            base = d[rows] * self._offsets[0]
+            steps = []
+            for j in range(self.ndim):
+                base = base + lo[j][rows] * self._offsets[j + 1]
+                steps += [(hi[j][rows] - lo[j][rows]) * self._offsets[j + 1]]
+            offsets = base[np.newaxis, :] + \
+                self._corner_steps @ np.vstack(steps)
+            return self._flat_counts[offsets]
+
+        c = corner_counts(slice(None))
+
+        # Fall back on searching for a bounding box for datasets whose
+        # lattice cell is not fully measured
+        needs_fallback = np.flatnonzero(np.isnan(c).any(axis=0) | outside)
+        profiling.count('interp_calls')
+        profiling.count('interp_rows', len(d))
+        profiling.count('interp_fallback_rows', len(needs_fallback))
+        if len(needs_fallback) > 0:
+            position = [np.searchsorted(axis, vals[needs_fallback],
+                                        side='left') +
+                        np.searchsorted(axis, vals[needs_fallback],
+                                        side='right')
+                        for axis, vals in zip(self.axes, x)]
+            rows = self._box_row[d[needs_fallback]]
+            box = np.where(rows >= 0, self._box_index[rows,
+                np.ravel_multi_index(position, self._positions_shape)], -1)
+            if np.any(box < 0):
+                i = needs_fallback[np.flatnonzero(box < 0)[0]]
+                point = tuple(float(vals[i]) for vals in x)
+                raise ValueError(("Unable to interpolate probe count at "
+                                  "parameter values %s for dataset %s") %
+                                 (point, self.datasets[d[i]]))
+            for j in range(self.ndim):
+                lo[j][needs_fallback] = self._box_lo[box, j]
+                hi[j][needs_fallback] = self._box_hi[box, j]
+            c[:, needs_fallback] = corner_counts(needs_fallback)
+
+        lo_vals = [axis[lo_j] for axis, lo_j in zip(self.axes, lo)]
+        hi_vals = [axis[hi_j] for axis, hi_j in zip(self.axes, hi)]
+        return x, lo_vals, hi_vals, c
+
+    @staticmethod
+    def _corner_weights(f, dims):
+        """Compute the weight of each corner of a box, as the product of
+        its weight along each of the given dimensions.
+
+        Args:
+            f: list giving, for each dimension, an array of the
+                fractional position of each point between the lower (0)
+                and upper (1) side of its box
+            dims: dimensions to weight by
+
+        Returns:
+            list giving, for each corner over dims (ordered as
+            self._corner_bits, restricted to dims), an array of its
+            weight for each point
+        """
+        if not dims:
+            return [np.ones(len(f[0]))]
+        weights = [1 - f[dims[-1]], f[dims[-1]]]
+        for j in reversed(dims[:-1]):
+            # Split each corner along dimension j, so that it varies
+            # fastest
+            weights = [w * fj for w in weights for fj in (1 - f[j], f[j])]
+        return weights
+
+    def _interp(self, x, with_grad, idx=None):
+        x, lo_vals, hi_vals, c = self._corners(x, idx=idx)
+
+        width = [h - l for l, h in zip(lo_vals, hi_vals)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = [np.where(w > 0, (v - l) / w, 0.0)
+                 for v, l, w in zip(x, lo_vals, width)]
+
+        dims = list(range(self.ndim))
+        vals = sum(w * c_k for w, c_k in
+                   zip(self._corner_weights(f, dims), c))
+        if not with_grad:
+            return vals
+
+        # Within a cell the interpolant is multilinear, so its partial
+        # derivative along a dimension is the slope along each edge in
+        # that dimension weighted by the position along the other
+        # dimensions; along a dimension on which the box is degenerate
+        # (zero width), the derivative is taken to be 0
+        grad = np.empty((len(vals), self.ndim))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for j in dims:
+                weights = self._corner_weights(f, dims[:j] + dims[j + 1:])
+                slope = sum(w * (c[k + (1 << j)] - c[k]) for w, k in
+                            zip(weights, self._lower_corners[j]))
+                grad[:, j] = np.where(width[j] > 0, slope / width[j], 0.0)
+        return vals, grad.ravel()
+
+    def interp(self, x, idx=None):
+        """Interpolate (multilinearly) the probe count of every dataset.
+
+        Args:
+            x: list giving all the parameter values across datasets,
+                such that, with N parameters, x_{N*i+j} gives the value
+                of the j'th parameter for the i'th dataset (e.g., for
+                mismatches and cover_extension, x_{2i} gives the number
+                of mismatches and x_{2i+1} the cover extension); each
+                may be a float
+            idx: if set, x only gives parameter values for the datasets
+                with these indices (in self.datasets), in this order
+
+        Returns:
+            numpy array giving the interpolated probe count of each
+            dataset (or of each dataset in idx)
+        """
+        return self._interp(x, False, idx=idx)
+
+    def interp_with_grad(self, x):
+        """Interpolate the probe count of every dataset, along with its
+        gradient.
+
+        Because the interpolation is piecewise multilinear, the gradient
+        is exact within each cell; on a cell boundary it is the
+        derivative from the side of the cell that is used for
+        interpolation.
+
+        Args:
+            x: list of parameter values across datasets (see interp())
+
+        Returns:
+            tuple (vals, grad) where vals is as returned by interp() and
+            grad is a numpy array, laid out like x, such that grad_{N*i+j}
+            is the partial derivative of the probe count of the i'th
+            dataset with respect to its j'th parameter
+        """
+        return self._interp(x, True)
+
+    def total(self, x):
+        """Sum the interpolated probe counts across datasets.
+
+        Args:
+            x: list of parameter values across datasets (see interp())
+
+        Returns:
+            interpolated total probe count
+        """
+        return float(np.sum(self.interp(x)))
+
+    def total_with_grad(self, x):
+        """Sum the interpolated probe counts across datasets, along with
+        the gradient of the sum.
+
+        Args:
+            x: list of parameter values across datasets (see interp())
+
+        Returns:
+            tuple (total, grad) where total is the interpolated total
+            probe count and grad is its gradient with respect to x
+        """
+        vals, grad = self.interp_with_grad(x)
+        return float(np.sum(vals)), grad
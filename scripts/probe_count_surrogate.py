@@ -0,0 +1,208 @@
+"""Predict probe counts at parameter values for which they are missing.
+
+Probe counts are often missing at some points of the lattice of
+parameter values (e.g., because a make_probes job failed or was never
+run). For each dataset, this fits a surrogate model to the counts that
+are available and uses it to predict the others. The model is
+log-linear -- the log of the probe count is linear in the parameter
+values, with a non-positive slope along each -- and its predictions are
+then clipped so that they are consistent with the measured counts,
+assuming that larger values of each parameter never yield more probes:
+a prediction is at most the smallest measured count at parameter values
+that are all smaller (or equal), and at least the largest measured count
+at parameter values that are all larger (or equal). Since the log-linear
+prediction and both of these envelopes decrease with each parameter, so
+do the clipped predictions.
+
+Each prediction comes with an estimate of its relative error: the
+tighter of two standard errors of the model under leave-one-out
+cross-validation (growing with how far the prediction is extrapolated
+beyond the dataset's measured parameter values) and, if the prediction
+is enclosed by measured counts, the distance from it to the farther of
+them (a bound, if counts indeed never increase with any parameter).
+"""
+
+import itertools
+
+import numpy as np
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def fit_log_linear(params, counts):
+    """Fit the log of probe counts as a linear function of parameter
+    values, with a non-positive slope along each parameter.
+
+    A parameter along which the least squares slope is positive is
+    dropped from the model (i.e., given a slope of 0) and the model is
+    refit.
+
+    Args:
+        params: array (num points x num parameters) of parameter values
+        counts: array of the probe count at each point
+
+    Returns:
+        tuple (coef, sigma) where coef gives the intercept followed by
+        the slope along each parameter, and sigma is the root mean
+        squared leave-one-out error of the model in log space (inf if
+        there are too few points to estimate it)
+    """
+    params = np.asarray(params, dtype=float)
+    y = np.log(np.maximum(np.asarray(counts, dtype=float), 1.0))
+    num_points, num_params = params.shape
+    design = np.hstack([np.ones((num_points, 1)), params])
+
+    active = np.ones(num_params + 1, dtype=bool)
+    while True:
+        a = design[:, active]
+        coef_active = np.linalg.lstsq(a, y, rcond=None)[0]
+        coef = np.zeros(num_params + 1)
+        coef[active] = coef_active
+        positive = np.flatnonzero(coef[1:] > 0) + 1
+        if len(positive) == 0:
+            break
+        active[positive] = False
+
+    if num_points <= np.sum(active):
+        return coef, float('inf')
+
+    # The leave-one-out residual of a linear least squares fit is the
+    # residual divided by 1 minus the leverage of the point
+    a = design[:, active]
+    leverage = np.sum(a * (a @ np.linalg.pinv(a.T @ a)), axis=1)
+    residuals = y - design @ coef
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loo = residuals / (1.0 - leverage)
+    if not np.all(np.isfinite(loo)):
+        return coef, float('inf')
+    return coef, float(np.sqrt(np.mean(loo**2)))
+
+
+def _envelopes(measured_params, measured_counts, params):
+    """Compute the bounds on the count at each point implied by the
+    measured counts, assuming that counts never increase with any
+    parameter.
+
+    Returns:
+        tuple (lower, upper) of arrays giving the largest measured count
+        at parameter values all >= each point (0 if there are none) and
+        the smallest measured count at parameter values all <= each point
+        (inf if there are none)
+    """
+    # geq[i, k] is True iff measured point k is >= point i along every
+    # parameter, and leq[i, k] iff it is <= point i along every parameter
+    geq = np.all(measured_params[np.newaxis, :, :] >=
+                 params[:, np.newaxis, :], axis=2)
+    leq = np.all(measured_params[np.newaxis, :, :] <=
+                 params[:, np.newaxis, :], axis=2)
+    lower = np.max(np.where(geq, measured_counts, 0.0), axis=1)
+    upper = np.min(np.where(leq, measured_counts, np.inf), axis=1)
+    return lower, upper
+
+
+def predict_dataset_counts(dataset_probe_counts, axes):
+    """Predict the probe counts of a dataset at the lattice points at
+    which they are missing.
+
+    Args:
+        dataset_probe_counts: dict {param values: probe count}
+        axes: list giving, for each parameter, the values of the lattice
+
+    Returns:
+        dict {param values: (predicted probe count, estimated relative
+        error)} with an entry for each lattice point not in
+        dataset_probe_counts
+    """
+    keys = sorted(dataset_probe_counts.keys())
+    missing = [k for k in itertools.product(*axes)
+               if k not in dataset_probe_counts]
+    if not keys or not missing:
+        return {}
+
+    measured_params = np.array(keys, dtype=float)
+    measured_counts = np.array([dataset_probe_counts[k] for k in keys],
+                               dtype=float)
+    params = np.array(missing, dtype=float)
+
+    coef, sigma = fit_log_linear(measured_params, measured_counts)
+    model = np.exp(coef[0] + params @ coef[1:])
+    lower, upper = _envelopes(measured_params, measured_counts, params)
+    pred = np.maximum(np.minimum(np.maximum(model, lower), upper), 1.0)
+
+    # The model is less reliable the farther a point is outside the
+    # measured parameter values, counted in lattice steps
+    steps_outside = np.zeros(len(missing))
+    for j, axis in enumerate(axes):
+        axis = np.asarray(axis, dtype=float)
+        idx = np.searchsorted(axis, params[:, j])
+        lo = np.searchsorted(axis, measured_params[:, j].min())
+        hi = np.searchsorted(axis, measured_params[:, j].max())
+        steps_outside += np.maximum(lo - idx, 0) + np.maximum(idx - hi, 0)
+    model_err = np.expm1(2.0 * sigma * (1.0 + steps_outside))
+
+    with np.errstate(invalid='ignore'):
+        envelope_err = np.where(np.isfinite(upper) & (lower > 0),
+                                np.maximum(upper - pred, pred - lower) / pred,
+                                np.inf)
+    rel_err = np.minimum(model_err, envelope_err)
+
+    return {k: (int(round(p)), float(e))
+            for k, p, e in zip(missing, pred, rel_err)}
+
+
+def lattice_axes(probe_counts):
+    """Return, for each parameter, the sorted values at which any
+    dataset has a probe count.
+    """
+    ndims = set(len(k) for d in probe_counts.values() for k in d.keys())
+    if len(ndims) != 1:
+        raise ValueError(("Probe counts must all be keyed by the same "
+                          "number of parameters"))
+    ndim = ndims.pop()
+    return [sorted(set(k[j] for d in probe_counts.values() for k in d.keys()))
+            for j in range(ndim)]
+
+
+def predict_missing_counts(probe_counts, axes=None):
+    """Predict the probe counts of every dataset at the lattice points at
+    which they are missing.
+
+    Args:
+        probe_counts: dict {dataset: {param values: probe count}}
+        axes: list giving, for each parameter, the values of the lattice;
+            if None, the values at which any dataset has a count
+
+    Returns:
+        dict {dataset: {param values: (predicted probe count, estimated
+        relative error)}}
+    """
+    if axes is None:
+        axes = lattice_axes(probe_counts)
+    return {dataset: predict_dataset_counts(probe_counts[dataset], axes)
+            for dataset in sorted(probe_counts.keys())}
+
+
+def fill_probe_counts(probe_counts, predictions,
+                      max_rel_error=float('inf')):
+    """Fill in missing probe counts with predictions.
+
+    Args:
+        probe_counts: dict {dataset: {param values: probe count}}
+        predictions: as returned by predict_missing_counts
+        max_rel_error: only fill in predictions whose estimated relative
+            error is at most this
+
+    Returns:
+        tuple (filled, predicted) where filled is a copy of probe_counts
+        with predictions filled in and predicted is a dict {dataset: set
+        of param values whose count is predicted}
+    """
+    filled, predicted = {}, {}
+    for dataset, d in probe_counts.items():
+        filled[dataset] = dict(d)
+        predicted[dataset] = set()
+        for k, (count, rel_err) in predictions.get(dataset, {}).items():
+            if rel_err <= max_rel_error:
+                filled[dataset][k] = count
+                predicted[dataset].add(k)
+    return filled, predicted
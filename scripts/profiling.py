@@ -0,0 +1,137 @@
+"""Record timings and counters while running, and report them as JSON.
+
+Profiling is disabled by default, in which case recording is (nearly)
+free; a script enables it (e.g., when given --profile) and writes the
+profile at the end of its run. Timings are recorded by phase, where
+nested phases are named by their path (e.g., 'solve/optimize'), and
+counters are incremented by name from anywhere (e.g., in
+probe_count_grid on each interpolation).
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+class Profile:
+    """Timings, counters and events recorded during a run.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        # {phase path: [total time, number of times entered]}
+        self.phases = {}
+        self.counters = {}
+        # {name: list of dicts}, e.g., one dict per annealing stage
+        self.events = {}
+        self.values = {}
+        self._stack = []
+
+    def to_dict(self):
+        """Summarize the profile.
+
+        Returns:
+            dict suitable for writing as JSON
+        """
+        return {'argv': sys.argv,
+                'total_time': time.perf_counter() - self.start_time,
+                'phases': {path: {'time': t, 'calls': n}
+                           for path, (t, n) in self.phases.items()},
+                'counters': dict(self.counters),
+                'events': self.events,
+                'values': self.values}
+
+
+# The profile being recorded, or None if profiling is disabled
+_profile = None
+
+
+def enable():
+    """Start recording a new profile.
+    """
+    global _profile
+    _profile = Profile()
+
+
+def disable():
+    """Stop recording, discarding the profile.
+    """
+    global _profile
+    _profile = None
+
+
+def is_enabled():
+    return _profile is not None
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a phase of the run, named name within any enclosing phase.
+    """
+    if _profile is None:
+        yield
+        return
+    _profile._stack.append(name)
+    path = '/'.join(_profile._stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        entry = _profile.phases.setdefault(path, [0.0, 0])
+        entry[0] += elapsed
+        entry[1] += 1
+        _profile._stack.pop()
+
+
+def count(name, n=1):
+    """Increment the counter name by n.
+    """
+    if _profile is not None:
+        _profile.counters[name] = _profile.counters.get(name, 0) + n
+
+
+def get_count(name):
+    """Return the value of the counter name (0 if it has not been
+    incremented or profiling is disabled).
+    """
+    if _profile is None:
+        return 0
+    return _profile.counters.get(name, 0)
+
+
+def add_event(name, **fields):
+    """Record an event (e.g., an iteration and its statistics) in the
+    list of events named name.
+    """
+    if _profile is not None:
+        _profile.events.setdefault(name, []).append(fields)
+
+
+def set_value(name, value):
+    """Record a single value (e.g., the number of datasets).
+    """
+    if _profile is not None:
+        _profile.values[name] = value
+
+
+def write(path):
+    """Write the profile being recorded as JSON to path ('-' for stdout).
+    """
+    if _profile is None:
+        return
+    summary = _profile.to_dict()
+    if path == '-':
+        json.dump(summary, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        # Write to a temporary file and rename it so that an interrupted
+        # write does not leave a corrupt profile
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
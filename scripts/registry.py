@@ -0,0 +1,173 @@
+"""Registry of dataset collections, their parameter spaces and paths.
+
+Scripts that generate jobs or summarize their results over datasets and
+parameter values read these from a JSON config file rather than
+hard-coding them, so that a new collection of datasets can be swept by
+adding it to the config. The config has the form:
+
+  {"collections": {
+     NAME: {
+       "datasets": [DATASET or {"datasets": [DATASET, ...], "name": NAME}],
+       "datasets_file": PATH,
+       "parameter_space": [[PARAM, VALUES], ...],
+       "paths": {KEY: PATH, ...}
+     }, ...}}
+
+where a dataset given as a dict is a group of datasets whose results
+are named together (e.g., 'ebola_zaire-with-2014'); "datasets_file",
+used if "datasets" is not given, is a tsv giving on each line a dataset
+and its number of genomes, number of sequences and average sequence
+length; VALUES is a list of values or {"range": [start, stop, step]}
+(as for Python's range); and "paths" gives named paths (e.g., a results
+directory).
+
+The config is found at --registry (see add_collection_args), or else
+at the path in the environment variable REGISTRY_ENV_VAR, or else at
+DEFAULT_REGISTRY_PATH. Nothing is read when this module is imported: the
+config is read when a collection is first requested, and a collection's
+datasets file when its datasets are first requested.
+"""
+
+import itertools
+import json
+import os
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+REGISTRY_ENV_VAR = "HYBSEL_REGISTRY"
+
+DEFAULT_REGISTRY_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "registry.json")
+
+# configs that have been read, keyed by path
+_configs = {}
+
+
+def registry_path(path=None):
+    # return the path to the config: path if given, else the one in the
+    # environment variable, else the default
+    if path is not None:
+        return path
+    return os.environ.get(REGISTRY_ENV_VAR, DEFAULT_REGISTRY_PATH)
+
+
+def _read_config(path):
+    path = os.path.abspath(path)
+    if path not in _configs:
+        with open(path) as f:
+            _configs[path] = json.load(f)
+    return _configs[path]
+
+
+def collection_names(path=None):
+    return sorted(_read_config(registry_path(path))['collections'].keys())
+
+
+def get_collection(name, path=None):
+    """Return the collection with the given name from the config at path
+    (see registry_path).
+    """
+    collections = _read_config(registry_path(path))['collections']
+    if name not in collections:
+        raise ValueError(("Unknown collection '%s'; the registry has: %s") %
+                         (name, ', '.join(sorted(collections.keys()))))
+    return Collection(name, collections[name])
+
+
+def _param_values(values):
+    # expand VALUES in a parameter space (see the module docstring)
+    if isinstance(values, dict):
+        return list(range(*values['range']))
+    return list(values)
+
+
+class Collection:
+    """A collection of datasets, with a parameter space and named paths.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self._datasets = None
+        self._dataset_stats = None
+
+    def _read_datasets_file(self):
+        # read the tsv given by "datasets_file"
+        stats = {}
+        datasets = []
+        with open(self.config['datasets_file']) as f:
+            for line in f:
+                ls = line.rstrip('\n').split('\t')
+                dataset = ls[0]
+                stats[dataset] = (int(ls[1]), int(ls[2]), float(ls[3]))
+                datasets += [([dataset], dataset)]
+        self._dataset_stats = stats
+        self._datasets = datasets
+
+    @property
+    def datasets(self):
+        """List of (datasets, name), where datasets is a list of the
+        datasets whose results are named name (usually one, with the same
+        name).
+        """
+        if self._datasets is None:
+            if 'datasets' in self.config:
+                self._datasets = []
+                for dataset in self.config['datasets']:
+                    if isinstance(dataset, dict):
+                        self._datasets += [(list(dataset['datasets']),
+                                            dataset['name'])]
+                    else:
+                        self._datasets += [([dataset], dataset)]
+            else:
+                self._read_datasets_file()
+        return self._datasets
+
+    @property
+    def dataset_names(self):
+        return [name for _, name in self.datasets]
+
+    @property
+    def dataset_stats(self):
+        """Dict {dataset: (number of genomes, number of sequences, average
+        sequence length)}, as given by the datasets file.
+        """
+        if self._dataset_stats is None:
+            if 'datasets_file' not in self.config:
+                raise ValueError(("Collection '%s' has no datasets file "
+                                  "giving dataset stats") % self.name)
+            self._read_datasets_file()
+        return self._dataset_stats
+
+    @property
+    def param_names(self):
+        return [name for name, _ in self.config['parameter_space']]
+
+    @property
+    def parameter_space(self):
+        """List of tuples giving every combination of parameter values,
+        in the order of param_names.
+        """
+        return list(itertools.product(
+            *[_param_values(values)
+              for _, values in self.config['parameter_space']]))
+
+    def path(self, key, default=None):
+        return self.config.get('paths', {}).get(key, default)
+
+
+def add_collection_args(parser, default):
+    # add arguments to an argparse parser for choosing a collection (see
+    # collection_from_args)
+    parser.add_argument("--collection", default=default,
+                        help=("name of the collection of datasets in the "
+                              "registry (default: %(default)s)"))
+    parser.add_argument("--registry",
+                        help=("path to the registry config (default: $" +
+                              REGISTRY_ENV_VAR + " or " +
+                              DEFAULT_REGISTRY_PATH + ")"))
+
+
+def collection_from_args(args):
+    return get_collection(args.collection, args.registry)
@@ -1,68 +1,218 @@
 """Utilities for working with sequence i/o.
 """
 
+from collections import namedtuple
 from collections import OrderedDict
-import re
-import textwrap
+from collections.abc import Mapping
+import gzip
+import io
+import os
+import struct
+import zlib
 
 import numpy as np
 
+try:
+    import dnaio
+except ImportError:
+    # dnaio (a compiled FASTA/FASTQ parser) is optional; without it,
+    # FASTA files are parsed in pure Python
+    dnaio = None
+
 __author__ = 'Hayden Metsky <hayden@mit.edu>'
 
 
-def read_fasta(fn, data_type='str', replace_degenerate=False):
-    """Read a FASTA file.
+# Alphabet for the 'encoded' representation: a sequence is stored as a
+# uint8 array in which each base is the index of its (uppercase) symbol in
+# this alphabet. A, C, G and T take codes 0-3 so that they fit in 2 bits;
+# every other symbol (including 'N' and the degenerate bases) is >= 4.
+# Symbols not in the alphabet are encoded as 'N'.
+ALPHABET = b'ACGTNRYKMSWBDHV-'
+CODE_A, CODE_C, CODE_G, CODE_T, CODE_N = 0, 1, 2, 3, 4
+CODE_GAP = ALPHABET.index(b'-')
+
+_ENCODE_TABLE = np.full(256, CODE_N, dtype=np.uint8)
+for _i, _b in enumerate(ALPHABET):
+    _ENCODE_TABLE[_b] = _i
+    _ENCODE_TABLE[ord(chr(_b).lower())] = _i
+_ENCODE_TABLE[ord('U')] = CODE_T
+_ENCODE_TABLE[ord('u')] = CODE_T
+
+_DECODE_TABLE = np.frombuffer(ALPHABET, dtype=np.uint8)
+
+# Complement of each code (A<->T, C<->G, R<->Y, K<->M, B<->V, D<->H;
+# N, S, W and '-' are their own complements)
+_COMPLEMENT_TABLE = _ENCODE_TABLE[np.frombuffer(b'TGCANYRMKSWVHDB-',
+                                                dtype=np.uint8)]
+
+# Translation tables for replacing the degenerate bases with 'N'
+_REPLACE_DEGENERATE_TABLE = bytes.maketrans(b'YRWSMK', b'NNNNNN')
+_REPLACE_DEGENERATE_STR_TABLE = str.maketrans('YRWSMK', 'NNNNNN')
+
+# Whether to parse FASTA files with dnaio when it is installed; set to
+# False to always use the pure-Python parser
+USE_FAST_PARSER = True
+
+
+def _open_fasta(fn):
+    """Open a FASTA file for reading, decompressing it if needed.
+
+    Plain, gzip and bgzip (which is a series of gzip members) input are
+    all supported; compression is detected from the file's magic bytes
+    rather than its extension.
 
     Args:
         fn: path to FASTA file to read
-        data_type: determines whether to store a sequence as
-            a native Python string ('str') or as a numpy array
-            ('np')
+
+    Returns:
+        binary-mode file object
+    """
+    with open(fn, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(fn, 'rb')
+    return open(fn, 'rb')
+
+
+def _iterate_raw_fasta_records(fn, replace_degenerate=False):
+    """Scan through a FASTA file and yield each record, unconverted.
+
+    If dnaio is installed (and USE_FAST_PARSER is True), it does the
+    parsing; otherwise, lines of a sequence are collected in a list and
+    joined once the record is complete, so reading a sequence takes time
+    linear in its length.
+
+    Args:
+        fn: path to FASTA file to read (may be gzip/bgzip compressed)
         replace_degenerate: when True, replace the degenerate
             bases ('Y','R','W','S','M','K') with 'N'
 
-    Returns:
-        dict mapping the name of each sequence to the sequence
-        itself. The mapping is ordered by the order in which
-        the sequence is encountered in the FASTA file; this
-        helps in particular with replicating past results,
-        where the input order could affect the output.
+    Yields:
+        tuple (name, seq) for each sequence in the FASTA file, where
+        name is the header (str) without the leading '>' and seq is
+        str (from dnaio) or bytes (from the pure-Python parser)
     """
-    degenerate_pattern = re.compile('[YRWSMK]')
+    if dnaio is not None and USE_FAST_PARSER:
+        with dnaio.open(fn, fileformat='fasta') as f:
+            for record in f:
+                seq = record.sequence
+                if replace_degenerate:
+                    seq = seq.translate(_REPLACE_DEGENERATE_STR_TABLE)
+                yield (record.name.rstrip(), seq)
+        return
 
-    m = OrderedDict()
-    with open(fn) as f:
-        curr_seq_name = ""
+    def make_record(seq_name, seq_lines):
+        seq = b''.join(seq_lines)
+        if replace_degenerate:
+            seq = seq.translate(_REPLACE_DEGENERATE_TABLE)
+        return (seq_name, seq)
+
+    with _open_fasta(fn) as f:
+        curr_seq_name = None
+        curr_seq_lines = []
         for line in f:
             line = line.rstrip()
             if len(line) == 0:
                 continue
-            if curr_seq_name == "":
-                # Must encounter a new sequence
-                assert line.startswith('>')
-            if len(line) == 0:
-                # Reset the sequence being read on an empty line
-                curr_seq_name = ""
-            elif line.startswith('>'):
-                curr_seq_name = line[1:]
-                m[curr_seq_name] = ''
+            if line.startswith(b'>'):
+                # Yield the current sequence (if there is one) and reset the
+                # sequence being read
+                if curr_seq_name is not None:
+                    yield make_record(curr_seq_name, curr_seq_lines)
+                curr_seq_name = line[1:].decode()
+                curr_seq_lines = []
             else:
-                # Append the sequence
-                if replace_degenerate:
-                    line = degenerate_pattern.sub('N', line)
-                m[curr_seq_name] += line
+                # Must have encountered a sequence name
+                assert curr_seq_name is not None
+                curr_seq_lines.append(line)
+        if curr_seq_name is not None:
+            yield make_record(curr_seq_name, curr_seq_lines)
+
+
+def iterate_fasta_headers(fn):
+    """Scan through a FASTA file and yield each header.
 
+    This only looks at header lines, without assembling sequences.
+
+    Args:
+        fn: path to FASTA file to read (may be gzip/bgzip compressed)
+
+    Yields:
+        each header (str) without the leading '>'
+    """
+    with _open_fasta(fn) as f:
+        for line in f:
+            if line.startswith(b'>'):
+                yield line[1:].rstrip().decode()
+
+
+def _format_seq(seq, data_type):
+    """Convert a sequence read as str or raw bytes into the given data_type.
+    """
     if data_type == 'str':
-        # Already stored sequence as string
-        m_converted = m
-    elif data_type == 'np':
-        m_converted = OrderedDict()
-        for seq_name, seq in m.items():
-            m_converted[seq_name] = np.fromstring(seq, dtype='S1')
+        if isinstance(seq, str):
+            return seq
+        return seq.decode()
+    if isinstance(seq, str):
+        seq = seq.encode()
+    if data_type == 'np':
+        # Copy so that the array is writable
+        return np.frombuffer(seq, dtype='S1').copy()
+    elif data_type == 'encoded':
+        return _ENCODE_TABLE[np.frombuffer(seq, dtype=np.uint8)]
+    elif data_type == 'packed':
+        return pack_2bit(_ENCODE_TABLE[np.frombuffer(seq, dtype=np.uint8)])
     else:
         raise ValueError("Unknown data_type " + data_type)
 
-    return m_converted
+
+def iterate_fasta_records(fn, data_type='str', replace_degenerate=False):
+    """Scan through a FASTA file and yield each record.
+
+    Args:
+        fn: path to FASTA file to read (may be gzip/bgzip compressed)
+        data_type: determines whether to store a sequence as
+            a native Python string ('str'), as a numpy array of
+            single characters ('np'), as a numpy array of uint8
+            codes ('encoded'; see ALPHABET), or as a PackedSeq
+            of 2-bit codes ('packed')
+        replace_degenerate: when True, replace the degenerate
+            bases ('Y','R','W','S','M','K') with 'N'
+
+    Yields:
+        tuple (name, seq) for each sequence in the FASTA file, where
+        name is the header without the leading '>'
+    """
+    for seq_name, seq in _iterate_raw_fasta_records(fn,
+            replace_degenerate=replace_degenerate):
+        yield (seq_name, _format_seq(seq, data_type))
+
+
+def read_fasta(fn, data_type='str', replace_degenerate=False):
+    """Read a FASTA file.
+
+    Args:
+        fn: path to FASTA file to read (may be gzip/bgzip compressed)
+        data_type: determines whether to store a sequence as
+            a native Python string ('str'), as a numpy array of
+            single characters ('np'), as a numpy array of uint8
+            codes ('encoded'; see ALPHABET), or as a PackedSeq
+            of 2-bit codes ('packed')
+        replace_degenerate: when True, replace the degenerate
+            bases ('Y','R','W','S','M','K') with 'N'
+
+    Returns:
+        dict mapping the name of each sequence to the sequence
+        itself. The mapping is ordered by the order in which
+        the sequence is encountered in the FASTA file; this
+        helps in particular with replicating past results,
+        where the input order could affect the output.
+    """
+    m = OrderedDict()
+    for seq_name, seq in iterate_fasta_records(fn, data_type=data_type,
+            replace_degenerate=replace_degenerate):
+        m[seq_name] = seq
+    return m
 
 
 def iterate_fasta(fn, data_type='str', replace_degenerate=False):
@@ -72,65 +222,286 @@ def iterate_fasta(fn, data_type='str', replace_degenerate=False):
     upon completing the read of a sequence, yields that sequence.
 
     Args:
-        fn: path to FASTA file to read
+        fn: path to FASTA file to read (may be gzip/bgzip compressed)
         data_type: determines whether to store a sequence as
-            a native Python string ('str') or as a numpy array
-            ('np')
+            a native Python string ('str'), as a numpy array of
+            single characters ('np'), as a numpy array of uint8
+            codes ('encoded'; see ALPHABET), or as a PackedSeq
+            of 2-bit codes ('packed')
         replace_degenerate: when True, replace the degenerate
             bases ('Y','R','W','S','M','K') with 'N'
 
     Yields:
         each sequence in the FASTA file
     """
-    degenerate_pattern = re.compile('[YRWSMK]')
+    for seq_name, seq in _iterate_raw_fasta_records(fn,
+            replace_degenerate=replace_degenerate):
+        if len(seq) > 0:
+            yield _format_seq(seq, data_type)
 
-    def format_seq(seq):
-        if data_type == 'str':
-            # Already stored as str
-            return seq
-        elif data_type == 'np':
-            return np.fromstring(seq, dtype='S1')
+
+def encode_seq(seq):
+    """Encode a sequence as a numpy array of uint8 codes.
+
+    Args:
+        seq: sequence as a str or bytes
+
+    Returns:
+        numpy array (dtype uint8) giving the code (index in ALPHABET)
+        of each base
+    """
+    if isinstance(seq, str):
+        seq = seq.encode()
+    return _ENCODE_TABLE[np.frombuffer(seq, dtype=np.uint8)]
+
+
+def decode_seq(codes):
+    """Decode a numpy array of uint8 codes into a string.
+
+    Args:
+        codes: numpy array of codes, as produced by encode_seq
+
+    Returns:
+        sequence as a str
+    """
+    return _DECODE_TABLE[codes].tobytes().decode()
+
+
+def reverse_complement(codes):
+    """Compute the reverse complement of an encoded sequence.
+
+    Args:
+        codes: numpy array of codes, as produced by encode_seq
+
+    Returns:
+        numpy array of codes giving the reverse complement
+    """
+    return _COMPLEMENT_TABLE[codes[::-1]]
+
+
+def gc_fraction(codes):
+    """Compute the fraction of bases in an encoded sequence that are G or C.
+
+    Args:
+        codes: numpy array of codes, as produced by encode_seq
+
+    Returns:
+        number of 'G' and 'C' bases divided by the length of the sequence
+    """
+    if len(codes) == 0:
+        return 0.0
+    num_gc = np.count_nonzero((codes == CODE_G) | (codes == CODE_C))
+    return float(num_gc) / len(codes)
+
+
+PackedSeq = namedtuple('PackedSeq', ['bits', 'length', 'ambig_pos',
+                                     'ambig_codes'])
+PackedSeq.__doc__ = """Sequence with 2 bits per base.
+
+bits is a uint8 array holding 4 bases per byte (the first base in the two
+most significant bits); length is the number of bases. Bases that are not
+A, C, G or T are stored as 'A' in bits, and their positions (ambig_pos)
+and codes (ambig_codes) are stored separately.
+"""
+
+
+def pack_2bit(codes):
+    """Pack an encoded sequence into 2 bits per base.
+
+    Args:
+        codes: numpy array of codes, as produced by encode_seq
+
+    Returns:
+        PackedSeq
+    """
+    ambig = codes > CODE_T
+    ambig_pos = np.flatnonzero(ambig)
+    ambig_codes = codes[ambig_pos]
+
+    length = len(codes)
+    padded = np.zeros(4 * ((length + 3) // 4), dtype=np.uint8)
+    padded[:length] = codes & 3
+    padded[:length][ambig] = CODE_A
+    quads = padded.reshape(-1, 4)
+    bits = ((quads[:, 0] << 6) | (quads[:, 1] << 4) |
+            (quads[:, 2] << 2) | quads[:, 3]).astype(np.uint8)
+    return PackedSeq(bits, length, ambig_pos, ambig_codes)
+
+
+def unpack_2bit(packed, start=0, end=None):
+    """Unpack (a slice of) a PackedSeq into an encoded sequence.
+
+    Only the bytes of packed.bits that overlap [start, end) are unpacked.
+
+    Args:
+        packed: PackedSeq, as produced by pack_2bit
+        start: start position (inclusive) of the slice to unpack
+        end: end position (exclusive) of the slice to unpack; if None,
+            unpack to the end of the sequence
+
+    Returns:
+        numpy array of codes, as produced by encode_seq
+    """
+    if end is None or end > packed.length:
+        end = packed.length
+    if start >= end:
+        return np.zeros(0, dtype=np.uint8)
+
+    bits = packed.bits[start // 4:(end + 3) // 4]
+    quads = np.empty((len(bits), 4), dtype=np.uint8)
+    quads[:, 0] = bits >> 6
+    quads[:, 1] = (bits >> 4) & 3
+    quads[:, 2] = (bits >> 2) & 3
+    quads[:, 3] = bits & 3
+    offset = 4 * (start // 4)
+    codes = quads.reshape(-1)[start - offset:end - offset]
+
+    # Restore the bases that are not A, C, G or T
+    lo, hi = np.searchsorted(packed.ambig_pos, [start, end])
+    codes[packed.ambig_pos[lo:hi] - start] = packed.ambig_codes[lo:hi]
+    return codes
+
+
+# Empty BGZF block that marks the end of a bgzip-compressed file
+_BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000'
+                          '000000000000')
+
+# Maximum number of uncompressed bytes in a BGZF block (as used by bgzip)
+_BGZF_BLOCK_SIZE = 0xff00
+
+
+class _BgzfWriter:
+    """Minimal writer of BGZF (bgzip-compressed) files.
+
+    Data is buffered and written as a series of gzip members, each
+    holding at most _BGZF_BLOCK_SIZE uncompressed bytes and carrying the
+    'BC' extra subfield that gives the size of the compressed block.
+    """
+
+    def __init__(self, fn, compresslevel=6):
+        self._f = open(fn, 'wb')
+        self._buf = bytearray()
+        self._compresslevel = compresslevel
+
+    def _write_block(self, data):
+        c = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -15)
+        cdata = c.compress(data) + c.flush()
+        # Block size, minus 1, is the header (18 bytes) plus the compressed
+        # data plus the trailer (8 bytes), minus 1
+        bsize = len(cdata) + 25
+        self._f.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00'
+                      b'BC\x02\x00' + struct.pack('<H', bsize))
+        self._f.write(cdata)
+        self._f.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                  len(data)))
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= _BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buf[:_BGZF_BLOCK_SIZE]))
+            del self._buf[:_BGZF_BLOCK_SIZE]
+
+    def close(self):
+        if len(self._buf) > 0:
+            self._write_block(bytes(self._buf))
+            self._buf = bytearray()
+        self._f.write(_BGZF_EOF)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _open_fasta_for_writing(out_fn, compression, buffer_size):
+    """Open a FASTA file for writing bytes.
+
+    Args:
+        out_fn: path to FASTA file to write
+        compression: 'gzip', 'bgzip' or None (no compression); or 'auto'
+            to use bgzip if out_fn ends in '.gz' and otherwise None
+        buffer_size: number of bytes to buffer before writing
+
+    Returns:
+        binary-mode file object
+    """
+    if compression == 'auto':
+        compression = 'bgzip' if out_fn.endswith('.gz') else None
+    if compression is None:
+        return open(out_fn, 'wb', buffering=buffer_size)
+    elif compression == 'gzip':
+        return io.BufferedWriter(gzip.open(out_fn, 'wb'),
+                                 buffer_size=buffer_size)
+    elif compression == 'bgzip':
+        return _BgzfWriter(out_fn)
+    else:
+        raise ValueError("Unknown compression " + str(compression))
+
+
+def _seq_to_bytes(seq):
+    """Convert a sequence of any of the types in read_fasta to bytes.
+    """
+    if isinstance(seq, str):
+        return seq.encode()
+    elif isinstance(seq, bytes):
+        return seq
+    elif isinstance(seq, PackedSeq):
+        return _DECODE_TABLE[unpack_2bit(seq)].tobytes()
+    elif isinstance(seq, np.ndarray):
+        if seq.dtype == np.uint8:
+            # seq is encoded
+            return _DECODE_TABLE[seq].tobytes()
         else:
-            raise ValueError("Unknown data_type " + data_tyoe)
+            # seq is an array of single characters
+            return seq.astype('S1').tobytes()
+    else:
+        raise TypeError("Unknown sequence type " + str(type(seq)))
 
-    with open(fn) as f:
-        curr_seq = ''
-        for line in f:
-            line = line.rstrip()
-            if len(line) == 0:
-                continue
-            if line.startswith('>'):
-                # Yield the current sequence (if there is one) and reset the
-                # sequence being read
-                if len(curr_seq) > 0:
-                    yield format_seq(curr_seq)
-                curr_seq = ''
-            else:
-                # Append the sequence
-                if replace_degenerate:
-                    line = degenerate_pattern.sub('N', line)
-                curr_seq += line
-        if len(curr_seq) > 0:
-            yield format_seq(curr_seq)
+
+def _wrap_seq(seq, chars_per_line):
+    """Break a sequence (bytes) into lines of chars_per_line bases.
+
+    Returns:
+        bytes, with each line (including the last) ending in a newline
+    """
+    num_full_lines = len(seq) // chars_per_line
+    # Lay out the full lines as rows of chars_per_line bases, followed by
+    # a newline column
+    rows = np.empty((num_full_lines, chars_per_line + 1), dtype=np.uint8)
+    rows[:, :chars_per_line] = np.frombuffer(
+        seq, dtype=np.uint8, count=num_full_lines * chars_per_line).reshape(
+            num_full_lines, chars_per_line)
+    rows[:, chars_per_line] = ord('\n')
+    wrapped = rows.tobytes()
+    last_line = seq[num_full_lines * chars_per_line:]
+    if len(last_line) > 0:
+        wrapped += last_line + b'\n'
+    return wrapped
 
 
-def write_fasta(seqs, out_fn, chars_per_line=70):
+def write_fasta(seqs, out_fn, chars_per_line=70, compression='auto',
+                buffer_size=2**22):
     """Write sequences to a FASTA file.
 
     Args:
         seqs: dict (or OrderedDict) mapping the name of each
-            sequence to the sequence itself
+            sequence to the sequence itself, or an iterable (e.g.,
+            the generator iterate_fasta_records) of tuples (name, seq);
+            each sequence may be of any of the types given by
+            read_fasta's data_type
         out_fn: path to FASTA file to write
         chars_per_line: the number of characters to put on
             each line when writing a sequence
+        compression: 'gzip', 'bgzip' or None (no compression); by
+            default ('auto'), use bgzip if out_fn ends in '.gz'
+        buffer_size: number of bytes to buffer before writing
     """
-    with open(out_fn, 'w') as f:
-        for seq_name, seq in seqs.items():
-            if isinstance(seq, np.ndarray):
-                # Convert seq to a string
-                seq = ''.join(seq)
-            f.write('>' + seq_name + '\n')
-            seq_wrapped = textwrap.wrap(seq, chars_per_line)
-            for seq_line in seq_wrapped:
-                f.write(seq_line + '\n')
-            f.write('\n')
+    if isinstance(seqs, Mapping):
+        seqs = seqs.items()
+    with _open_fasta_for_writing(out_fn, compression, buffer_size) as f:
+        for seq_name, seq in seqs:
+            f.write(b'>' + seq_name.encode() + b'\n')
+            f.write(_wrap_seq(_seq_to_bytes(seq), chars_per_line))
+            f.write(b'\n')
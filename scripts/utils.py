@@ -1,58 +1,571 @@
 #!/bin/python3
 
+import concurrent.futures
+import gzip
+import json
+import math
 import os
 import re
-import subprocess
+import sys
 
-FASTA_PATTERN = re.compile('mismatches_([0-9]+)-coverextension_([0-9]+)\.fasta')
-FASTA_PATTERN_NEXPANDED = \
-    re.compile('mismatches_([0-9]+)-coverextension_([0-9]+)\.n_expanded\.fasta')
+import numpy as np
 
+FASTA_PATTERN = re.compile(
+    r'mismatches_([0-9]+)-coverextension_([0-9]+)\.fasta(\.gz)?$')
+FASTA_PATTERN_NEXPANDED = re.compile(
+    r'mismatches_([0-9]+)-coverextension_([0-9]+)\.n_expanded\.fasta(\.gz)?$')
 
-def count_probes(fn):
-    # return the number of probes in the fasta file fn
-    cmd = ["grep", "'>'", fn, "|", "wc", "-l"]
-    out = subprocess.check_output(' '.join(cmd), shell=True)
-    if not isinstance(out, str):
-        out = out.decode('utf-8')
-    out = out.rstrip()
-    return int(out)
+# fasta file named by any number of parameters, e.g.,
+# 'mismatches_2-lcfthres_100-coverextension_10.fasta'
+PARAMS_FASTA_PATTERN = re.compile(
+    r'((?:[a-z]+_[0-9]+-)*[a-z]+_[0-9]+)(\.n_expanded)?\.fasta(\.gz)?$')
 
+ANALYSIS_PATTERN = re.compile(
+    r'mismatches_([0-9]+)-coverextension_([0-9]+)\.analysis\.tsv$')
 
-def read_probe_counts(args,
-                      skip=["datasets.txt",
-                            "all_mismatches_3-coverextension_0.fasta",
-                            "make_probes.sh",
-                            "archived"],
-                      use_n_expanded_counts=False):
-    probe_counts = {}
-    for dir in os.listdir(args.results_dir):
-        if args.limit_datasets is not None and dir not in args.limit_datasets:
-            # only process datasets in args.limit_datasets
-            continue
+# coverage of a dataset is acceptable if the fraction of unambiguous
+# bases covered, at the ACCEPTABLE_COVERAGE_PERCENTILE'th percentile
+# across genomes, exceeds ACCEPTABLE_FRAC_COVERED (i.e., 95% of genomes
+# are > 99% covered)
+ACCEPTABLE_COVERAGE_PERCENTILE = 5.0
+ACCEPTABLE_FRAC_COVERED = 0.99
 
-        dataset_results_path = os.path.join(args.results_dir, dir)
-        if os.path.isfile(dataset_results_path) and dir in skip:
-            continue
-        else:
-            assert os.path.isdir(dataset_results_path)
-        # dir gives a virus/dataset name
-        dataset = dir
-        d = {}
-        for fn in os.listdir(dataset_results_path):
+# percentiles, across genomes, at which the fraction of unambiguous bases
+# covered is summarized (see summarize_analysis_file)
+COVERAGE_SUMMARY_PERCENTILES = [0, 5, 25, 50, 75, 95, 100]
+
+# name of the file, in a directory of analysis tsv files, that caches
+# summaries of them
+COVERAGE_SUMMARY_CACHE_FN = ".coverage_summary_cache.json"
+
+# default number of threads to use when scanning a results directory
+DEFAULT_NUM_SCAN_WORKERS = 16
+
+
+# name of the file, in a results directory, that caches probe counts
+PROBE_COUNT_CACHE_FN = ".probe_counts_cache.json"
+
+# default name of the file, in a results directory, that holds the probe
+# count table written by index_probe_counts.py
+PROBE_COUNT_TABLE_FN = "probe_counts.tsv"
+
+
+def count_probes(fn, chunk_size=2**22):
+    # return the number of probes (headers) in the fasta file fn
+    # (which may be gzip-compressed)
+    with open(fn, 'rb') as f:
+        is_gzip = f.read(2) == b'\x1f\x8b'
+
+    # count in chunks, carrying over the last byte of each chunk so
+    # that a '\n>' spanning two chunks is counted (and starting with
+    # '\n' so that a header on the first line is counted)
+    count = 0
+    prev = b'\n'
+    with (gzip.open(fn, 'rb') if is_gzip else open(fn, 'rb')) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            count += (prev + chunk).count(b'\n>')
+            prev = chunk[-1:]
+    return count
+
+
+class FileFingerprintCache:
+    """Persistent cache of values computed from files.
+
+    Values are stored in a JSON file, keyed by the absolute path of each
+    file along with its size and modification time; a value is only
+    reused if the file's size and modification time are unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.modified = False
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # the cache is corrupt; start over
+                self.entries = {}
+
+    def get(self, fn, st=None):
+        # return the cached value for fn, or None if there is none or fn
+        # has changed; st, if given, is the result of os.stat(fn)
+        if st is None:
+            st = os.stat(fn)
+        entry = self.entries.get(os.path.abspath(fn))
+        if entry is not None and entry[0] == st.st_size and \
+                entry[1] == st.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, fn, value, st=None):
+        if st is None:
+            st = os.stat(fn)
+        self.entries[os.path.abspath(fn)] = [st.st_size, st.st_mtime_ns,
+                                             value]
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        # write to a temporary file and rename it so that an interrupted
+        # write does not leave a corrupt cache
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.modified = False
+        except OSError:
+            # the directory may not be writable; the cache is only an
+            # optimization, so skip saving it
+            pass
+
+
+class ProbeCountCache(FileFingerprintCache):
+    """Persistent cache of probe counts of fasta files.
+    """
+
+    def count_probes(self, fn, st=None):
+        # return the number of probes in fn, using the cache if possible;
+        # st, if given, is the result of os.stat(fn)
+        if st is None:
+            st = os.stat(fn)
+        count = self.get(fn, st)
+        if count is None:
+            count = count_probes(fn)
+            self.put(fn, count, st)
+        return count
+
+
+def parse_fasta_params(fn, param_names):
+    # parse the values of the parameters param_names from the name of a
+    # fasta file matching PARAMS_FASTA_PATTERN, in which each parameter
+    # is named without underscores (e.g., 'cover_extension' is
+    # 'coverextension'); returns a tuple (key, is_n_expanded,
+    # is_compressed), where key gives the values in the order of
+    # param_names, or None if fn is not named by exactly these parameters
+    m = PARAMS_FASTA_PATTERN.match(fn)
+    if not m:
+        return None
+    params = {}
+    for token in m.group(1).split('-'):
+        name, value = token.split('_')
+        params[name] = int(value)
+    names = [name.replace('_', '') for name in param_names]
+    if sorted(params.keys()) != sorted(names):
+        return None
+    key = tuple(params[name] for name in names)
+    return key, m.group(2) is not None, m.group(3) is not None
+
+
+def _scan_dataset_results(dataset_results_path, count_fn, param_names=None):
+    # count probes in each fasta file (plain and n_expanded) in
+    # dataset_results_path; returns a tuple of dicts
+    # ({(mismatches, cover_extension): count}, ...) for plain and
+    # n_expanded fasta files; if param_names is set, files are instead
+    # named by those parameters (see parse_fasta_params) and keys give
+    # their values
+    d, d_n_expanded = {}, {}
+    with os.scandir(dataset_results_path) as it:
+        for entry in it:
             # match fasta files; the parameters are part of the
             # file name
-            if use_n_expanded_counts:
-                m = FASTA_PATTERN_NEXPANDED.match(fn)
+            if param_names is not None:
+                parsed = parse_fasta_params(entry.name, param_names)
+                if parsed is None:
+                    continue
+                key, is_n_expanded, is_compressed = parsed
+                out = d_n_expanded if is_n_expanded else d
             else:
-                m = FASTA_PATTERN.match(fn)
-            if m:
-                # fn is a fasta file
+                m = FASTA_PATTERN.match(entry.name)
+                out = d
+                if not m:
+                    m = FASTA_PATTERN_NEXPANDED.match(entry.name)
+                    out = d_n_expanded
+                if not m:
+                    continue
                 mismatches = int(m.group(1))
                 cover_extension = int(m.group(2))
-                fn_path = os.path.join(dataset_results_path, fn)
-                probe_count = count_probes(fn_path)
-                d[(mismatches, cover_extension)] = probe_count
-        probe_counts[dataset] = d
-    return probe_counts
+                key = (mismatches, cover_extension)
+                is_compressed = m.group(3) is not None
+            if key in out and is_compressed:
+                # prefer the uncompressed file if both are present
+                continue
+            out[key] = count_fn(entry.path, entry.stat())
+    return d, d_n_expanded
+
+
+def scan_probe_counts(results_dir,
+                      limit_datasets=None,
+                      skip=["datasets.txt",
+                            "all_mismatches_3-coverextension_0.fasta",
+                            "make_probes.sh",
+                            "archived",
+                            PROBE_COUNT_CACHE_FN,
+                            PROBE_COUNT_CACHE_FN + ".tmp",
+                            COVERAGE_SUMMARY_CACHE_FN,
+                            COVERAGE_SUMMARY_CACHE_FN + ".tmp",
+                            PROBE_COUNT_TABLE_FN],
+                      use_cache=True,
+                      num_workers=DEFAULT_NUM_SCAN_WORKERS,
+                      show_progress=False,
+                      param_names=None):
+    """Count probes in every dataset's results, in one pass.
+
+    Datasets are scanned in parallel on a thread pool, since the work is
+    dominated by filesystem latency.
+
+    Args:
+        results_dir: directory containing a folder for each dataset,
+            each of which contains a fasta file (possibly gzip-compressed)
+            for each choice of parameters
+        limit_datasets: if set, only scan these datasets
+        skip: names of files in results_dir to ignore
+        use_cache: when True, reuse and update the probe count cache
+            in results_dir
+        num_workers: number of threads to use
+        show_progress: when True, print progress to stderr
+        param_names: if set, names of the parameters by which fasta
+            files are named (see parse_fasta_params), rather than
+            mismatches and cover extension
+
+    Returns:
+        tuple (probe_counts, n_expanded_probe_counts), each of the form
+        {dataset: {(mismatches, cover_extension): probe count}} (or, if
+        param_names is set, keyed by the values of those parameters)
+    """
+    if use_cache:
+        cache = ProbeCountCache(os.path.join(results_dir,
+                                             PROBE_COUNT_CACHE_FN))
+        count_fn = cache.count_probes
+    else:
+        cache = None
+        count_fn = lambda fn, st: count_probes(fn)
+
+    dataset_paths = {}
+    with os.scandir(results_dir) as it:
+        for entry in it:
+            if limit_datasets is not None and entry.name not in limit_datasets:
+                # only process datasets in limit_datasets
+                continue
+            if entry.name in skip:
+                continue
+            if not entry.is_dir():
+                # a stray file (e.g., a README), not a dataset
+                continue
+            # entry gives a virus/dataset name
+            dataset_paths[entry.name] = entry.path
+
+    probe_counts = {}
+    n_expanded_probe_counts = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=num_workers) as executor:
+        futures = {executor.submit(_scan_dataset_results, path, count_fn,
+                                   param_names):
+                   dataset for dataset, path in dataset_paths.items()}
+        for i, future in enumerate(
+                concurrent.futures.as_completed(futures)):
+            dataset = futures[future]
+            probe_counts[dataset], n_expanded_probe_counts[dataset] = \
+                future.result()
+            if show_progress:
+                print("Scanned %d of %d datasets (%s)" % (i + 1,
+                      len(futures), dataset), file=sys.stderr)
+
+    if cache is not None:
+        cache.save()
+    return probe_counts, n_expanded_probe_counts
+
+
+def read_probe_counts(args,
+                      use_n_expanded_counts=False,
+                      use_cache=True,
+                      param_names=None):
+    # read probe counts from args.results_dir, only for datasets
+    # in args.limit_datasets (if set); see scan_probe_counts for
+    # param_names
+    probe_counts, n_expanded_probe_counts = scan_probe_counts(
+        args.results_dir,
+        limit_datasets=getattr(args, 'limit_datasets', None),
+        use_cache=use_cache,
+        num_workers=getattr(args, 'num_scan_workers', None) or
+            DEFAULT_NUM_SCAN_WORKERS,
+        show_progress=getattr(args, 'show_progress', False),
+        param_names=param_names)
+    if use_n_expanded_counts:
+        return n_expanded_probe_counts
+    else:
+        return probe_counts
+
+
+def read_frac_covered_array(fn):
+    # Returns numpy array of fracs of unambig bases covered, one per
+    # genome (skips reverse complement genomes). Only the columns up to
+    # the frac are split from each line.
+    with open(fn, 'rb') as f:
+        f.readline() # skip header
+        lines = f.read().split(b'\n')
+    cols = [line.split(b'\t', 4) for line in lines if line]
+    return np.array([c[3] for c in cols if not c[0].endswith(b'(rc)')],
+                    dtype=float)
+
+
+def read_frac_of_covered_genome(fn):
+    # Returns list of fracs of unambig bases covered, one per genome
+    # (skips reverse complement genomes)
+    return read_frac_covered_array(fn).tolist()
+
+
+def summarize_analysis_file(fn):
+    # return a dict summarizing the fraction of unambiguous bases covered
+    # across genomes in the analysis tsv file fn: its value at each of
+    # COVERAGE_SUMMARY_PERCENTILES ('percentiles'), its mean ('mean') and
+    # the number of genomes ('num_genomes')
+    fracs = read_frac_covered_array(fn)
+    if len(fracs) == 0:
+        percentiles = [float('nan')] * len(COVERAGE_SUMMARY_PERCENTILES)
+        mean = float('nan')
+    else:
+        percentiles = np.percentile(fracs,
+                                    COVERAGE_SUMMARY_PERCENTILES).tolist()
+        mean = float(np.mean(fracs))
+    return {'percentiles': percentiles, 'mean': mean,
+            'num_genomes': len(fracs)}
+
+
+def summarize_analysis_files(paths, cache=None, num_workers=None):
+    """Summarize coverage in many analysis tsv files.
+
+    Files are parsed in parallel on a process pool, since the work is
+    dominated by parsing.
+
+    Args:
+        paths: paths to analysis tsv files
+        cache: if set, a FileFingerprintCache from which to reuse
+            summaries of files that have not changed, and to which new
+            summaries are added
+        num_workers: number of processes to use (default: number of CPUs)
+
+    Returns:
+        {path: summary} where summary is as returned by
+        summarize_analysis_file
+    """
+    summaries = {}
+    to_parse = []
+    for path in paths:
+        st = os.stat(path)
+        summary = cache.get(path, st) if cache is not None else None
+        if summary is None:
+            to_parse += [(path, st)]
+        else:
+            summaries[path] = summary
+
+    if len(to_parse) > 1 and num_workers != 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_workers) as executor:
+            parsed = list(executor.map(summarize_analysis_file,
+                                       [path for path, _ in to_parse],
+                                       chunksize=8))
+    else:
+        parsed = [summarize_analysis_file(path) for path, _ in to_parse]
+
+    for (path, st), summary in zip(to_parse, parsed):
+        summaries[path] = summary
+        if cache is not None:
+            cache.put(path, summary, st)
+    return summaries
+
+
+def scan_coverage_summaries(results_dir, datasets,
+                            num_workers=DEFAULT_NUM_SCAN_WORKERS,
+                            use_cache=True):
+    """Summarize coverage from the analysis tsv files of each dataset.
+
+    Files are summarized with summarize_analysis_files, so summaries of
+    files that have not changed are reused from a cache in results_dir.
+
+    Args:
+        results_dir: directory containing a folder for each dataset
+        datasets: names of the datasets (folders) to scan
+        num_workers: number of processes to use
+        use_cache: when True, reuse and update the coverage summary
+            cache in results_dir
+
+    Returns:
+        {dataset: {(mismatches, cover_extension): (5th percentile, mean)}}
+        giving the 5th percentile and mean, across genomes, of the
+        fraction of unambiguous bases covered
+    """
+    paths = {}
+    for dataset in datasets:
+        with os.scandir(os.path.join(results_dir, dataset)) as it:
+            for entry in it:
+                m = ANALYSIS_PATTERN.match(entry.name)
+                if m:
+                    key = (int(m.group(1)), int(m.group(2)))
+                    paths[(dataset, key)] = entry.path
+
+    cache = None
+    if use_cache:
+        cache = FileFingerprintCache(os.path.join(results_dir,
+                                                  COVERAGE_SUMMARY_CACHE_FN))
+    summaries = summarize_analysis_files(list(paths.values()), cache=cache,
+                                         num_workers=num_workers)
+    if cache is not None:
+        cache.save()
+
+    prctile_idx = COVERAGE_SUMMARY_PERCENTILES.index(
+        ACCEPTABLE_COVERAGE_PERCENTILE)
+    out = {dataset: {} for dataset in datasets}
+    for (dataset, key), path in paths.items():
+        summary = summaries[path]
+        out[dataset][key] = (summary['percentiles'][prctile_idx],
+                             summary['mean'])
+    return out
+
+
+# columns of a probe count table, in the order they are written; the
+# table has a header line and one row per (dataset, parameters)
+PROBE_COUNT_TABLE_COLUMNS = ["dataset", "mismatches", "cover_extension",
+                             "num_probes", "num_probes_n_expanded",
+                             "frac_covered_p5", "frac_covered_mean"]
+
+
+def write_probe_count_table(path, probe_counts,
+                            n_expanded_probe_counts=None,
+                            coverage_summaries=None):
+    # write probe counts (and, if given, n_expanded probe counts and
+    # coverage summaries) to a tsv table at path; values that are
+    # unavailable are written as 'NA'
+    n_expanded_probe_counts = n_expanded_probe_counts or {}
+    coverage_summaries = coverage_summaries or {}
+
+    def fmt(x):
+        if x is None or (isinstance(x, float) and math.isnan(x)):
+            return 'NA'
+        return str(x)
+
+    with open(path, 'w') as f:
+        f.write('\t'.join(PROBE_COUNT_TABLE_COLUMNS) + '\n')
+        for dataset in sorted(probe_counts.keys()):
+            n_expanded = n_expanded_probe_counts.get(dataset, {})
+            covg = coverage_summaries.get(dataset, {})
+            params = set(probe_counts[dataset].keys()) | set(n_expanded.keys())
+            for mismatches, cover_extension in sorted(params):
+                key = (mismatches, cover_extension)
+                p5, mean = covg.get(key, (None, None))
+                row = [dataset, mismatches, cover_extension,
+                       probe_counts[dataset].get(key), n_expanded.get(key),
+                       p5, mean]
+                f.write('\t'.join(fmt(x) for x in row) + '\n')
+
+
+def read_probe_count_table(path):
+    """Read a probe count table as numpy arrays.
+
+    Tables with only some of the columns in PROBE_COUNT_TABLE_COLUMNS
+    (e.g., 'dataset', 'mismatches', 'cover_extension' and 'num_probes')
+    can also be read; missing columns are filled as unavailable. Any
+    other columns (e.g., additional parameters such as 'lcf_thres') are
+    read as int arrays with -1 where unavailable.
+
+    Returns:
+        dict mapping each column in PROBE_COUNT_TABLE_COLUMNS to a numpy
+        array with one value per row; 'dataset' is an array of str,
+        counts are int arrays with -1 where unavailable, and coverage
+        summaries are float arrays with NaN where unavailable
+    """
+    with open(path) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+    cols = list(zip(*rows)) if rows else [()] * len(header)
+    raw = dict(zip(header, cols))
+
+    table = {}
+    table['dataset'] = np.array(raw['dataset'], dtype=str)
+    num_rows = len(table['dataset'])
+    for col in PROBE_COUNT_TABLE_COLUMNS[1:]:
+        if col.startswith('frac_'):
+            dtype, missing = float, float('nan')
+        else:
+            dtype, missing = int, -1
+        if col in raw:
+            vals = [missing if v == 'NA' else dtype(float(v))
+                    for v in raw[col]]
+        else:
+            vals = [missing] * num_rows
+        table[col] = np.array(vals, dtype=dtype)
+    for col in header:
+        if col not in table:
+            table[col] = np.array([-1 if v == 'NA' else int(float(v))
+                                   for v in raw[col]], dtype=int)
+    return table
+
+
+def _table_values_by_params(table, values, available, limit_datasets,
+                            param_names):
+    # return {dataset: {param values: value}} from a table, as returned by
+    # read_probe_count_table, where values gives a value for each row and
+    # rows for which available is False are skipped
+    for name in param_names:
+        if name not in table:
+            raise ValueError("Probe count table has no column %s" % name)
+    params = zip(*[table[name] for name in param_names])
+    out = {}
+    for dataset, key, value, is_available in zip(table['dataset'], params,
+                                                 values, available):
+        dataset = str(dataset)
+        if limit_datasets is not None and dataset not in limit_datasets:
+            continue
+        d = out.setdefault(dataset, {})
+        if is_available:
+            key = tuple(int(v) for v in key)
+            if key in d:
+                raise ValueError(("Probe count table has multiple rows "
+                                  "for dataset %s at %s=%s; it may have "
+                                  "other parameter columns") %
+                                 (dataset, tuple(param_names), key))
+            d[key] = value
+    return out
+
+
+def probe_counts_from_table(table, use_n_expanded_counts=False,
+                            limit_datasets=None,
+                            param_names=("mismatches", "cover_extension")):
+    # convert a table, as returned by read_probe_count_table, into
+    # the form returned by read_probe_counts: {dataset: {(mismatches,
+    # cover_extension): count}}, or keyed by the values of the columns
+    # param_names; rows without a count are skipped
+    if use_n_expanded_counts:
+        counts = table['num_probes_n_expanded']
+    else:
+        counts = table['num_probes']
+    return _table_values_by_params(table, [int(c) for c in counts],
+                                   counts >= 0, limit_datasets, param_names)
+
+
+def coverage_from_table(table, limit_datasets=None,
+                        param_names=("mismatches", "cover_extension")):
+    # return, from a table as returned by read_probe_count_table,
+    # {dataset: {(mismatches, cover_extension): frac covered}} giving the
+    # ACCEPTABLE_COVERAGE_PERCENTILE'th percentile of the fraction of
+    # unambiguous bases covered across genomes (or keyed by the values of
+    # the columns param_names); rows without a coverage summary are
+    # skipped
+    p5 = table['frac_covered_p5']
+    return _table_values_by_params(table, [float(v) for v in p5],
+                                   ~np.isnan(p5), limit_datasets,
+                                   param_names)
+
 
+def coverage_is_acceptable(frac_covered):
+    # return whether the ACCEPTABLE_COVERAGE_PERCENTILE'th percentile of
+    # the fraction of unambiguous bases covered, across genomes, is
+    # acceptable; works elementwise on numpy arrays (NaN is not
+    # acceptable)
+    return np.asarray(frac_covered) > ACCEPTABLE_FRAC_COVERED
@@ -0,0 +1,92 @@
+"""Tests the bounding-box fallback of probe_count_grid.ProbeCountGrid, used
+when the lattice cell around a point is missing a probe count.
+"""
+
+import itertools
+import os
+import sys
+import unittest
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+import probe_count_grid
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def sparse_probe_counts(shape, num_datasets, frac_missing, seed):
+    # probe counts, decreasing in each parameter, on a lattice of the given
+    # shape with a fraction of points missing (other than the lowest
+    # and highest corners)
+    rng = np.random.RandomState(seed)
+    probe_counts = {}
+    for d in range(num_datasets):
+        counts = {}
+        for idx in itertools.product(*[range(n) for n in shape]):
+            if (0 < sum(idx) < sum(shape) - len(shape) and
+                    rng.uniform() < frac_missing):
+                continue
+            counts[tuple(float(i) for i in idx)] = (rng.uniform(1000, 5000) /
+                                                    (1 + sum(idx)))
+        probe_counts['d%d' % d] = counts
+    return probe_counts
+
+
+class TestBoundingBox(unittest.TestCase):
+
+    def setUp(self):
+        # mismatches 0..2 and cover_extension 0..20, missing the count at
+        # (1, 10)
+        self.counts = {(0, 0): 900.0, (0, 10): 700.0, (0, 20): 650.0,
+                       (1, 0): 800.0, (1, 20): 500.0,
+                       (2, 0): 600.0, (2, 10): 450.0, (2, 20): 300.0}
+        self.grid = probe_count_grid.ProbeCountGrid({'d': self.counts},
+                                                    steps=[1, 10])
+
+    def test_smallest_box(self):
+        # the cells around (1, 15) are missing (1, 10), and the smallest
+        # box around it with every corner is [1, 1] x [0, 20]
+        c = self.counts
+        expected = 0.25 * c[(1, 0)] + 0.75 * c[(1, 20)]
+        self.assertAlmostEqual(self.grid.interp([1, 15])[0], expected)
+
+    def test_tie_is_broken_by_lattice_order(self):
+        # around (0.5, 5), the boxes [0, 2] x [0, 10] and [0, 1] x [0, 20]
+        # have the same size relative to the steps; the second comes
+        # first in lattice order (by its mismatches values) and is chosen
+        c = self.counts
+        expected = 0.75 * (0.5 * c[(0, 0)] + 0.5 * c[(1, 0)]) + \
+            0.25 * (0.5 * c[(0, 20)] + 0.5 * c[(1, 20)])
+        other = 0.5 * (0.75 * c[(0, 0)] + 0.25 * c[(2, 0)]) + \
+            0.5 * (0.75 * c[(0, 10)] + 0.25 * c[(2, 10)])
+        self.assertNotEqual(expected, other)
+        self.assertAlmostEqual(self.grid.interp([0.5, 5])[0], expected)
+
+    def test_no_box(self):
+        grid = probe_count_grid.ProbeCountGrid(
+            {'d': {(0, 0): 10.0, (1, 1): 1.0}})
+        with self.assertRaises(ValueError):
+            grid.interp([0.5, 0.5])
+
+    def test_chunk_size_does_not_change_boxes(self):
+        for shape in [(7, 6), (4, 3, 5)]:
+            with self.subTest(shape=shape):
+                probe_counts = sparse_probe_counts(shape, 20, 0.3, seed=1)
+                grid = probe_count_grid.ProbeCountGrid(probe_counts)
+                chunk_size = probe_count_grid.BOX_CHUNK_SIZE
+                try:
+                    probe_count_grid.BOX_CHUNK_SIZE = 5
+                    chunked = probe_count_grid.ProbeCountGrid(probe_counts)
+                finally:
+                    probe_count_grid.BOX_CHUNK_SIZE = chunk_size
+                np.testing.assert_array_equal(chunked._box_index,
+                                              grid._box_index)
+                np.testing.assert_array_equal(chunked._box_lo, grid._box_lo)
+                np.testing.assert_array_equal(chunked._box_hi, grid._box_hi)
+
+                # only the boxes that are chosen are kept
+                self.assertEqual(len(grid._box_lo),
+                                 len(np.unique(grid._box_index[
+                                     grid._box_index >= 0])))
@@ -0,0 +1,439 @@
+"""Tests that FASTA parsing with dnaio and in pure Python agree, both in
+seq_io itself and at the scripts that read FASTA files through it.
+
+Tests of the dnaio parser are skipped if dnaio is not installed, and
+tests of a script are skipped if one of its dependencies is not.
+"""
+
+import gzip
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+from collections import namedtuple
+
+import numpy as np
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'scripts'))
+import seq_io
+
+__author__ = 'Hayden Metsky <hayden@mit.edu>'
+
+
+def load_script(*path):
+    # import a script that is not in a package (e.g., because its
+    # directory name has a '-') as a module
+    path = os.path.join(REPO_DIR, *path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def parsers():
+    # values of seq_io.USE_FAST_PARSER to test: the pure-Python parser,
+    # and dnaio if it is installed
+    return [False, True] if seq_io.dnaio is not None else [False]
+
+
+def with_each_parser(fn):
+    # return a list of the results of fn() with each parser
+    results = []
+    try:
+        for use_fast_parser in parsers():
+            seq_io.USE_FAST_PARSER = use_fast_parser
+            results += [fn()]
+    finally:
+        seq_io.USE_FAST_PARSER = True
+    return results
+
+
+def write_bytes(path, data, compression=None):
+    if compression is None:
+        with open(path, 'wb') as f:
+            f.write(data)
+    elif compression == 'gzip':
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+    elif compression == 'bgzip':
+        with seq_io._BgzfWriter(path) as f:
+            f.write(data)
+    else:
+        raise ValueError("Unknown compression " + compression)
+
+
+# (FASTA content, expected records); sequences are given as str
+PARSE_CASES = {
+    'crlf': (b'>a desc\r\nACGT\r\nNNAC\r\n>b\r\nGG\r\n',
+             [('a desc', 'ACGTNNAC'), ('b', 'GG')]),
+    'blank_lines': (b'\n>a\nACGT\n\nAC\n\n>b\nGG\n\n\n',
+                    [('a', 'ACGTAC'), ('b', 'GG')]),
+    'empty_records': (b'>a\n>b\nACG\n>c\n',
+                      [('a', ''), ('b', 'ACG'), ('c', '')]),
+    'trailing_whitespace': (b'>a x  \nACGT  \nAC\t\n',
+                            [('a x', 'ACGTAC')]),
+    'no_final_newline': (b'>a\nACGT\n>b\nGG',
+                         [('a', 'ACGT'), ('b', 'GG')]),
+    'irregular_wrapping': (b'>a\nAC\nGTACGT\nA\n>b\nGGGGGGGG\nC\n',
+                           [('a', 'ACGTACGTA'), ('b', 'GGGGGGGGC')]),
+}
+
+
+class TestParserParity(unittest.TestCase):
+    """Tests that each parser gives the expected records, from plain,
+    gzip and bgzip input.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_case(self, name, data, compression):
+        path = os.path.join(self.tmp_dir.name,
+                            name + '.' + str(compression) + '.fasta')
+        write_bytes(path, data, compression)
+        return path
+
+    def test_records(self):
+        for name, (data, expected) in PARSE_CASES.items():
+            for compression in [None, 'gzip', 'bgzip']:
+                with self.subTest(case=name, compression=compression):
+                    path = self.write_case(name, data, compression)
+                    for records in with_each_parser(lambda: list(
+                            seq_io.iterate_fasta_records(path))):
+                        self.assertEqual(records, expected)
+
+    def test_headers(self):
+        for name, (data, expected) in PARSE_CASES.items():
+            with self.subTest(case=name):
+                path = self.write_case(name, data, 'gzip')
+                self.assertEqual(list(seq_io.iterate_fasta_headers(path)),
+                                 [n for n, _ in expected])
+
+    def test_iterate_fasta_skips_empty_records(self):
+        data, expected = PARSE_CASES['empty_records']
+        path = self.write_case('empty_records', data, None)
+        for seqs in with_each_parser(lambda: list(
+                seq_io.iterate_fasta(path))):
+            self.assertEqual(seqs, [s for _, s in expected if s])
+
+    def test_replace_degenerate(self):
+        path = self.write_case('degenerate', b'>a\nacgtYRWSMKn\n', 'bgzip')
+        for records in with_each_parser(lambda: list(
+                seq_io.iterate_fasta_records(path,
+                                             replace_degenerate=True))):
+            self.assertEqual(records, [('a', 'acgtNNNNNNn')])
+
+    def test_data_types(self):
+        data, expected = PARSE_CASES['crlf']
+        path = self.write_case('crlf', data, 'gzip')
+        for data_type in ['np', 'encoded', 'packed']:
+            with self.subTest(data_type=data_type):
+                results = with_each_parser(lambda: seq_io.read_fasta(
+                    path, data_type=data_type))
+                for seqs in results:
+                    self.assertEqual(list(seqs.keys()),
+                                     [n for n, _ in expected])
+                    for name, seq in expected:
+                        if data_type == 'np':
+                            want = np.array(list(seq), dtype='S1')
+                            got = seqs[name]
+                        elif data_type == 'encoded':
+                            want = seq_io.encode_seq(seq)
+                            got = seqs[name]
+                        else:
+                            want = seq_io.encode_seq(seq)
+                            got = seq_io.unpack_2bit(seqs[name])
+                        np.testing.assert_array_equal(got, want)
+
+    def test_multiple_bgzf_blocks(self):
+        # more than one BGZF block (each up to 64 KB uncompressed)
+        rng = np.random.RandomState(1)
+        expected = []
+        lines = []
+        for i in range(40):
+            seq = ''.join(rng.choice(list('ACGTN'), size=5000))
+            expected += [('seq%d' % i, seq)]
+            lines += ['>seq%d' % i] + [seq[j:j + 60]
+                                       for j in range(0, len(seq), 60)]
+        data = ('\r\n'.join(lines) + '\r\n').encode()
+        path = self.write_case('blocks', data, 'bgzip')
+        for records in with_each_parser(lambda: list(
+                seq_io.iterate_fasta_records(path))):
+            self.assertEqual(records, expected)
+
+    @unittest.skipIf(seq_io.dnaio is None, "dnaio is not installed")
+    def test_fast_parser_is_used(self):
+        # the parity tests above only compare both parsers if dnaio is
+        # used when it is installed
+        self.assertEqual(parsers(), [False, True])
+        self.assertTrue(seq_io.USE_FAST_PARSER)
+
+
+class TestSequenceHelpers(unittest.TestCase):
+    """Tests the helpers in seq_io that operate on encoded sequences.
+    """
+
+    def test_reverse_complement(self):
+        for seq, rc in [('ACGT', 'ACGT'), ('AACGN', 'NCGTT'),
+                        ('RYKMSWBDHV-', '-BDHVWSKMRY'), ('acgu', 'ACGT'),
+                        ('', '')]:
+            codes = seq_io.encode_seq(seq)
+            self.assertEqual(
+                seq_io.decode_seq(seq_io.reverse_complement(codes)), rc)
+
+    def test_gc_fraction(self):
+        for seq, frac in [('ACGT', 0.5), ('GGCC', 1.0), ('AATTN', 0.0),
+                          ('GcNNs', 0.4), ('', 0.0)]:
+            self.assertEqual(seq_io.gc_fraction(seq_io.encode_seq(seq)),
+                             frac)
+
+
+class TestReadProbeSeqs(unittest.TestCase):
+    """Tests analyze_probe_sequence_composition.read_probe_seqs.
+    """
+
+    def setUp(self):
+        try:
+            import plotly.plotly
+        except ImportError:
+            self.skipTest("plotly.plotly is not installed")
+        self.module = load_script('scripts',
+                                  'analyze_probe_sequence_composition.py')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'probes.fasta')
+        write_bytes(self.path,
+                    b'>probe_1 | virus A\r\nAAAAACGTACGTTTTTT\r\n\r\n'
+                    b'>probe_2 | virus B\r\nAAAAAGGGG\r\n'
+                    b'>probe_3 | reverse complement of probe_2\r\n'
+                    b'CCCCTTTTT\r\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_args(self, skip_adapters, skip_rc):
+        Args = namedtuple('Args', ['probe_seqs', 'skip_adapters', 'adapters',
+                                   'skip_reverse_complement_probes'])
+        return Args(self.path, skip_adapters, ['AAAAA', 'TTTTT'], skip_rc)
+
+    def test_without_adapters(self):
+        args = self.make_args(True, True)
+        for probe_seqs in with_each_parser(
+                lambda: self.module.read_probe_seqs(args)):
+            self.assertEqual(probe_seqs, {'probe_1': 'CGTACGT',
+                                          'probe_2': 'GGGG'})
+
+    def test_with_adapters_and_reverse_complements(self):
+        args = self.make_args(False, False)
+        for probe_seqs in with_each_parser(
+                lambda: self.module.read_probe_seqs(args)):
+            self.assertEqual(probe_seqs, {'probe_1': 'AAAAACGTACGTTTTTT',
+                                          'probe_2': 'AAAAAGGGG',
+                                          'probe_3': 'CCCCTTTTT'})
+
+    def test_multiline_records(self):
+        # the sequence lines of a record are joined; before seq_io was
+        # used, each line was read as the whole probe, so only the last
+        # line of a record was kept
+        write_bytes(self.path,
+                    b'>probe_1 | virus A\nAAAAACGTAC\nGTTTTTT\n'
+                    b'>probe_2 | virus B\nGG\nGG\n')
+        args = self.make_args(True, False)
+        for probe_seqs in with_each_parser(
+                lambda: self.module.read_probe_seqs(args)):
+            self.assertEqual(probe_seqs, {'probe_1': 'CGTACGT',
+                                          'probe_2': 'GGGG'})
+
+
+class TestProbeComposition(unittest.TestCase):
+    """Tests the GC content and hairpin calculations of
+    analyze_probe_sequence_composition.
+    """
+
+    def setUp(self):
+        try:
+            import plotly.plotly
+        except ImportError:
+            self.skipTest("plotly.plotly is not installed")
+        self.module = load_script('scripts',
+                                  'analyze_probe_sequence_composition.py')
+
+    def test_gc_content_hist(self):
+        seqs = ['ACGT', 'GGCC', 'AATT', 'GCAT']
+        scatter = self.module.create_gc_content_hist(seqs, 'probes',
+                                                     bin_size=0.25)
+        self.assertEqual(list(scatter['y']), [0.25, 0.0, 0.5, 0.25])
+
+    def test_hairpin_fraction(self):
+        # 'AACG' appears in every foreground probe, but only the first two
+        # also contain its reverse complement, 'CGTT'
+        foreground = ['AACGTT', 'AACGGGCGTT', 'AACGAAAA', 'AACGCCCC']
+        background = foreground + ['GGGGGGGG'] * 20
+        significant = self.module.find_significant_kmers_by_probe(
+            foreground, background, k=4, alpha=1.1)
+        hairpin = {kmer: frac_hairpin
+                   for kmer, _, _, frac_hairpin in significant}
+        self.assertEqual(hairpin['AACG'], 0.5)
+
+
+class TestDetermineDatasetStats(unittest.TestCase):
+    """Tests determine_dataset_stats.py.
+    """
+
+    def setUp(self):
+        self.module = load_script('scripts', 'determine_dataset_stats.py')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_duplicate_headers_are_counted(self):
+        # every record is counted, even if its header repeats; reading
+        # into a dict (as before seq_io streamed records) kept only the
+        # last record with each header
+        write_bytes(os.path.join(self.data_dir, 'a.fasta'),
+                    b'>x\nACGT\n>x\nAC\n>y\nGGGGGGGGG\n')
+        write_bytes(os.path.join(self.data_dir, 'b.fasta.gz'),
+                    b'>x\nACGT\n>x\nAC\n', 'gzip')
+        os.makedirs(os.path.join(self.data_dir, 'seg'))
+        write_bytes(os.path.join(self.data_dir, 'seg', 'g1.fasta'),
+                    b'>s\nAAAA\n>s\nCC\n')
+        write_bytes(os.path.join(self.data_dir, 'seg', 'g2.fasta'),
+                    b'>t\nGGGGGG\n')
+
+        for stats in with_each_parser(
+                lambda: self.module.compute_dataset_stats(self.data_dir)):
+            self.assertEqual(stats, {'a': (3, 3, 5.0),
+                                     'b': (2, 2, 3.0),
+                                     'seg': (2, 3, 4.0)})
+
+
+class TestRemoveLtr(unittest.TestCase):
+    """Tests remove_ltr.py on an aligned HIV-1 FASTA.
+    """
+
+    def setUp(self):
+        self.module = load_script('input-data-processing',
+                                  'remove-ltr-from-hiv', 'remove_ltr.py')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        # an alignment whose reference has enough non-gap bases to
+        # contain both LTRs
+        rng = np.random.RandomState(2)
+        alphabet = list('ACGTACGTACGTACGT-')
+        length = 11000
+        self.seqs = [('ref | reference', ''.join(rng.choice(alphabet,
+                                                            size=length)))]
+        for i in range(3):
+            self.seqs += [('genome%d' % i,
+                           ''.join(rng.choice(alphabet, size=length)))]
+
+        ref = self.seqs[0][1]
+        nongap_idx = [i for i, b in enumerate(ref) if b != '-']
+        ltr_5_end = nongap_idx[self.module.HIV1_LTR5_COORDS[1] - 1] + 1
+        ltr_3_start = nongap_idx[self.module.HIV1_LTR3_COORDS[0]]
+        self.expected = [(name, seq[ltr_5_end:ltr_3_start].replace('-', ''))
+                         for name, seq in self.seqs]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_alignment(self, fn, compression):
+        # write the alignment with lines of irregular lengths (which
+        # cannot be indexed) and CRLF line endings
+        lines = []
+        for name, seq in self.seqs:
+            lines += ['>' + name, seq[:61], seq[61:5000], seq[5000:]]
+        path = os.path.join(self.tmp_dir.name, fn)
+        write_bytes(path, ('\r\n'.join(lines) + '\r\n').encode(),
+                    compression)
+        return path
+
+    def run_remove_ltr(self, in_path):
+        Args = namedtuple('Args', ['i', 'o', 's'])
+        out_path = os.path.join(self.tmp_dir.name, 'out.fasta')
+        self.module.main(Args(in_path, out_path, 'hiv1'))
+        return list(seq_io.iterate_fasta_records(out_path))
+
+    def test_remove_ltr(self):
+        for fn, compression in [('aln.fasta', None),
+                                ('aln.fasta.gz', 'gzip'),
+                                ('aln.bgz.fasta.gz', 'bgzip')]:
+            with self.subTest(compression=compression):
+                in_path = self.write_alignment(fn, compression)
+                for records in with_each_parser(
+                        lambda: self.run_remove_ltr(in_path)):
+                    self.assertEqual(records, self.expected)
+
+
+class TestMergeWithExtraSequences(unittest.TestCase):
+    """Tests merge_with_extra_sequences in the genome downloader.
+    """
+
+    def setUp(self):
+        try:
+            import Bio
+        except ImportError:
+            self.skipTest("Biopython is not installed")
+        self.module = load_script('download-genbank-viral-genomes',
+                                  'download_dataset_fastas.py')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.write_dir = os.path.join(self.tmp_dir.name, 'data')
+        os.makedirs(self.write_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def merge(self, extra_path, is_segmented, present=()):
+        Dataset = namedtuple('Dataset', ['name'])
+        Sequence = namedtuple('Sequence', ['name'])
+        return self.module.merge_with_extra_sequences(Dataset('ds'),
+            [Sequence(name) for name in present], extra_path, is_segmented,
+            self.write_dir)
+
+    def test_segmented(self):
+        extra_dir = os.path.join(self.tmp_dir.name, 'extra')
+        os.makedirs(extra_dir)
+        # one genome is new; sequence lines have irregular lengths, which
+        # should be copied as is
+        with open(os.path.join(extra_dir, 'g1.fasta'), 'w') as f:
+            f.write('>gi|1|gb|AB1.1|segment L, complete\n'
+                    'ACGTACGTAC\nGT\n'
+                    '>gi|2|gb|AB2.1|segment S, complete [segment S]\n'
+                    'GGGG\n')
+        # another is already present
+        with open(os.path.join(extra_dir, 'g2.fasta'), 'w') as f:
+            f.write('>gi|3|gb|AB3.1|segment L, complete\nTTTT\n')
+
+        expected = ('>gi|1|gb|AB1.1|segment L, complete [segment L]\n'
+                    'ACGTACGTAC\nGT\n'
+                    '>gi|2|gb|AB2.1|segment S, complete [segment S]\n'
+                    'GGGG\n')
+        for added in with_each_parser(lambda: self.merge(extra_dir, True,
+                                                         present=['AB3'])):
+            self.assertEqual(added, (2, 1))
+            with open(os.path.join(self.write_dir, 'g1.fasta')) as f:
+                self.assertEqual(f.read(), expected)
+            self.assertFalse(os.path.exists(os.path.join(self.write_dir,
+                                                         'g2.fasta')))
+
+    def test_unsegmented(self):
+        extra_path = os.path.join(self.tmp_dir.name, 'extra.fasta')
+        with open(extra_path, 'w') as f:
+            f.write('>gi|1|gb|AB1.1| genome\nACGTACGTAC\nGT\n'
+                    '>gi|2|gb|AB2.1| genome\nGGGG\n')
+        out_path = os.path.join(self.write_dir, 'ds.fasta')
+        with open(out_path, 'w') as f:
+            f.write('>gi|2|gb|AB2.1| genome\nGGGG\n')
+
+        self.assertEqual(self.merge(extra_path, False, present=['AB2']),
+                         (1, 1))
+        with open(out_path) as f:
+            self.assertEqual(f.read(), '>gi|2|gb|AB2.1| genome\nGGGG\n\n'
+                             '>gi|1|gb|AB1.1| genome\nACGTACGTAC\nGT\n')